@@ -33,6 +33,9 @@ def run(app):
     options = {
         "bind": "%s:%s" % (cfg.ADDRESS, cfg.PORT),
         "workers": number_of_workers(),
+        # Threads, so the event streams do not take the whole worker
+        "worker_class": "gthread",
+        "threads": cfg.WORKER_THREADS,
         "keyfile": cfg.KEYFILE,  # 'certs/server.key',
         "certfile": cfg.CERTFILE,  # 'certs/server.crt',
         "ca-certs": cfg.CACERTS,  # 'certs/ca-crt.pem',
@@ -3,11 +3,14 @@ import os
 import connexion
 from connexion import FlaskApp
 from flask_marshmallow import Marshmallow
-from flask_sqlalchemy import SQLAlchemy
 
 from .config import config_by_name, basedir
+from .util.encoding import check_compression, compress_response, get_api_cls
+from .util.request_streams import StreamedRequest
+from .util.routing import RoutingSQLAlchemy
+from .util.validation import SampledResponseValidator
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 ma = Marshmallow()
 cfg = config_by_name[os.getenv("CLS_ENV") or "dev"]
 logger = None
@@ -22,12 +25,23 @@ def create_app() -> FlaskApp:
 
     # Get the underlying Flask app instance
     app = connex_app.app
+    app.request_class = StreamedRequest
 
     app.config.from_object(cfg)
     db.init_app(app)
     ma.init_app(app)
     logger = app.logger
 
-    connex_app.add_api("swagger.yml", strict_validation=True, validate_responses=True)
+    # After the logger is set up, so missing optional libraries are reported at startup
+    connex_app.api_cls = get_api_cls(cfg.JSON_PROVIDER)
+    check_compression(cfg.COMPRESSION)
+    app.after_request(compress_response)
+
+    connex_app.add_api(
+        "swagger.yml",
+        strict_validation=True,
+        validate_responses=True,
+        validator_map={"response": SampledResponseValidator},
+    )
 
     return connex_app
@@ -1,8 +1,20 @@
 import logging
 from datetime import date, time
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
 
 from calories.main import db
-from calories.main.models.models import User, Meal
+from calories.main.controller.helpers.users import user_records
+from calories.main.models.models import (
+    MEAL_FTS_INDEX,
+    MEAL_FTS_POSTGRESQL,
+    MEAL_FTS_SQLITE,
+    User,
+    Meal,
+)
+from calories.main.util.lru import clear_caches
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +40,11 @@ def build_db() -> None:
     db.create_all()
     logger.info("Created new database tables")
 
+    # The data versions start over, so results cached under them are stale, and
+    # the records shared with running workers may belong to dropped users
+    clear_caches()
+    user_records.clear()
+
     # Create admin user
     db.session.add(User(**ADMNIN_USER))
     logger.warning("Admin user has been created. Please remeber to change its password")
@@ -37,6 +54,87 @@ def build_db() -> None:
     logger.info("Database built successfully")
 
 
+def migrate_indexes() -> List[str]:
+    """Bring an existing database up to date with the models without dropping
+    anything: missing tables are created and missing columns and indexes are added
+    to the existing ones, new columns need a server default or to be nullable. On
+    Postgres indexes are built with CREATE INDEX CONCURRENTLY so
+    writes to the tables are not blocked, and the indexes of the models left invalid
+    by a failed concurrent build are dropped and built again. Invalid indexes of
+    other schemas, or not defined by the models, are left alone
+
+    :return: The names of the indexes created
+    """
+    db.create_all()
+    engine = db.get_engine()
+    postgresql = engine.dialect.name == "postgresql"
+    created = []
+
+    with engine.connect() as conn:
+        if postgresql:
+            # Concurrent builds cannot run inside a transaction
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            names = {
+                index.name
+                for table in db.metadata.sorted_tables
+                for index in table.indexes
+            }
+            invalid = conn.execute(
+                text(
+                    "SELECT n.nspname, c.relname FROM pg_index i "
+                    "JOIN pg_class c ON c.oid = i.indexrelid "
+                    "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                    "WHERE NOT i.indisvalid AND n.nspname = current_schema() "
+                    "AND c.relname = ANY(:names)"
+                ),
+                names=sorted(names | {MEAL_FTS_INDEX}),
+            ).fetchall()
+            preparer = engine.dialect.identifier_preparer
+            for schema, name in invalid:
+                conn.execute(
+                    f"DROP INDEX CONCURRENTLY IF EXISTS "
+                    f"{preparer.quote_schema(schema)}.{preparer.quote(name)}"
+                )
+                logger.warning(f"Invalid index '{schema}.{name}' dropped")
+
+        inspector = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                conn.execute(
+                    f"ALTER TABLE {engine.dialect.identifier_preparer.format_table(table)}"
+                    f" ADD COLUMN {CreateColumn(column).compile(dialect=engine.dialect)}"
+                )
+                logger.info(f"Column '{column.name}' added to '{table.name}'")
+
+            existing = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                if index.name in existing:
+                    continue
+                index.dialect_options["postgresql"]["concurrently"] = postgresql
+                try:
+                    conn.execute(CreateIndex(index))
+                finally:
+                    index.dialect_options["postgresql"]["concurrently"] = False
+                created.append(index.name)
+                logger.info(f"Index '{index.name}' created on '{table.name}'")
+
+        # The full-text search structures are created if they do not exist
+        if postgresql:
+            for statement in MEAL_FTS_POSTGRESQL:
+                conn.execute(
+                    text(statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY"))
+                )
+        elif engine.dialect.name == "sqlite":
+            for statement in MEAL_FTS_SQLITE:
+                conn.execute(text(statement))
+        logger.info("Full-text search index up to date")
+
+    return created
+
+
 def populate_db() -> None:
     """Populate the database using sample data"""
     users = [
@@ -1,14 +1,26 @@
 import os
+import tempfile
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def _replica_binds(hosts: str, template: str = "{}") -> dict:
+    """Binds of the read replicas given as a comma separated list, formatted with the
+    template into database URIs"""
+    return {
+        f"replica{i}": template.format(host)
+        for i, host in enumerate(h for h in hosts.split(",") if h)
+    }
+
+
 class Config:
     DEBUG = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SWAGGER_UI = False
     ADDRESS = os.getenv("CLS_ADDRESS", "0.0.0.0")
     PORT = os.getenv("CLS_PORT", "8080")
+    WORKER_THREADS = int(os.getenv("CLS_WORKER_THREADS", 32))
+    MAX_CONTENT_LENGTH = int(os.getenv("CLS_MAX_CONTENT_LENGTH", 64 * 1024 ** 2))
     TOKEN_SECRET_KEY = os.getenv("CLS_TOKEN_SECRET_KEY", "secret_string")
     TOKEN_LIFETIME_SECONDS = os.getenv("CLS_TOKEN_LIFETIME_SECONDS", 1800)
     NTX_BASE_URL = os.getenv("CLS_NTX_BASE_URL", "https://api.nutritionix.com/v1_1")
@@ -17,6 +29,40 @@ class Config:
     KEYFILE = os.getenv("CLS_KEYFILE", "certs/server.key")
     CERTFILE = os.getenv("CLS_CERTFILE", "certs/server.crt")
     CACERTS = os.getenv("CLS_CACERTS", "certs/ca-crt.pem")
+    RESPONSE_VALIDATION = os.getenv("CLS_RESPONSE_VALIDATION", "sampled")
+    RESPONSE_VALIDATION_RATE = float(os.getenv("CLS_RESPONSE_VALIDATION_RATE", 0.01))
+    JSON_PROVIDER = os.getenv("CLS_JSON_PROVIDER", "orjson")
+    COMPRESSION = os.getenv("CLS_COMPRESSION", "true").lower() == "true"
+    COMPRESSION_MIN_SIZE = int(os.getenv("CLS_COMPRESSION_MIN_SIZE", 1024))
+    QUERY_CACHE_MAX_ENTRIES = int(os.getenv("CLS_QUERY_CACHE_MAX_ENTRIES", 1024))
+    QUERY_CACHE_MAX_BYTES = int(os.getenv("CLS_QUERY_CACHE_MAX_BYTES", 32 * 1024 ** 2))
+    USER_CACHE_FILE = os.getenv(
+        "CLS_USER_CACHE_FILE",
+        os.path.join(
+            "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+            "calories_users",
+        ),
+    )
+    USER_CACHE_SLOTS = int(os.getenv("CLS_USER_CACHE_SLOTS", 4096))
+    USER_CACHE_TTL = float(os.getenv("CLS_USER_CACHE_TTL", 60))
+    DAY_CACHE_MAX_AGE = int(os.getenv("CLS_DAY_CACHE_MAX_AGE", 86400))
+    TRENDS_MAX_DAYS = int(os.getenv("CLS_TRENDS_MAX_DAYS", 20 * 366))
+    EVENTS_SOCKET_DIR = os.getenv("CLS_EVENTS_SOCKET_DIR")
+    EVENTS_HEARTBEAT = float(os.getenv("CLS_EVENTS_HEARTBEAT", 15))
+    EVENTS_MAX_STREAMS = int(os.getenv("CLS_EVENTS_MAX_STREAMS", 16))
+    OUTBOX_SINK = os.getenv(
+        "CLS_OUTBOX_SINK",
+        "file://" + os.path.join(tempfile.gettempdir(), "calories_outbox.ndjson"),
+    )
+    OUTBOX_BATCH_SIZE = int(os.getenv("CLS_OUTBOX_BATCH_SIZE", 500))
+    IDEMPOTENCY_KEY_TTL = int(os.getenv("CLS_IDEMPOTENCY_KEY_TTL", 86400))
+    IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("CLS_IDEMPOTENCY_LOCK_TIMEOUT", 60))
+    SQLALCHEMY_BINDS = _replica_binds(os.getenv("CLS_REPLICA_URIS", ""))
+    REPLICA_MAX_LAG = float(os.getenv("CLS_REPLICA_MAX_LAG", 5))
+    REPLICA_MARKS_FILE = os.getenv(
+        "CLS_REPLICA_MARKS_FILE",
+        os.path.join(os.path.dirname(USER_CACHE_FILE), "calories_writes"),
+    )
 
 
 class DevelopmentConfig(Config):
@@ -26,6 +72,7 @@ class DevelopmentConfig(Config):
     )
     SQLALCHEMY_ECHO = True
     SWAGGER_UI = True
+    RESPONSE_VALIDATION = "always"
 
 
 class TestingConfig(Config):
@@ -36,6 +83,9 @@ class TestingConfig(Config):
     )
     PRESERVE_CONTEXT_ON_EXCEPTION = False
     SQLALCHEMY_ECHO = False
+    RESPONSE_VALIDATION = "always"
+    USER_CACHE_FILE = os.path.join(tempfile.gettempdir(), "calories_users_test")
+    REPLICA_MARKS_FILE = os.path.join(tempfile.gettempdir(), "calories_writes_test")
 
 
 class ProductionConfig(Config):
@@ -47,6 +97,16 @@ class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = (
         f"postgresql+psycopg2://{_PG_USER}:{_PG_PWD}@{_PG_URL}/{_PG_DB}"
     )
+    SQLALCHEMY_BINDS = _replica_binds(
+        os.getenv("PG_REPLICA_URLS", ""),
+        f"postgresql+psycopg2://{_PG_USER}:{_PG_PWD}@{{}}/{_PG_DB}",
+    )
+    # A connection for every thread of the worker, and a second one for the
+    # threads running an atomic batch
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": Config.WORKER_THREADS,
+        "max_overflow": Config.WORKER_THREADS,
+    }
     SQLALCHEMY_ECHO = False
 
 
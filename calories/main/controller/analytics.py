@@ -0,0 +1,124 @@
+"""
+This is the analytics module and supports the REST actions that aggregate the meals
+"""
+
+from flask import abort
+
+from calories.main import logger
+from calories.main.controller import ResponseType
+from calories.main.controller.helpers import RequestError
+from calories.main.controller.helpers.analytics import (
+    get_fleet_analytics,
+    get_summary,
+    get_trends,
+)
+from calories.main.controller.helpers.auth import is_allowed
+from calories.main.controller.helpers.replicas import replica_reads
+from calories.main.models.models import Role
+
+
+@is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+@replica_reads
+def read_summary(
+        user: str, username: str, granularity: str = "day", **date_range: str
+) -> ResponseType:
+    """Read the calories of a given user per day, week or month
+
+    :param user: The user that requests the action
+    :param username: User to summarize his meals
+    :param granularity: Size of the buckets, either day, week or month
+    :param date_range: Query parameters 'from' and 'to', bounds of the summary,
+    they are keywords so they cannot be regular arguments
+    """
+    date_from, date_to = date_range.get("from"), date_range.get("to")
+    try:
+        data = get_summary(username, granularity, date_from, date_to)
+    except RequestError as e:
+        data = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(
+        f"User: '{user}', read summary for user: '{username}',"
+        f" granularity: '{granularity}', from: '{date_from}', to: '{date_to}'"
+    )
+
+    return (
+        {
+            "status": 200,
+            "title": "Success",
+            "detail": f"Summary succesfully read for user: '{username}'",
+            "data": data,
+        },
+        200,
+    )
+
+
+@is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+@replica_reads
+def read_trends(user: str, username: str, **date_range: str) -> ResponseType:
+    """Read the rolling averages, longest streak under the daily limit and day of
+    the week profile of a given user
+
+    :param user: The user that requests the action
+    :param username: User to read his trends
+    :param date_range: Query parameters 'from' and 'to', bounds of the trends,
+    they are keywords so they cannot be regular arguments
+    """
+    date_from, date_to = date_range.get("from"), date_range.get("to")
+    try:
+        data = get_trends(username, date_from, date_to)
+    except RequestError as e:
+        data = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(
+        f"User: '{user}', read trends for user: '{username}',"
+        f" from: '{date_from}', to: '{date_to}'"
+    )
+
+    return (
+        {
+            "status": 200,
+            "title": "Success",
+            "detail": f"Trends succesfully read for user: '{username}'",
+            "data": data,
+        },
+        200,
+    )
+
+
+@is_allowed(roles_allowed=[Role.MANAGER])
+@replica_reads
+def read_fleet_analytics(user: str, top: int = 10, **date_range: str) -> ResponseType:
+    """Read the analytics of all the users: users over their daily limit per day,
+    average daily calories per role and top consumers
+
+    :param user: The user that requests the action
+    :param top: Number of top consumers to return, defaults to 10
+    :param date_range: Query parameters 'from' and 'to', bounds of the analytics,
+    they are keywords so they cannot be regular arguments
+    """
+    date_from, date_to = date_range.get("from"), date_range.get("to")
+    try:
+        data = get_fleet_analytics(date_from, date_to, top)
+    except RequestError as e:
+        data = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(
+        f"User: '{user}', read analytics, from: '{date_from}', to: '{date_to}',"
+        f" top: '{top}'"
+    )
+
+    return (
+        {
+            "status": 200,
+            "title": "Success",
+            "detail": "Analytics succesfully read",
+            "data": data,
+        },
+        200,
+    )
@@ -3,7 +3,7 @@ This module supports all authentication actions
 """
 from typing import Dict
 
-from flask import abort
+from flask import abort, g
 from jose import JWTError, jwt
 
 from calories.main import cfg, logger
@@ -46,9 +46,18 @@ def login(body: RequestBodyType) -> ResponseType:
 
 
 def decode_token(token: str) -> Dict[str, str]:
-    """Decode the given token"""
+    """Decode the given token, once per application context, so the operations of
+    a batch, which share the context of the batch, do not decode it again"""
+    decoded = g.get("decoded_token")
+    if decoded is not None and decoded[0] == token:
+        return decoded[1]
+
     try:
-        return jwt.decode(token, cfg.TOKEN_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        info = jwt.decode(token, cfg.TOKEN_SECRET_KEY, algorithms=[JWT_ALGORITHM])
     except JWTError as e:
+        info = None
         logger.warning(f"Error decoding token: '{e}'")
         abort(401, "Invalid authentication token")
+    g.decoded_token = (token, info)
+
+    return info
@@ -0,0 +1,31 @@
+"""
+This is the batch module and supports running several REST actions in one request
+"""
+from calories.main import logger
+from calories.main.controller import ResponseType, RequestBodyType
+from calories.main.controller.helpers.batch import run_operations
+
+
+def run_batch(user: str, body: RequestBodyType) -> ResponseType:
+    """Run a list of operations of the API in one request
+
+    :param user: The user that requests the action
+    :param body: Operations to run and whether they run in a single transaction
+    :return: The responses of the operations run
+    """
+    operations = body["operations"]
+    data = run_operations(operations, body.get("atomic", False))
+
+    run = len(data["results"])
+    logger.info(f"User: '{user}' ran {run} of {len(operations)} operations in a batch")
+
+    return (
+        {
+            "status": 200,
+            "title": "Success",
+            "detail": f"{run} of {len(operations)} operations run"
+                      + (", all of them rolled back" if data["rolled_back"] else ""),
+            "data": data,
+        },
+        200,
+    )
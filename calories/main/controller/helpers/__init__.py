@@ -32,3 +32,8 @@ class NotFound(RequestError):
 class Conflict(RequestError):
     def __init__(self, message: str):
         super().__init__(message, 409)
+
+
+class ServiceUnavailable(RequestError):
+    def __init__(self, message: str):
+        super().__init__(message, 503)
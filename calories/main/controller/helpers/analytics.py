@@ -0,0 +1,282 @@
+"""
+This module contains helper functions to be used on the analytics endpoints
+"""
+import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Table, and_, case, desc, exists, select, true
+from sqlalchemy.orm import Query
+from sqlalchemy.sql import ClauseElement, func
+
+from calories.main import cfg, db
+from calories.main.controller.helpers import BadRequest
+from calories.main.controller.helpers.users import get_user_record
+from calories.main.models.models import DailyRollup, DirtyDay, Meal, User
+from calories.main.util import trends
+from calories.main.util.sql import date_bucket
+
+
+def get_summary(
+        username: str,
+        granularity: str,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Get the calories of a user per day, week or month. Everything is computed by
+    one grouped query over the (user_id, date) index, the daily totals are grouped
+    first so every bucket knows how many of its days went over the daily limit
+
+    :param username: Username of the user whose summary we need to get
+    :param granularity: Size of the buckets, either 'day', 'week' or 'month'
+    :param date_from: First date of the summary in ISO format, unbounded if not specified
+    :param date_to: Last date of the summary in ISO format, unbounded if not specified
+    :return: The buckets with meals, ordered by date
+    :raises NotFound: If the user does not exist
+    :raises BadRequest: If the dates are wrong
+    """
+    user = get_user_record(username)
+    date_from, date_to = _parse_range(date_from, date_to)
+
+    days = _daily_totals(user, date_from, date_to).subquery()
+
+    bucket = date_bucket(granularity, days.c.date)
+    over_limit = case([(days.c.calories >= user.daily_calories, 1)], else_=0)
+    buckets = (
+        db.session.query(
+            bucket.label("date"),
+            func.sum(days.c.calories),
+            func.sum(days.c.meals),
+            func.count(),
+            func.sum(over_limit),
+        )
+            .group_by(bucket)
+            .order_by(bucket)
+    )
+
+    return [
+        {
+            "date": date.isoformat(),
+            "calories": int(calories),
+            "meals": int(meals),
+            "days": days_count,
+            "days_over_limit": int(days_over_limit),
+            "over_limit": days_over_limit > 0,
+        }
+        for date, calories, meals, days_count, days_over_limit in buckets
+    ]
+
+
+def get_trends(
+        username: str, date_from: Optional[str] = None, date_to: Optional[str] = None
+) -> Dict[str, Any]:
+    """Get the 7 and 30 day rolling averages of the calories of a user, his longest
+    streak of days under the daily limit and his average per day of the week. The
+    daily totals are read with one grouped query and the rest is computed over
+    NumPy arrays with a position for every day of the range, so the range can be
+    at most TRENDS_MAX_DAYS long
+
+    :param username: Username of the user whose trends we need to get
+    :param date_from: First date of the trends in ISO format, first day with meals
+    if not specified
+    :param date_to: Last date of the trends in ISO format, last day with meals if
+    not specified
+    :return: The trends of the user
+    :raises NotFound: If the user does not exist
+    :raises BadRequest: If the dates are wrong or the range is too long
+    """
+    user = get_user_record(username)
+    date_from, date_to = _parse_range(date_from, date_to)
+    if None not in (date_from, date_to):
+        _check_length(date_from, date_to)
+
+    totals = _daily_totals(user, date_from, date_to).order_by(Meal.date).all()
+    if not totals:
+        return {"daily": [], "longest_streak": None, "weekdays": []}
+    dates, calories, _ = zip(*totals)
+
+    start, end = date_from or dates[0], date_to or dates[-1]
+    _check_length(start, end)
+    days, calories, logged = trends.daily_series(dates, calories, start, end)
+    streak = trends.longest_streak(logged & (calories < user.daily_calories))
+
+    return {
+        "daily": [
+            {"date": day, "calories": total, "average_7": avg_7, "average_30": avg_30}
+            for day, total, avg_7, avg_30 in zip(
+                np.datetime_as_string(days).tolist(),
+                calories.tolist(),
+                trends.to_list(trends.rolling_average(calories, logged, 7)),
+                trends.to_list(trends.rolling_average(calories, logged, 30)),
+            )
+        ],
+        "longest_streak": None
+        if streak is None
+        else {
+            "from": str(days[streak[0]]),
+            "to": str(days[streak[1]]),
+            "days": streak[1] - streak[0] + 1,
+        },
+        "weekdays": trends.weekday_profile(days, calories, logged),
+    }
+
+
+def get_fleet_analytics(
+        date_from: Optional[str] = None, date_to: Optional[str] = None, top: int = 10
+) -> Dict[str, Any]:
+    """Get the number of users over their daily limit per day, the average daily
+    calories per role and the users with the most calories. It is read from the
+    daily rollups, so it does not depend on the size of the meals table but it only
+    reflects the meals as they were when the rollups were last refreshed
+
+    :param date_from: First date analyzed in ISO format, unbounded if not specified
+    :param date_to: Last date analyzed in ISO format, unbounded if not specified
+    :param top: Number of users with the most calories to return
+    :return: The analytics of all the users
+    :raises BadRequest: If the dates are wrong
+    """
+    date_from, date_to = _parse_range(date_from, date_to)
+
+    rollups = db.session.query(DailyRollup).join(User, User.id == DailyRollup.user_id)
+    if date_from is not None:
+        rollups = rollups.filter(DailyRollup.date >= date_from)
+    if date_to is not None:
+        rollups = rollups.filter(DailyRollup.date <= date_to)
+
+    over_limit = (
+        rollups.filter(DailyRollup.calories >= User.daily_calories)
+            .with_entities(DailyRollup.date, func.count())
+            .group_by(DailyRollup.date)
+            .order_by(DailyRollup.date)
+    )
+    roles = (
+        rollups.with_entities(
+            User.role,
+            func.avg(DailyRollup.calories),
+            func.count(func.distinct(DailyRollup.user_id)),
+        )
+            .group_by(User.role)
+            .order_by(User.role)
+    )
+    total = func.sum(DailyRollup.calories).label("total")
+    consumers = (
+        rollups.with_entities(User.username, total, func.count())
+            .group_by(User.id, User.username)
+            .order_by(desc(total), User.username)
+            .limit(top)
+    )
+
+    return {
+        "over_limit_users": [
+            {"date": date.isoformat(), "users": users} for date, users in over_limit
+        ],
+        "average_per_role": [
+            {"role": role.value, "average": round(float(average), 2), "users": users}
+            for role, average, users in roles
+        ],
+        "top_consumers": [
+            {"username": username, "calories": int(calories), "days": days}
+            for username, calories, days in consumers
+        ],
+        "pending_changes": db.session.query(func.count(DirtyDay.id)).scalar(),
+    }
+
+
+def refresh_rollups(full: bool = False) -> int:
+    """Bring the daily rollups up to date with the meals. Only the days marked as
+    dirty are recomputed, each of them with set-based statements over the
+    (user_id, date) index of the meals, and their marks are then removed. Days
+    marked while the refresh runs are left for the next one
+
+    :param full: Rebuild the rollups of every day instead of just the dirty ones
+    :return: The number of days with meals written to the rollups
+    """
+    rollup, dirty, meal = DailyRollup.__table__, DirtyDay.__table__, Meal.__table__
+    last = db.session.query(func.max(DirtyDay.id)).scalar()
+    if last is None and not full:
+        return 0
+
+    def is_dirty(table: Table) -> ClauseElement:
+        if full:
+            return true()
+        return exists().where(
+            and_(
+                dirty.c.user_id == table.c.user_id,
+                dirty.c.date == table.c.date,
+                dirty.c.id <= last,
+            )
+        )
+
+    db.session.execute(rollup.delete().where(is_dirty(rollup)))
+    days = (
+        select(
+            [
+                meal.c.user_id,
+                meal.c.date,
+                func.coalesce(func.sum(meal.c.calories), 0),
+                func.count(meal.c.id),
+            ]
+        )
+            .where(and_(meal.c.user_id.isnot(None), is_dirty(meal)))
+            .group_by(meal.c.user_id, meal.c.date)
+    )
+    count = db.session.execute(
+        rollup.insert().from_select(["user_id", "date", "calories", "meals"], days)
+    ).rowcount
+    if last is not None:
+        db.session.execute(dirty.delete().where(dirty.c.id <= last))
+    db.session.commit()
+
+    return count
+
+
+def _daily_totals(
+        user: User,
+        date_from: Optional[datetime.date],
+        date_to: Optional[datetime.date],
+) -> Query:
+    """Query for the date, calories and number of meals of every day with meals of
+    a user, grouped over the (user_id, date) index"""
+    days = db.session.query(
+        Meal.date.label("date"),
+        func.coalesce(func.sum(Meal.calories), 0).label("calories"),
+        func.count(Meal.id).label("meals"),
+    ).filter(Meal.user_id == user.id)
+    if date_from is not None:
+        days = days.filter(Meal.date >= date_from)
+    if date_to is not None:
+        days = days.filter(Meal.date <= date_to)
+
+    return days.group_by(Meal.date)
+
+
+def _parse_range(
+        date_from: Optional[str], date_to: Optional[str]
+) -> Tuple[Optional[datetime.date], Optional[datetime.date]]:
+    """Parse the bounds of a range of dates
+
+    :raises BadRequest: If any of the dates is wrong or the range is empty
+    """
+    try:
+        bounds = tuple(
+            None if d is None else datetime.date.fromisoformat(d)
+            for d in (date_from, date_to)
+        )
+    except ValueError as e:
+        raise BadRequest(f"Wrong date: {e}")
+    if None not in bounds and bounds[0] > bounds[1]:
+        raise BadRequest(f"Date 'from': '{date_from}' is after date 'to': '{date_to}'")
+
+    return bounds
+
+
+def _check_length(start: datetime.date, end: datetime.date):
+    """Check that a range of dates is not longer than TRENDS_MAX_DAYS
+
+    :raises BadRequest: If the range is too long
+    """
+    if (end - start).days >= cfg.TRENDS_MAX_DAYS:
+        raise BadRequest(
+            f"Range from '{start}' to '{end}' is longer than {cfg.TRENDS_MAX_DAYS} days, "
+            f"use 'from' and 'to' to narrow it"
+        )
@@ -11,7 +11,7 @@ from werkzeug.security import check_password_hash
 
 from calories.main import cfg, logger
 from calories.main.controller.helpers import Unauthorized, RequestError
-from calories.main.controller.helpers.users import _get_user
+from calories.main.controller.helpers.users import _get_user, get_user_record
 from calories.main.models.models import Role
 
 JWT_ALGORITHM = "HS256"
@@ -77,7 +77,7 @@ def is_allowed(
             if roles_allowed is None:
                 roles_allowed = []
 
-            user = _get_user(kwargs["user"])
+            user = get_user_record(kwargs["user"])
 
             # Admin can do everything
             if user.role == Role.ADMIN:
@@ -0,0 +1,86 @@
+"""
+This module contains helper functions to be used on the batch endpoint
+"""
+from typing import Any, Dict, List
+
+from flask import current_app, request
+
+from calories.main import db
+from calories.main.controller import RequestBodyType
+from calories.main.util.sql import single_transaction
+
+BATCH_PATH = "/batch"
+
+
+def run_operations(
+        operations: List[RequestBodyType], atomic: bool = False
+) -> Dict[str, Any]:
+    """Run a list of operations of the API in order, each of them dispatched to its
+    endpoint as a request of its own with the Authorization header of the batch,
+    so they are validated and authorized as usual while the token is only decoded
+    once. The operations are independent unless atomic is set, then they run in a
+    single transaction and the first one that fails rolls back all of them and
+    stops the batch
+
+    :param operations: Operations with their 'method', 'path' relative to the API,
+    and optional 'body' and 'headers'
+    :param atomic: Run the operations in a single transaction
+    :return: The status and body of the response of every operation run and
+    whether the operations were rolled back
+    """
+    if not atomic:
+        results = []
+        for operation in operations:
+            result = _run_operation(operation)
+            if result["status"] >= 400:
+                # Leave the session clean for the next operations
+                db.session.rollback()
+            results.append(result)
+        return {"results": results, "rolled_back": False}
+
+    results = []
+    rolled_back = False
+    with single_transaction() as transaction:
+        for operation in operations:
+            result = _run_operation(operation)
+            results.append(result)
+            if result["status"] >= 400:
+                transaction.rollback()
+                rolled_back = True
+                break
+
+    return {"results": results, "rolled_back": rolled_back}
+
+
+def _run_operation(operation: RequestBodyType) -> Dict[str, Any]:
+    """Dispatch an operation to its endpoint and get the status and body of the
+    response, errors are given as responses too"""
+    path = operation["path"]
+    if path.split("?")[0].rstrip("/") == BATCH_PATH:
+        return _bad_request("Batches cannot be nested")
+
+    base = request.path[: -len(BATCH_PATH)]
+    headers = {
+        **operation.get("headers", {}),
+        "Authorization": request.headers["Authorization"],
+    }
+    kwargs = {"json": operation["body"]} if "body" in operation else {}
+
+    with current_app.test_request_context(
+            base + path, method=operation["method"], headers=headers, **kwargs
+    ):
+        response = current_app.full_dispatch_request()
+
+    if response.is_streamed:
+        response.close()
+        return _bad_request("Streamed responses are not supported in batches")
+
+    return {"status": response.status_code, "body": response.get_json(silent=True)}
+
+
+def _bad_request(detail: str) -> Dict[str, Any]:
+    """Result of an operation that cannot be run in a batch"""
+    return {
+        "status": 400,
+        "body": {"status": 400, "title": "Bad Request", "detail": detail},
+    }
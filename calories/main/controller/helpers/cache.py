@@ -0,0 +1,93 @@
+"""
+This module contains helper functions to answer requests without reading again data
+the client already has
+"""
+import datetime
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Response, request
+from werkzeug.http import quote_etag
+
+from calories.main import cfg
+from calories.main.controller.helpers import RequestError
+from calories.main.controller.helpers.meals import get_day_tag
+from calories.main.controller.helpers.users import get_data_tag
+from calories.main.util.encoding import CONTENT_ENCODINGS
+
+
+def conditional(func):
+    """Decorate a read endpoint of the data of a user, given by the 'username'
+    argument, to answer conditional requests. Responses carry an ETag made of the
+    id and data version of the user and the request, so a request whose
+    If-None-Match matches it is answered with a 304 after looking up just the
+    data version. It has to be applied after is_allowed so permissions are always
+    checked
+
+    :return: The endpoint that decorates
+    """
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        tag = get_data_tag(kwargs["username"])
+        if tag is None:
+            return func(*args, **kwargs)
+
+        etag = _make_etag(tag)
+        headers = {"ETag": quote_etag(etag, weak=True)}
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+
+        body, status = func(*args, **kwargs)
+        return body, status, headers
+
+    return wrapped
+
+
+def conditional_day(func):
+    """Decorate a read endpoint of the meals of a user on a day, given by the
+    'username' and 'date' arguments, to answer conditional requests with strong
+    ETags made of the version of the day. Days before yesterday, in any time zone,
+    are unlikely to change, so clients and proxies may keep them for DAY_CACHE_MAX_AGE
+    seconds, while more recent days have to be revalidated every time. It has to be
+    applied after is_allowed so permissions are always checked
+
+    :return: The endpoint that decorates
+    """
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        try:
+            tag = get_day_tag(kwargs["username"], kwargs["date"])
+        except RequestError:
+            return func(*args, **kwargs)
+
+        day = datetime.date.fromisoformat(kwargs["date"])
+        if day < datetime.date.today() - datetime.timedelta(days=1):
+            cache_control = f"public, max-age={cfg.DAY_CACHE_MAX_AGE}"
+        else:
+            cache_control = "no-cache"
+        # Proxies keep a copy per token, as the response depends on permissions
+        headers = {"Cache-Control": cache_control, "Vary": "Authorization"}
+
+        etag = _make_etag(tag)
+        # Compressed responses have the encoding appended to their ETag
+        for candidate in [etag, *(f"{etag}-{e}" for e in CONTENT_ENCODINGS)]:
+            if request.if_none_match.contains_weak(candidate):
+                headers["ETag"] = quote_etag(candidate)
+                return Response(status=304, headers=headers)
+
+        headers["ETag"] = quote_etag(etag)
+        body, status = func(*args, **kwargs)
+        return body, status, headers
+
+    return wrapped
+
+
+def _make_etag(tag: str) -> str:
+    """Make the ETag for the current request on data with the given tag"""
+    query = urlencode(sorted(request.args.items(multi=True)))
+    digest = hashlib.sha1(f"{request.path}?{query}".encode()).hexdigest()
+
+    return f"{tag}-{digest[:16]}"
@@ -0,0 +1,84 @@
+"""
+This module contains helper functions to be used on the events endpoints
+"""
+import json
+import threading
+from typing import Callable, Iterator
+
+from calories.main import cfg, db
+from calories.main.controller.helpers import RequestError, ServiceUnavailable
+from calories.main.controller.helpers.meals import get_meal_changes, get_sync_cursor
+from calories.main.controller.helpers.users import get_user_record
+from calories.main.util.changes import broker
+
+# Every stream holds a thread of the worker while it is open
+streams = threading.BoundedSemaphore(cfg.EVENTS_MAX_STREAMS)
+
+
+def stream_meal_events(
+        username: str, cursor: str = None, heartbeat: float = 15
+) -> Iterator[str]:
+    """Stream the changes of the meals of a user as Server-Sent Events. Every event
+    carries the changes of the meals since the previous one, as returned by
+    get_meal_changes, with its cursor as id so clients can resume from it. The
+    changes are read when the broker notifies a write to the meals of the user and
+    every heartbeat, when a comment is sent to keep the connection alive, so writes
+    made on processes that do not share the broker are sent too
+
+    :param username: Username of the user owner of the meals
+    :param cursor: Cursor of a previous sync or event to send the changes since,
+    only the changes from now on are sent if not given
+    :param heartbeat: Seconds between reads of the changes without notifications
+    :return: An iterator on the events
+    :raises NotFound: If the user does not exist
+    :raises BadRequest: If the cursor is invalid
+    """
+    user = get_user_record(username)
+    if cursor is None:
+        cursor = get_sync_cursor(username)
+    else:
+        get_meal_changes(username, cursor)
+
+    return _stream_events(username, user.id, cursor, heartbeat)
+
+
+def open_stream() -> Callable[[], None]:
+    """Take one of the EVENTS_MAX_STREAMS streams a worker can have open at once,
+    so they do not take all its threads
+
+    :return: Function that gives the stream back, to call once it is closed
+    :raises ServiceUnavailable: If the worker has all its streams open
+    """
+    if not streams.acquire(blocking=False):
+        raise ServiceUnavailable("Too many event streams open, try again later")
+
+    return streams.release
+
+
+def _stream_events(
+        username: str, user_id: int, cursor: str, heartbeat: float
+) -> Iterator[str]:
+    """Send the changes of the meals of a user as they happen, until the client
+    disconnects or the user is deleted. The subscription is only taken once the
+    stream starts, so responses that are never sent leave nothing behind"""
+    subscription = broker.subscribe(str(user_id))
+    try:
+        yield ": connected\n\n"
+        # Read after subscribing so no write is missed in between
+        changes = get_meal_changes(username, cursor)
+        while True:
+            if changes["upserts"] or changes["deletes"]:
+                data = json.dumps(changes, separators=(",", ":"))
+                yield f"event: meals\nid: {changes['cursor']}\ndata: {data}\n\n"
+
+            # No transaction is kept open while waiting
+            db.session.close()
+            if not subscription.wait(heartbeat):
+                yield ": keep-alive\n\n"
+
+            try:
+                changes = get_meal_changes(username, changes["cursor"])
+            except RequestError:
+                return
+    finally:
+        subscription.close()
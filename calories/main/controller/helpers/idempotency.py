@@ -0,0 +1,179 @@
+"""
+This module contains helper functions to answer repeated creation requests with the
+response given to the first one instead of creating the resource again
+"""
+import datetime
+import hashlib
+import json
+from functools import wraps
+from typing import Any, Dict, Optional, Tuple
+
+from flask import abort, request
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from calories.main import cfg, db, logger
+from calories.main.controller.helpers import Conflict, RequestError
+from calories.main.models.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+
+def idempotent(func):
+    """Decorate a creation endpoint so requests with an Idempotency-Key header are
+    processed once per user and key. Repeated requests with the same key, like
+    retries after a timeout, get the response of the first one without doing any
+    work, for IDEMPOTENCY_KEY_TTL seconds. Failed requests release their key so they
+    can be retried, and requests that never finish, like those of a killed worker,
+    hold it for IDEMPOTENCY_LOCK_TIMEOUT seconds at most. It has to be applied after
+    is_allowed so permissions are always checked
+
+    :return: The endpoint that decorates
+    """
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return func(*args, **kwargs)
+
+        user = kwargs["user"]
+        try:
+            stored = reserve_key(user, key, _fingerprint())
+        except RequestError as e:
+            stored = None
+            logger.warning(e.message)
+            abort(e.code, e.message)
+
+        if stored is not None:
+            logger.info(f"User: '{user}' repeated request with key: '{key}'")
+            body, status = stored
+            return body, status, {"Idempotent-Replayed": "true"}
+
+        try:
+            body, status = func(*args, **kwargs)
+        except Exception:
+            release_key(user, key)
+            raise
+        store_response(user, key, body, status)
+
+        return body, status
+
+    return wrapped
+
+
+def reserve_key(
+        username: str, key: str, fingerprint: str
+) -> Optional[Tuple[Dict[str, Any], int]]:
+    """Reserve an idempotency key of a user for a request for IDEMPOTENCY_LOCK_TIMEOUT
+    seconds, unless it was already used. Keys older than IDEMPOTENCY_KEY_TTL
+    seconds, and keys whose request did not finish on time, are reserved again
+
+    :param username: Username of the user that sends the request
+    :param key: Idempotency key of the request
+    :param fingerprint: Fingerprint of the request
+    :return: The body and status of the response to the request that used the key
+    or None if it was reserved for this one
+    :raises Conflict: If the key was used for a different request or the request
+    that used it is still being processed
+    """
+    now = datetime.datetime.utcnow()
+    cutoff = now - datetime.timedelta(seconds=cfg.IDEMPOTENCY_KEY_TTL)
+    reservation = {
+        "fingerprint": fingerprint,
+        "status": None,
+        "response": None,
+        "created_at": now,
+        "locked_until": now + datetime.timedelta(seconds=cfg.IDEMPOTENCY_LOCK_TIMEOUT),
+    }
+
+    row = IdempotencyKey.query.filter(
+        IdempotencyKey.username == username, IdempotencyKey.key == key
+    ).first()
+    if row is None:
+        db.session.add(IdempotencyKey(username=username, key=key, **reservation))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise Conflict(f"Request with key '{key}' is still being processed")
+        return None
+
+    if row.created_at >= cutoff:
+        if row.fingerprint != fingerprint:
+            db.session.commit()
+            raise Conflict(f"Key '{key}' was already used for a different request")
+        if row.status is not None:
+            db.session.commit()
+            return json.loads(row.response), row.status
+
+    # Conditional, so only one of the requests racing for the key takes it
+    taken = IdempotencyKey.query.filter(
+        IdempotencyKey.id == row.id,
+        or_(
+            IdempotencyKey.created_at < cutoff,
+            and_(IdempotencyKey.status.is_(None), IdempotencyKey.locked_until < now),
+        ),
+    ).update(reservation, synchronize_session=False)
+    db.session.commit()
+    if not taken:
+        raise Conflict(f"Request with key '{key}' is still being processed")
+
+    return None
+
+
+def store_response(
+        username: str, key: str, body: Dict[str, Any], status: int
+) -> None:
+    """Store the response to the request that reserved an idempotency key
+
+    :param username: Username of the user that sent the request
+    :param key: Idempotency key of the request
+    :param body: Body of the response
+    :param status: Status code of the response
+    """
+    IdempotencyKey.query.filter(
+        IdempotencyKey.username == username,
+        IdempotencyKey.key == key,
+        IdempotencyKey.status.is_(None),
+    ).update({"status": status, "response": json.dumps(body), "locked_until": None})
+    db.session.commit()
+
+
+def release_key(username: str, key: str) -> None:
+    """Remove the reservation of an idempotency key after its request failed,
+    discarding anything left on the session by the request
+
+    :param username: Username of the user that sent the request
+    :param key: Idempotency key of the request
+    """
+    db.session.rollback()
+    IdempotencyKey.query.filter(
+        IdempotencyKey.username == username,
+        IdempotencyKey.key == key,
+        IdempotencyKey.status.is_(None),
+    ).delete()
+    db.session.commit()
+
+
+def purge_keys() -> int:
+    """Remove the idempotency keys older than IDEMPOTENCY_KEY_TTL seconds. They are
+    not used anymore, this only keeps the table small
+
+    :return: The number of keys removed
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=cfg.IDEMPOTENCY_KEY_TTL
+    )
+    count = IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete()
+    db.session.commit()
+
+    return count
+
+
+def _fingerprint() -> str:
+    """Fingerprint of the method, path and body of the current request"""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+
+    return digest.hexdigest()
@@ -1,52 +1,305 @@
 """
 This module contains helper functions to be used on the meals endpoints
 """
+import base64
+import binascii
 import datetime
 
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
 from marshmallow import ValidationError
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import ColumnElement, func
 
-from calories.main import db
+from calories.main import cfg, db
 from calories.main.controller import RequestBodyType
 from calories.main.controller.helpers import BadRequest, NotFound
-from calories.main.controller.helpers.users import _get_user, get_daily_calories
-from calories.main.models.models import Meal, User, MealSchema
+from calories.main.controller.helpers.users import (
+    _get_user,
+    get_daily_calories,
+    get_user_record,
+)
+from calories.main.models.models import Meal, MealSchema, MealTombstone, User
 from calories.main.util.external_apis import calories_from_nutritionix
-from calories.main.util.filters import apply_filter
-
-meal_schema = MealSchema(exclude=["user"])
-meals_schema = MealSchema(many=True, exclude=["user"])
+from calories.main.util.changes import get_day_version, record_meal_changes
+from calories.main.util.filters import apply_filter, apply_keyset, filter_query
+from calories.main.util.lru import LRUCache
+from calories.main.util.search import apply_search
+from calories.main.util.serializers import RowSerializer
+from calories.main.util.sorting import get_ordering
+from calories.main.util.sql import (
+    batches,
+    bulk_insert,
+    commit_without_expire,
+    update_returning,
+)
+from calories.main.util.streams import ParseError, read_rows
+
+meal_schema = MealSchema(exclude=["user", "version", "updated_at"])
+meals_serializer = RowSerializer(Meal, exclude=["user_id", "version", "updated_at"])
+meal_changes_serializer = RowSerializer(Meal, exclude=["user_id", "version"])
+meal_patch_schema = MealSchema(
+    exclude=["user", "id", "under_daily_total", "version", "updated_at"]
+)
+
+# Every ordering is backed by an index on the user_id followed by its columns
+MEAL_ORDERINGS = {
+    "date,time": (Meal.date, Meal.time, Meal.id),
+    "calories": (Meal.calories, Meal.id),
+    "name": (Meal.name, Meal.id),
+}
+DEFAULT_MEAL_SORT = "date,time"
+
+meals_cache = LRUCache("meals", cfg.QUERY_CACHE_MAX_ENTRIES, cfg.QUERY_CACHE_MAX_BYTES)
+
+IMPORT_COLUMNS = ("date", "time", "name", "grams", "description", "calories")
+IMPORT_IGNORED = ("id", "under_daily_total")
+# Dates whose daily flags are refreshed by every UPDATE, within the parameter limits
+REFRESH_BATCH_SIZE = 500
 
 
 def get_meals(
-        username: str, filter_str: str, items_per_page: int, page_number: int
+        username: str,
+        filter_str: str,
+        items_per_page: int,
+        page_number: int,
+        fields: List[str] = None,
+        search: str = None,
+        sort: str = None,
 ) -> ...:
-    """Get the list of meals for the specified user from the database
+    """Get the list of meals for the specified user from the database. Pages are
+    cached under the data version of the user, so they are read again after the
+    user or his meals change
 
     :param username: Username of the user whose meals we need to get
     :param filter_str: Filter string for the result
     :param items_per_page: Number of items per page
     :param page_number: Page requested
+    :param fields: Fields of the meals to return, all of them if not specified
+    :param search: Words to search for on the name and description of the meals,
+    the results are ranked from the best to the worst match unless sorted
+    :param sort: Ordering of the meals, by date and time if not specified
     :return: The list of the users filtered and paginated
+    :raises BadRequest: If the sort is not allowed
+    :raises NotFound: If the user is not on the database
+    """
+    # The version is read before the meals, so a page is never older than its key
+    r_user = (
+        db.session.query(User.id, User.data_version)
+            .filter(User.username == username)
+            .one_or_none()
+    )
+    if r_user is None:
+        raise NotFound(f"User '{username}' not found")
+    serializer = _get_serializer(fields)
+    if sort is None and search is None:
+        sort = DEFAULT_MEAL_SORT
+    ordering = _get_ordering(sort) if sort else None
+
+    def load():
+        meals = Meal.query.with_entities(*serializer.columns).filter(
+            Meal.user_id == r_user.id
+        )
+        meals = filter_query(meals, filter_str)
+        if search is not None:
+            meals = apply_search(meals, search)
+        if ordering:
+            meals = meals.order_by(None).order_by(*ordering)
+        meals, pagination = apply_filter(meals, None, items_per_page, page_number)
+        return serializer.dump(meals), pagination
+
+    key = (
+        r_user.id,
+        r_user.data_version,
+        filter_str,
+        items_per_page,
+        page_number,
+        serializer.fields,
+        search,
+        sort,
+    )
+    # The version is not committed yet, it could be reused if it is rolled back
+    if db.session.info.get("single_transaction"):
+        return load()
+    return meals_cache.get_or_set(key, load)
+
+
+def srch_meals(
+        filter_str: str,
+        usernames: List[str] = None,
+        role: str = None,
+        items_per_page: int = 10,
+        cursor: str = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Search the meals of all the users, ordered by date and id. Pages are read by
+    seeking past the previous page on the (date, id, calories, user_id) index, so
+    filters on dates and calories are evaluated on the index and only the rows of
+    the page are read from the table
+
+    :param filter_str: Filter string for the meals
+    :param usernames: Only return meals of these users if given
+    :param role: Only return meals of users with this role if given
+    :param items_per_page: Number of items per page
+    :param cursor: Cursor of the page returned with the previous one
+    :return: The meals of the page with the username of their owner, and the cursor
+    of the next page
+    """
+    meals = filter_query(
+        Meal.query.with_entities(*meals_serializer.columns, Meal.user_id), filter_str
+    )
+    if usernames or role:
+        users = db.session.query(User.id)
+        if usernames:
+            users = users.filter(User.username.in_(usernames))
+        if role:
+            users = users.filter(User.role == role)
+        meals = meals.filter(Meal.user_id.in_(users.subquery()))
+    meals = meals.join(User, User.id == Meal.user_id).add_columns(User.username)
+
+    rows, next_cursor = apply_keyset(meals, [Meal.date, Meal.id], items_per_page, cursor)
+    data = [
+        {**meals_serializer.dump_row(row), "username": row.username} for row in rows
+    ]
+
+    return data, next_cursor
+
+
+def stream_meals(
+        username: str, filter_str: str, batch_size: int = 1000
+) -> Iterator[Dict[str, Any]]:
+    """Get all the meals of the specified user, ordered by date and time. Rows are
+    fetched lazily from a server-side cursor in batches as they are consumed
+
+    :param username: Username of the user whose meals we need to get
+    :param filter_str: Filter string for the result
+    :param batch_size: Number of rows fetched from the database at once
+    :return: An iterator on the serialized meals
     """
-    r_user = _get_user(username)
+    r_user = get_user_record(username)
 
-    meals = Meal.query.join(User, User.id == Meal.user_id).filter(
-        User.username == r_user.username
+    meals = Meal.query.with_entities(*meals_serializer.columns).filter(
+        Meal.user_id == r_user.id
     )
-    meals, pagination = apply_filter(meals, filter_str, items_per_page, page_number)
-    data = meals_schema.dump(meals)
+    meals = filter_query(meals, filter_str).order_by(Meal.date, Meal.time, Meal.id)
+
+    return map(meals_serializer.dump_row, meals.yield_per(batch_size))
+
+
+def get_meal_changes(username: str, cursor: str = None) -> Dict[str, Any]:
+    """Get the meals of a user created, updated or deleted since a previous sync. All
+    the meals of a day are returned when any of them changes, as their
+    under_daily_total may have changed too. Writes are versioned with the data
+    version of the user, so a sync returns everything committed up to the version
+    of its cursor, and nothing committed later is missed by the next one
+
+    :param username: Username of the user owner of the meals
+    :param cursor: Cursor returned by the previous sync, all the meals and the
+    deletions ever recorded if not given
+    :return: The meals created or updated, the ids of the meals deleted and the
+    cursor of the next sync
+    :raises NotFound: If the user does not exist
+    :raises BadRequest: If the cursor is invalid
+    """
+    user = get_user_record(username)
+    version = db.session.query(User.data_version).filter(User.id == user.id).scalar()
+    # Meals never changed since versions were introduced have version 0
+    since = _decode_sync_cursor(cursor, user.id, version) if cursor else -1
+
+    upserts = Meal.query.with_entities(*meal_changes_serializer.columns).filter(
+        Meal.user_id == user.id, Meal.version > since, Meal.version <= version
+    )
+    deletes = db.session.query(MealTombstone.meal_id).filter(
+        MealTombstone.user_id == user.id,
+        MealTombstone.version > since,
+        MealTombstone.version <= version,
+    )
+    upserts = upserts.order_by(Meal.version, Meal.id)
+    deletes = deletes.order_by(MealTombstone.version, MealTombstone.meal_id)
+
+    return {
+        "upserts": meal_changes_serializer.dump(upserts),
+        "deletes": [meal_id for meal_id, in deletes],
+        "cursor": _encode_sync_cursor(user.id, version),
+    }
+
+
+def get_sync_cursor(username: str) -> str:
+    """Get the cursor of a sync of the meals of a user made now, to read only the
+    changes made from now on
+
+    :param username: Username of the user owner of the meals
+    :return: The cursor
+    :raises NotFound: If the user does not exist
+    """
+    user = get_user_record(username)
+    version = db.session.query(User.data_version).filter(User.id == user.id).scalar()
 
-    return data, pagination
+    return _encode_sync_cursor(user.id, version)
 
 
-def get_meal(username: str, meal_id: int) -> Meal:
+def get_meal(username: str, meal_id: int, fields: List[str] = None) -> Meal:
     """Get the selected meal from the database
 
     :param username: Username of the user owner of the meal
     :param meal_id: Id of the meal
+    :param fields: Fields of the meal to return, all of them if not specified
     :return: The specified meal
+    :raises NotFound: If either the user or the meal do not exist
     """
-    return meal_schema.dump(_get_meal(username, meal_id))
+    user = get_user_record(username)
+    serializer = _get_serializer(fields)
+
+    meal = (
+        Meal.query.with_entities(*serializer.columns)
+            .filter(Meal.user_id == user.id, Meal.id == meal_id)
+            .one_or_none()
+    )
+    if meal is None:
+        raise NotFound(f"Meal '{meal_id}' not found")
+
+    return serializer.dump_row(meal)
+
+
+def get_day(username: str, date: str) -> Dict[str, Any]:
+    """Get the meals of a user on a day, ordered by time, and their total calories
+
+    :param username: Username of the user owner of the meals
+    :param date: Day of the meals, as an ISO 8601 date
+    :return: The day with its meals
+    :raises NotFound: If the user does not exist
+    :raises BadRequest: If the date is wrong
+    """
+    user = get_user_record(username)
+    day = _parse_date(date)
+
+    meals = (
+        Meal.query.with_entities(*meals_serializer.columns)
+            .filter(Meal.user_id == user.id, Meal.date == day)
+            .order_by(Meal.time, Meal.id)
+    )
+    data = meals_serializer.dump(meals)
+
+    return {
+        "date": day.isoformat(),
+        "calories": sum(m["calories"] or 0 for m in data),
+        "meals": data,
+    }
+
+
+def get_day_tag(username: str, date: str) -> str:
+    """Get a tag that changes with every write to the meals of a user on a day, made
+    of the id of the user and the version of the day. Only the versions of the days
+    that changed are bumped, so tags of past days last
+
+    :param username: Username of the user owner of the meals
+    :param date: Day of the meals, as an ISO 8601 date
+    :return: The tag of the day
+    :raises NotFound: If the user does not exist
+    :raises BadRequest: If the date is wrong
+    """
+    user = get_user_record(username)
+
+    return f"{user.id}.{get_day_version(user.id, _parse_date(date))}"
 
 
 def crt_meal(username: str, data: RequestBodyType) -> Meal:
@@ -73,7 +326,8 @@ def crt_meal(username: str, data: RequestBodyType) -> Meal:
     else:
         new_meal.under_daily_total = True
 
-    db.session.commit()
+    record_meal_changes(user.id, [new_meal.date])
+    commit_without_expire()
 
     return meal_schema.dump(new_meal)
 
@@ -87,7 +341,7 @@ def updt_meal(username: str, meal_id: int, data: RequestBodyType) -> Meal:
     :return: The updated meal
     """
     old_meal = _get_meal(username, meal_id)
-    user = _get_user(username)
+    user = get_user_record(username)
 
     new_meal = _parse_meal(data)
     new_meal.user_id = old_meal.user_id
@@ -129,18 +383,113 @@ def updt_meal(username: str, meal_id: int, data: RequestBodyType) -> Meal:
             new_meal.under_daily_total = user.daily_calories > calories + difference
 
     db.session.merge(new_meal)
-    db.session.commit()
+    record_meal_changes(user.id, [old_meal.date, new_meal.date or old_meal.date])
+    commit_without_expire()
 
     return meal_schema.dump(old_meal)
 
 
+def ptch_meal(username: str, meal_id: int, data: RequestBodyType) -> Meal:
+    """Partially update a meal. Only the supplied fields are validated and written,
+    using a single UPDATE that returns the new row, and the daily totals are only
+    recomputed when the date or the calories of the meal change
+
+    :param username: Username of the user whose meal is going to be updated
+    :param meal_id: Id of the meal
+    :param data: Fields of the meal to change
+    :return: The updated meal
+    :raises NotFound: If either the user or the meal do not exist
+    """
+    user = get_user_record(username)
+    changes = _parse_changes(data)
+
+    lookup = changes.get("name") and "calories" not in changes
+    old_date = None
+    if lookup or "date" in changes:
+        old = (
+            db.session.query(Meal.name, Meal.date)
+                .filter(Meal.id == meal_id, Meal.user_id == user.id)
+                .one_or_none()
+        )
+        if old is None:
+            raise NotFound(f"Meal '{meal_id}' not found")
+        old_date = old.date if "date" in changes else None
+
+        # Get calories from nutritionix if the name has changed but the user didn't provide its calories
+        if lookup and changes["name"] != old.name:
+            changes["calories"] = calories_from_nutritionix(changes["name"])
+
+    row = update_returning(Meal.__table__, changes, id=meal_id, user_id=user.id)
+    if row is None:
+        raise NotFound(f"Meal '{meal_id}' not found")
+
+    meal = meal_schema.dump(row)
+    if "date" in changes or "calories" in changes:
+        _refresh_daily_flags(user, {row.date, old_date or row.date})
+        meal["under_daily_total"] = (
+                get_daily_calories(user, row.date) < user.daily_calories
+        )
+    record_meal_changes(user.id, [row.date, old_date or row.date])
+
+    db.session.commit()
+
+    return meal
+
+
+def imprt_meals(
+        username: str, lines: Iterable[str], format: str, batch_size: int = 1000
+) -> int:
+    """Import meals for a user from a NDJSON or CSV document. The document is parsed
+    and validated as it is loaded, every row needs a date and a name, the calories
+    default to 0 and are never looked up on Nutritionix. Ids and under_daily_total
+    of the rows are ignored, daily totals are recomputed at the end, only for the
+    dates imported
+
+    :param username: Username of the user owner of the meals
+    :param lines: Lines of the document
+    :param format: Format of the document, either 'ndjson' or 'csv'
+    :param batch_size: Number of meals inserted at once where COPY is not available
+    :return: The number of meals imported
+    :raises NotFound: If the user does not exist
+    :raises BadRequest: If any row is not a valid meal or the document is not
+    valid UTF-8, nothing is imported then
+    """
+    user = get_user_record(username)
+
+    dates = set()
+
+    def rows() -> Iterator[Tuple[Any, ...]]:
+        for number, row in read_rows(lines, format):
+            values = _parse_import_row(number, row)
+            dates.add(values[0])
+            yield (user.id, *values, True)
+
+    try:
+        count = bulk_insert(
+            Meal.__table__,
+            ("user_id", *IMPORT_COLUMNS, "under_daily_total"),
+            rows(),
+            batch_size,
+        )
+    except (ParseError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        raise BadRequest(str(e))
+
+    for chunk in batches(sorted(dates), REFRESH_BATCH_SIZE):
+        _refresh_daily_flags(user, chunk)
+    record_meal_changes(user.id, dates)
+    db.session.commit()
+
+    return count
+
+
 def dlt_meals(username: str, meal_id: int) -> None:
     """Delete the selected meal from the database
 
     :param username: Username whose meal is going to be deleted
     :param meal_id: Id of the meal that is going to be deleted
     """
-    d_user = _get_user(username)
+    d_user = get_user_record(username)
     meal = _get_meal(username, meal_id)
 
     # Update under_daily_total for the day if necessary
@@ -149,6 +498,7 @@ def dlt_meals(username: str, meal_id: int) -> None:
         _update_meals(d_user, meal.date, True)
 
     db.session.delete(meal)
+    record_meal_changes(d_user.id, [meal.date], deleted=[meal.id])
     db.session.commit()
 
 
@@ -160,7 +510,7 @@ def _get_meal(username: str, meal_id: int) -> Meal:
     :return: The database object for the meal
     :raises NotFound: If the user is not on the database
     """
-    user = _get_user(username)
+    user = get_user_record(username)
     meal = (
         Meal.query.join(User, User.id == Meal.user_id)
             .filter(User.username == user.username, Meal.id == meal_id)
@@ -186,6 +536,118 @@ def _update_meals(user: User, date: datetime.date, under_daily_total: bool) -> N
         meal.under_daily_total = under_daily_total
 
 
+def _refresh_daily_flags(
+        user: User, dates: Optional[Iterable[datetime.date]] = None
+) -> None:
+    """Recompute under_daily_total for all the meals of a user on the given dates
+    with one set-based UPDATE. It does not commit changes to the database so
+    everything can be part of the same transaction
+
+    :param user: User to update its meals
+    :param dates: Dates of the meals to be updated, all of them if not specified
+    """
+    other = aliased(Meal)
+    daily_total = (
+        db.session.query(func.coalesce(func.sum(other.calories), 0))
+            .filter(other.user_id == Meal.user_id, other.date == Meal.date)
+            .as_scalar()
+    )
+    meals = Meal.query.filter(Meal.user_id == user.id)
+    if dates is not None:
+        meals = meals.filter(Meal.date.in_(list(dates)))
+    meals.update(
+        {Meal.under_daily_total: daily_total < user.daily_calories},
+        synchronize_session=False,
+    )
+
+
+def _get_serializer(fields: List[str]) -> RowSerializer:
+    """Get the serializer for the requested fields of the meals
+
+    :raises BadRequest: If any of the fields does not exist
+    """
+    try:
+        return meals_serializer.only(fields)
+    except ValueError as e:
+        raise BadRequest(f"Field(s): {e} do not exist")
+
+
+def _get_ordering(sort: str) -> List[ColumnElement]:
+    """Get the ORDER BY clauses of the sort parameter of the meals
+
+    :raises BadRequest: If the sort is not allowed
+    """
+    try:
+        return get_ordering(MEAL_ORDERINGS, sort)
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+
+def _encode_sync_cursor(user_id: int, version: int) -> str:
+    """Encode the position of a sync of the meals of a user as an opaque cursor"""
+    return base64.urlsafe_b64encode(f"{user_id}.{version}".encode()).decode()
+
+
+def _decode_sync_cursor(cursor: str, user_id: int, version: int) -> int:
+    """Decode a sync cursor of the meals of a user
+
+    :return: The data version the cursor was created at
+    :raises BadRequest: If the cursor is wrong, of another user or from the future
+    """
+    try:
+        cursor_user_id, since = map(
+            int, base64.urlsafe_b64decode(cursor.encode()).decode().split(".")
+        )
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise BadRequest(f"Cursor '{cursor}' is invalid")
+    if cursor_user_id != user_id or not 0 <= since <= version:
+        raise BadRequest(f"Cursor '{cursor}' is invalid")
+
+    return since
+
+
+def _parse_date(date: str) -> datetime.date:
+    """Parse an ISO 8601 date
+
+    :raises BadRequest: If the date is wrong
+    """
+    try:
+        return datetime.date.fromisoformat(date)
+    except ValueError as e:
+        raise BadRequest(f"Wrong date: {e}")
+
+
+def _parse_changes(body: RequestBodyType) -> Dict[str, Any]:
+    """Validate and deserialize only the fields present on a request body"""
+    try:
+        meal = meal_patch_schema.load(body, session=db.session, partial=True)
+    except ValidationError as e:
+        fields = ", ".join(f"'{f}'" for f in sorted(e.messages))
+        raise BadRequest(f"Field(s): {fields} have the wrong format")
+
+    return {field: getattr(meal, field) for field in body}
+
+
+def _parse_import_row(number: int, row: RequestBodyType) -> Tuple[Any, ...]:
+    """Validate an imported row and get the values of its columns
+
+    :raises ParseError: If the row is not a valid meal
+    """
+    row = {k: v for k, v in row.items() if k not in IMPORT_IGNORED}
+    missing = [f"'{f}'" for f in ("date", "name") if row.get(f) in (None, "")]
+    if missing:
+        raise ParseError(number, f"Field(s): {', '.join(missing)} are required")
+    try:
+        meal = meal_patch_schema.load(row, transient=True)
+    except ValidationError as e:
+        fields = ", ".join(f"'{f}'" for f in sorted(e.messages))
+        raise ParseError(number, f"Field(s): {fields} have the wrong format")
+    meal.grams = meal.grams or 0
+    meal.calories = meal.calories or 0
+
+    return tuple(getattr(meal, c) for c in IMPORT_COLUMNS)
+
+
 def _parse_meal(body: RequestBodyType) -> Meal:
     """Create a meal from a request body"""
     try:
@@ -0,0 +1,128 @@
+"""
+This module contains helper functions to serve the read endpoints from the read
+replicas of the database while users keep reading their own writes
+"""
+import random
+from functools import wraps
+from typing import Any, List, Optional
+
+from connexion import context
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from calories.main import cfg, db
+from calories.main.util import metrics
+from calories.main.util.shared_cache import SharedCache
+
+REPLICA_PREFIX = "replica"
+
+# Position of the last write of every user on the primary, while replicas may lag
+write_marks = SharedCache(
+    "writes", cfg.REPLICA_MARKS_FILE, cfg.USER_CACHE_SLOTS, ttl=cfg.REPLICA_MAX_LAG
+)
+
+
+def replica_reads(func):
+    """Decorate a read endpoint so its queries go to a read replica, unless the
+    user that requests it wrote in the last REPLICA_MAX_LAG seconds and the replica
+    may not have the write yet, then they go to the primary as usual. Reads of a
+    session with writes not committed yet, like those of an atomic batch, go to the
+    primary too. It has to be applied after is_allowed so permissions are checked
+    on the primary
+
+    :return: The endpoint that decorates
+    """
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        session = db.session()
+        if session.info.get("single_transaction") or session.info.get("wrote"):
+            return func(*args, **kwargs)
+        replica = get_replica(kwargs["user"])
+        if replica is None:
+            return func(*args, **kwargs)
+
+        session.info["replica"] = replica
+        try:
+            return func(*args, **kwargs)
+        finally:
+            session.info.pop("replica", None)
+
+    return wrapped
+
+
+def get_replica(username: str) -> Optional[Engine]:
+    """Choose a read replica for the reads of a user. On Postgres the replica is
+    used as soon as it replayed the last write of the user, on other databases
+    after REPLICA_MAX_LAG seconds
+
+    :param username: Username of the user that reads
+    :return: The engine of the replica or None if the reads have to go to the
+    primary
+    """
+    binds = _replica_binds()
+    if not binds:
+        return None
+
+    engine = db.get_engine(current_app, bind=random.choice(binds))
+    mark, _ = write_marks.lookup(username)
+    if mark is not None and not _replayed(engine, mark):
+        metrics.increment("replicas.primary_reads")
+        return None
+
+    metrics.increment("replicas.replica_reads")
+    return engine
+
+
+def mark_write(username: str) -> None:
+    """Record that a user just wrote to the primary, with its current WAL position
+    on Postgres, so their next reads go to the primary until the replicas have it
+
+    :param username: Username of the user that wrote
+    """
+    engine = db.get_engine(current_app)
+    position = True
+    if engine.dialect.name == "postgresql":
+        position = engine.scalar(text("SELECT CAST(pg_current_wal_lsn() AS TEXT)"))
+
+    _, generation = write_marks.lookup(username)
+    write_marks.set(username, position, generation)
+
+
+def _replayed(engine: Engine, mark: Any) -> bool:
+    """Whether a replica already replayed the write of the given mark"""
+    if engine.dialect.name != "postgresql" or not isinstance(mark, str):
+        return False
+
+    return bool(
+        engine.scalar(
+            text("SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)"), lsn=mark
+        )
+    )
+
+
+def _replica_binds() -> List[str]:
+    """Bind keys of the read replicas configured"""
+    binds = current_app.config.get("SQLALCHEMY_BINDS") or {}
+    return [key for key in binds if key.startswith(REPLICA_PREFIX)]
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_writes(session: Session) -> None:
+    """Mark the user of the request as a recent writer once his writes commit"""
+    if session.info.get("single_transaction") or not session.info.pop("wrote", False):
+        return
+    try:
+        username = context.get("user")
+    except (AttributeError, RuntimeError):
+        username = None
+    if username is not None and _replica_binds():
+        mark_write(username)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_writes(session: Session) -> None:
+    """Forget the writes of a transaction rolled back"""
+    session.info.pop("wrote", None)
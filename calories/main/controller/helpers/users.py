@@ -2,39 +2,174 @@
 This module contains helper functions to be used on the user endpoints
 """
 from datetime import datetime
+from typing import List, NamedTuple, Optional
 
 from marshmallow import INCLUDE
-from sqlalchemy.sql import func
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ColumnElement, func
 
-from calories.main import db
+from calories.main import cfg, db
 from calories.main.controller import RequestBodyType
 from calories.main.controller.helpers import NotFound, Conflict, Forbidden, BadRequest
-from calories.main.models.models import Meal, User, UserSchema, Role
+from calories.main.models.models import (
+    DailyRollup,
+    DayVersion,
+    Meal,
+    MealTombstone,
+    User,
+    UserSchema,
+    Role,
+)
+from calories.main.util.changes import get_users_version, record_user_changes
 from calories.main.util.filters import apply_filter
-
-user_schema = UserSchema(exclude=("id", "_password", "meals"), unknown=INCLUDE)
-users_schema = UserSchema(
-    many=True, exclude=("id", "_password", "meals"), unknown=INCLUDE
+from calories.main.util.lru import LRUCache
+from calories.main.util.shared_cache import SharedCache
+from calories.main.util.serializers import RowSerializer
+from calories.main.util.sorting import get_ordering
+from calories.main.util.sql import commit_without_expire
+
+user_schema = UserSchema(
+    exclude=("id", "_password", "meals", "data_version"), unknown=INCLUDE
 )
+users_serializer = RowSerializer(User, exclude=("id", "_password", "data_version"))
+
+# Every ordering is backed by an index on its columns
+USER_ORDERINGS = {
+    "username": (User.username,),
+    "name": (User.name, User.id),
+    "daily_calories": (User.daily_calories, User.id),
+}
+DEFAULT_USER_SORT = "username"
+
+users_cache = LRUCache("users", cfg.QUERY_CACHE_MAX_ENTRIES, cfg.QUERY_CACHE_MAX_BYTES)
+user_records = SharedCache(
+    "users", cfg.USER_CACHE_FILE, cfg.USER_CACHE_SLOTS, ttl=cfg.USER_CACHE_TTL
+)
+
 
+class UserRecord(NamedTuple):
+    """What the permission and daily limit checks need to know about a user"""
 
-def get_users(filter_str: str, items_per_page: int, page_number: int) -> ...:
-    """Get the list of users from the database
+    id: int
+    username: str
+    role: Optional[Role]
+    daily_calories: int
+
+
+def get_users(
+        filter_str: str,
+        items_per_page: int,
+        page_number: int,
+        fields: List[str] = None,
+        sort: str = None,
+) -> ...:
+    """Get the list of users from the database. Pages are cached under the version
+    of the list of users, so they are read again after any user changes
 
     :param filter_str: Filter string for the result
     :param items_per_page: Number of items per page
     :param page_number: Page requested
+    :param fields: Fields of the users to return, all of them if not specified
+    :param sort: Ordering of the users, by username if not specified
     :return: The list of the users filtered and paginated
+    :raises BadRequest: If the sort is not allowed
     """
-    users = User.query.order_by(User.username)
-    users, pagination = apply_filter(users, filter_str, items_per_page, page_number)
+    serializer = _get_serializer(fields)
+    ordering = _get_ordering(sort or DEFAULT_USER_SORT)
+
+    def load():
+        users = User.query.with_entities(*serializer.columns).order_by(*ordering)
+        users, pagination = apply_filter(users, filter_str, items_per_page, page_number)
+        return serializer.dump(users), pagination
+
+    # The version is read before the users, so a page is never older than its key
+    key = (
+        get_users_version(),
+        filter_str,
+        items_per_page,
+        page_number,
+        serializer.fields,
+        sort or DEFAULT_USER_SORT,
+    )
+    # The version is not committed yet, it could be reused if it is rolled back
+    if db.session.info.get("single_transaction"):
+        return load()
+    return users_cache.get_or_set(key, load)
 
-    return users_schema.dump(users), pagination
 
+def get_user(username: str, fields: List[str] = None) -> User:
+    """Get the information of a user
 
-def get_user(username: str) -> User:
-    """Get the information of a user"""
-    return user_schema.dump(_get_user(username))
+    :param username: Username of the user
+    :param fields: Fields of the user to return, all of them if not specified
+    :return: The specified user
+    :raises NotFound: If the user is not on the database
+    """
+    serializer = _get_serializer(fields)
+
+    user = (
+        User.query.with_entities(*serializer.columns)
+            .filter(User.username == username)
+            .one_or_none()
+    )
+    if user is None:
+        raise NotFound(f"User '{username}' not found")
+
+    return serializer.dump_row(user)
+
+
+def get_data_tag(username: str) -> Optional[str]:
+    """Get a tag that changes with every change to a user or his meals, made of the
+    id of the user and his data version, as the versions start over when a user is
+    deleted and created again with the same username
+
+    :param username: Username of the user
+    :return: The tag or None if the user does not exist
+    """
+    user = (
+        db.session.query(User.id, User.data_version)
+            .filter(User.username == username)
+            .one_or_none()
+    )
+    if user is None:
+        return None
+
+    return f"{user.id}.{user.data_version}"
+
+
+def get_user_record(username: str) -> UserRecord:
+    """Get the id, role and daily calories of a user. They are kept on a cache shared
+    by all the workers, which is invalidated when the user is updated or deleted
+
+    :param username: Username of the user
+    :return: The record of the user
+    :raises NotFound: If the user is not on the database
+    """
+    value, generation = user_records.lookup(username)
+    if value is not None:
+        user_id, role, daily_calories = value
+        return UserRecord(user_id, username, role and Role(role), daily_calories)
+
+    user = (
+        db.session.query(User.id, User.role, User.daily_calories)
+            .filter(User.username == username)
+            .one_or_none()
+    )
+    if user is None:
+        raise NotFound(f"User '{username}' not found")
+
+    role = user.role and Role(user.role)
+    # Records read from a lagging replica could be kept after the user changed, and
+    # the ones read inside a single transaction could be rolled back
+    if not (
+            db.session.info.get("replica") or db.session.info.get("single_transaction")
+    ):
+        user_records.set(
+            username, [user.id, role and role.value, user.daily_calories], generation
+        )
+
+    return UserRecord(user.id, username, role, user.daily_calories)
 
 
 def crt_user(req_user: str, username: str, data: RequestBodyType) -> User:
@@ -53,7 +188,7 @@ def crt_user(req_user: str, username: str, data: RequestBodyType) -> User:
     except NotFound:
         pass
 
-    owner = _get_user(req_user)
+    owner = get_user_record(req_user)
     new_user = user_schema.load(data, session=db.session)
 
     if owner.role == Role.MANAGER and new_user.role != Role.USER:
@@ -63,7 +198,9 @@ def crt_user(req_user: str, username: str, data: RequestBodyType) -> User:
         raise BadRequest(f"Username must contain only alphanumeric characters")
 
     db.session.add(new_user)
-    db.session.commit()
+    db.session.flush()
+    record_user_changes(new_user.id, new_user.username, "create")
+    commit_without_expire()
 
     return user_schema.dump(new_user)
 
@@ -79,7 +216,7 @@ def updt_user(req_user: str, username: str, data: RequestBodyType) -> User:
     :raises BadRequest: If the username has not alphanumeric characters
     """
     u_user = _get_user(username)
-    owner = _get_user(req_user)
+    owner = get_user_record(req_user)
 
     updated = user_schema.load(data, session=db.session)
 
@@ -92,7 +229,9 @@ def updt_user(req_user: str, username: str, data: RequestBodyType) -> User:
     updated.id = u_user.id
 
     db.session.merge(updated)
-    db.session.commit()
+    record_user_changes(u_user.id, u_user.username, "update")
+    _invalidate_record(username)
+    commit_without_expire()
 
     return user_schema.dump(u_user)
 
@@ -105,15 +244,31 @@ def dlt_user(req_user: str, username: str) -> None:
     :raises Forbiden: If the user is not allowed to perform the action
     """
     d_user = _get_user(username)
-    owner = _get_user(req_user)
+    owner = get_user_record(req_user)
 
     if owner.role == Role.MANAGER and d_user.role != Role.USER:
         raise Forbidden(f"User '{req_user}' can only delete users with role USER")
 
+    DailyRollup.query.filter(DailyRollup.user_id == d_user.id).delete()
+    DayVersion.query.filter(DayVersion.user_id == d_user.id).delete()
+    MealTombstone.query.filter(MealTombstone.user_id == d_user.id).delete()
     db.session.delete(d_user)
+    record_user_changes(d_user.id, username, "delete")
+    _invalidate_record(username)
     db.session.commit()
 
 
+def _get_ordering(sort: str) -> List[ColumnElement]:
+    """Get the ORDER BY clauses of the sort parameter of the users
+
+    :raises BadRequest: If the sort is not allowed
+    """
+    try:
+        return get_ordering(USER_ORDERINGS, sort)
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+
 def _get_user(username: str) -> User:
     """Get the specified user from the database
 
@@ -127,6 +282,17 @@ def _get_user(username: str) -> User:
     return user
 
 
+def _get_serializer(fields: List[str]) -> RowSerializer:
+    """Get the serializer for the requested fields of the users
+
+    :raises BadRequest: If any of the fields does not exist
+    """
+    try:
+        return users_serializer.only(fields)
+    except ValueError as e:
+        raise BadRequest(f"Field(s): {e} do not exist")
+
+
 def get_daily_calories(user: User, date: datetime.date) -> int:
     """Get the daily calories for a given user on a specified date"""
     calories = (
@@ -136,3 +302,26 @@ def get_daily_calories(user: User, date: datetime.date) -> int:
             .one()
     )
     return 0 if calories[0] is None else calories[0]
+
+
+def _invalidate_record(username: str) -> None:
+    """Remove the record of a user from the shared cache once the transaction that
+    changes him commits, see _invalidate_records"""
+    db.session.info.setdefault("stale_records", set()).add(username)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_records(session: Session) -> None:
+    """Remove the records of the users changed from the shared cache once committed,
+    so other workers cannot cache them again from the old rows"""
+    if session.info.get("single_transaction"):
+        # Not committed yet, see single_transaction
+        return
+    for username in session.info.pop("stale_records", ()):
+        user_records.delete(username)
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_records(session: Session) -> None:
+    """Forget the records of the users changed on a transaction rolled back"""
+    session.info.pop("stale_records", None)
@@ -1,30 +1,52 @@
 """
 This is the meals module and supports all the REST actions for the Meals data
 """
+import io
+from typing import List
 
-from flask import abort
+from flask import Response, abort, request, stream_with_context
 
-from calories.main import logger
+from calories.main import cfg, logger
 from calories.main.controller import ResponseType, RequestBodyType
 from calories.main.controller.helpers import RequestError
 from calories.main.controller.helpers.auth import is_allowed
+from calories.main.controller.helpers.cache import conditional, conditional_day
+from calories.main.controller.helpers.events import open_stream, stream_meal_events
+from calories.main.controller.helpers.idempotency import idempotent
 from calories.main.controller.helpers.meals import (
     get_meals,
     get_meal,
+    get_meal_changes,
+    get_day,
+    srch_meals,
+    stream_meals,
+    meals_serializer,
+    imprt_meals,
     crt_meal,
     updt_meal,
+    ptch_meal,
     dlt_meals,
 )
+from calories.main.controller.helpers.replicas import replica_reads
 from calories.main.models.models import Role
+from calories.main.util.streams import FORMATS, MIMETYPES, write_rows
+
+EXPORT_BATCH_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
 
 
 @is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+@replica_reads
+@conditional
 def read_meals(
         user: str,
         username: str,
         filter_results: str = None,
         items_per_page: int = 10,
         page_number: int = 1,
+        fields: List[str] = None,
+        q: str = None,
+        sort: str = None,
 ) -> ResponseType:
     """Read the list of meals for a given user
 
@@ -33,11 +55,14 @@ def read_meals(
     :param filter_results: Filter string for the results
     :param items_per_page: Number of items of every page, defaults to 10
     :param page_number: Page number of the results defaults to 1
+    :param fields: Fields of the meals to return, all of them if not specified
+    :param q: Words to search for on the name and description of the meals
+    :param sort: Ordering of the meals, by date and time unless searching
     """
 
     try:
         data, pagination = get_meals(
-            username, filter_results, items_per_page, page_number
+            username, filter_results, items_per_page, page_number, fields, q, sort
         )
     except RequestError as e:
         data = pagination = None
@@ -47,7 +72,7 @@ def read_meals(
     logger.info(
         f"User: '{user}', read meals for user: '{username}',"
         f" filter: '{filter_results}', itemsPerPage: '{items_per_page}',"
-        f" pageNumber: '{page_number}'"
+        f" pageNumber: '{page_number}', q: '{q}', sort: '{sort}'"
     )
 
     return (
@@ -63,16 +88,196 @@ def read_meals(
     )
 
 
+@is_allowed(roles_allowed=[Role.ADMIN])
+def search_meals(
+        user: str,
+        filter_results: str = None,
+        username: List[str] = None,
+        role: str = None,
+        items_per_page: int = 10,
+        cursor: str = None,
+) -> ResponseType:
+    """Search the meals of all the users
+
+    :param user: The user that requests the action
+    :param filter_results: Filter string for the results
+    :param username: Only return meals of these users if given
+    :param role: Only return meals of users with this role if given
+    :param items_per_page: Number of items of every page, defaults to 10
+    :param cursor: Cursor of the page returned with the previous one, first page if
+    not given
+    """
+    try:
+        data, next_cursor = srch_meals(
+            filter_results, username, role, items_per_page, cursor
+        )
+    except RequestError as e:
+        data = next_cursor = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(
+        f"User: '{user}', searched meals, filter: '{filter_results}',"
+        f" usernames: '{username}', role: '{role}', itemsPerPage: '{items_per_page}',"
+        f" cursor: '{cursor}'"
+    )
+
+    return (
+        {
+            "status": 200,
+            "title": "Success",
+            "detail": "Meals succesfully searched",
+            "data": data,
+            "next_cursor": next_cursor,
+        },
+        200,
+    )
+
+
 @is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
-def read_meal(user: str, username: str, meal_id: int) -> ResponseType:
+def export_meals(
+        user: str, username: str, format: str = "ndjson", filter_results: str = None
+) -> Response:
+    """Export all the meals of a given user, streaming them as they are read
+
+    :param user: The user that requests the action
+    :param username: User to export al his meals
+    :param format: Format of the export, either ndjson or csv
+    :param filter_results: Filter string for the results
+    """
+    try:
+        meals = stream_meals(username, filter_results, EXPORT_BATCH_SIZE)
+    except RequestError as e:
+        meals = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(
+        f"User: '{user}', exported meals for user: '{username}',"
+        f" format: '{format}', filter: '{filter_results}'"
+    )
+
+    document = write_rows(meals, meals_serializer.fields, format, EXPORT_BATCH_SIZE)
+
+    return Response(
+        stream_with_context(document),
+        mimetype=MIMETYPES[format],
+        headers={
+            "Content-Disposition": f"attachment; filename={username}-meals.{format}"
+        },
+    )
+
+
+@is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+def read_events(user: str, username: str, since: str = None) -> Response:
+    """Stream the changes of the meals of a user as Server-Sent Events
+
+    :param user: The user that requests the action
+    :param username: User whose changes are streamed
+    :param since: Cursor to send the changes since, the Last-Event-ID header of a
+    reconnection is used if not given, and only the changes from now on without it
+    """
+    since = since or request.headers.get("Last-Event-ID")
+    try:
+        events = stream_meal_events(username, since, cfg.EVENTS_HEARTBEAT)
+        close_stream = open_stream()
+    except RequestError as e:
+        events = close_stream = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(f"User: '{user}', subscribed to events of user: '{username}'")
+
+    response = Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(close_stream)
+
+    return response
+
+
+@is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+def import_meals(user: str, username: str) -> ResponseType:
+    """Import meals for a given user from a NDJSON or CSV document, the format is
+    taken from the content type of the request. The document is read from the
+    request stream as it is imported, it is never held in memory
+
+    :param user: The user that requests the action
+    :param username: User whose meals are going to be imported
+    :return: A success message with the number of meals imported or a 400 error
+    if any meal was wrong
+    """
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    try:
+        count = imprt_meals(
+            username, lines, FORMATS[request.mimetype], IMPORT_BATCH_SIZE
+        )
+    except RequestError as e:
+        count = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(f"User: '{user}' imported {count} meals for user: '{username}'")
+
+    return (
+        {
+            "status": 201,
+            "title": "Success",
+            "detail": f"{count} meals of user: '{username}' succesfully imported",
+            "data": count,
+        },
+        201,
+    )
+
+
+@is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+def read_meal_changes(user: str, username: str, since: str = None) -> ResponseType:
+    """Read the meals of a user created, updated or deleted since a previous sync
+
+    :param user: The user that requests the action
+    :param username: User to sync his meals
+    :param since: Cursor returned by the previous sync, everything if not given
+    """
+    try:
+        data = get_meal_changes(username, since)
+    except RequestError as e:
+        data = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(
+        f"User: '{user}', read changes of meals of user: '{username}',"
+        f" since: '{since}', upserts: {len(data['upserts'])},"
+        f" deletes: {len(data['deletes'])}"
+    )
+
+    return (
+        {
+            "status": 200,
+            "title": "Success",
+            "detail": f"Changes of meals succesfully read for user: '{username}'",
+            "data": data,
+        },
+        200,
+    )
+
+
+@is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+@replica_reads
+def read_meal(
+        user: str, username: str, meal_id: int, fields: List[str] = None
+) -> ResponseType:
     """Read a meal that belongs to a user
 
     :param user: The user that requests the action
     :param username: Username to read his meal
     :param meal_id: Id of the meal
+    :param fields: Fields of the meal to return, all of them if not specified
     """
     try:
-        data = get_meal(username, meal_id)
+        data = get_meal(username, meal_id, fields)
     except RequestError as e:
         data = None
         logger.warning(e.message)
@@ -92,6 +297,36 @@ def read_meal(user: str, username: str, meal_id: int) -> ResponseType:
 
 
 @is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+@conditional_day
+def read_day(user: str, username: str, date: str) -> ResponseType:
+    """Read the meals of a user on a day and their total calories
+
+    :param user: The user that requests the action
+    :param username: Username to read his meals
+    :param date: Day of the meals
+    """
+    try:
+        data = get_day(username, date)
+    except RequestError as e:
+        data = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(f"User: '{user}' read day: '{date}' of user: '{username}'")
+
+    return (
+        {
+            "status": 200,
+            "title": "Success",
+            "detail": f"Day: '{date}' of user: '{username}' succesfully read",
+            "data": data,
+        },
+        200,
+    )
+
+
+@is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+@idempotent
 def create_meal(user: str, username: str, body: RequestBodyType) -> ResponseType:
     """Create a meal
 
@@ -156,6 +391,38 @@ def update_meal(
     )
 
 
+@is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
+def patch_meal(
+        user: str, username: str, meal_id: int, body: RequestBodyType
+) -> ResponseType:
+    """Partially update a meal
+
+    :param user: User that requests the action
+    :param username: User whose meal is going to be updated
+    :param meal_id: Meal id to update
+    :param body: Fields of the meal to update
+    :return: A success message if the meal was found or a 404 error if either the user or the meal does not exist
+    """
+    try:
+        data = ptch_meal(username, meal_id, body)
+    except RequestError as e:
+        data = None
+        logger.warning(e.message)
+        abort(e.code, e.message)
+
+    logger.info(f"User: '{user}' patched meal: '{meal_id}' for  user: '{username}'")
+
+    return (
+        {
+            "status": 200,
+            "title": "Success",
+            "detail": f"Meal: '{meal_id}' of  user: '{username}' succesfully updated",
+            "data": data,
+        },
+        200,
+    )
+
+
 @is_allowed(roles_allowed=[Role.USER], only_allow_self=True)
 def delete_meal(user: str, username: str, meal_id: int) -> ResponseType:
     """Delete a meal
@@ -2,12 +2,17 @@
 This is the users module and supports all the REST actions for the Users data
 """
 
+from typing import List
+
 from flask import abort
 
 from calories.main import logger
 from calories.main.controller import ResponseType, RequestBodyType
 from calories.main.controller.helpers import RequestError
 from calories.main.controller.helpers.auth import is_allowed
+from calories.main.controller.helpers.cache import conditional
+from calories.main.controller.helpers.idempotency import idempotent
+from calories.main.controller.helpers.replicas import replica_reads
 from calories.main.controller.helpers.users import (
     get_users,
     get_user,
@@ -19,8 +24,14 @@ from calories.main.models.models import Role
 
 
 @is_allowed(roles_allowed=[Role.MANAGER])
+@replica_reads
 def read_users(
-        user, filter_results: str = "", items_per_page: int = None, page_number: int = None
+        user,
+        filter_results: str = "",
+        items_per_page: int = None,
+        page_number: int = None,
+        fields: List[str] = None,
+        sort: str = None,
 ) -> ResponseType:
     """Read the full list of users
 
@@ -28,10 +39,14 @@ def read_users(
     :param filter_results: Filter string for the results
     :param items_per_page: Number of items of every page, defaults to 10
     :param page_number: Page number of the results defaults to 1
+    :param fields: Fields of the users to return, all of them if not specified
+    :param sort: Ordering of the users, by username if not specified
     :return: Success mesage with the list of users
     """
     try:
-        data, pagination = get_users(filter_results, items_per_page, page_number)
+        data, pagination = get_users(
+            filter_results, items_per_page, page_number, fields, sort
+        )
     except RequestError as e:
         data = pagination = None
         logger.warning(e.message)
@@ -39,7 +54,7 @@ def read_users(
 
     logger.info(
         f"User: '{user}', read user list, filter: '{filter_results}', itemsPerPage: '{items_per_page}'"
-        f"pageNumber: '{page_number}'"
+        f"pageNumber: '{page_number}', sort: '{sort}'"
     )
 
     return (
@@ -56,15 +71,18 @@ def read_users(
 
 
 @is_allowed(roles_allowed=[Role.MANAGER], allow_self=True)
-def read_user(user: str, username: str) -> ResponseType:
+@replica_reads
+@conditional
+def read_user(user: str, username: str, fields: List[str] = None) -> ResponseType:
     """Read a user
 
     :param user: User that requests the action
     :param username: User to be read
+    :param fields: Fields of the user to return, all of them if not specified
     :return: Success message or 404 if user not found
     """
     try:
-        data = get_user(username)
+        data = get_user(username, fields)
     except RequestError as e:
         data = None
         logger.warning(e.message)
@@ -84,6 +102,7 @@ def read_user(user: str, username: str) -> ResponseType:
 
 
 @is_allowed(roles_allowed=[Role.MANAGER], allow_self=True)
+@idempotent
 def create_user(user: str, body: RequestBodyType) -> ResponseType:
     """Create a user
 
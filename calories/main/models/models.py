@@ -3,6 +3,7 @@ This module contains all the Models for the communication with the database
 """
 from enum import Enum
 
+from sqlalchemy import DDL, event, false
 from sqlalchemy.ext.hybrid import hybrid_property
 from werkzeug.security import generate_password_hash
 
@@ -21,6 +22,12 @@ class User(db.Model):
     """Database Model Class for users"""
 
     __tablename__ = "user"
+    __table_args__ = (
+        db.Index("ix_user_name_id", "name", "id"),
+        db.Index("ix_user_daily_calories_id", "daily_calories", "id"),
+        # Ids are not reused, they are part of the keys of cached results
+        {"sqlite_autoincrement": True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(32), unique=True)
     _password = db.Column("password", db.String(128))
@@ -28,6 +35,8 @@ class User(db.Model):
     email = db.Column(db.String(128))
     role = db.Column(db.Enum(Role))
     daily_calories = db.Column(db.Integer)
+    # Bumped by every write to the user or his meals, see calories.main.util.changes
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     meals = db.relationship(
         "Meal",
         backref="user",
@@ -48,6 +57,16 @@ class Meal(db.Model):
     """Database Model Class for meals"""
 
     __tablename__ = "meal"
+    __table_args__ = (
+        db.Index("ix_meal_user_id_date", "user_id", "date"),
+        db.Index("ix_meal_date_id_calories_user_id", "date", "id", "calories", "user_id"),
+        db.Index("ix_meal_user_id_date_time_id", "user_id", "date", "time", "id"),
+        db.Index("ix_meal_user_id_calories_id", "user_id", "calories", "id"),
+        db.Index("ix_meal_user_id_name_id", "user_id", "name", "id"),
+        db.Index("ix_meal_user_id_version", "user_id", "version"),
+        # Ids are not reused, clients keep them to sync the changes of the meals
+        {"sqlite_autoincrement": True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     date = db.Column(db.Date)
@@ -57,6 +76,174 @@ class Meal(db.Model):
     description = db.Column(db.String)
     calories = db.Column(db.Integer, default=0)
     under_daily_total = db.Column(db.Boolean, default=True)
+    # Data version of the user on the last write to the meals of the day, and when it
+    # happened, set by calories.main.util.changes
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    updated_at = db.Column(db.DateTime)
+
+
+# Days over the daily limit are the minority, so they are indexed on their own
+db.Index(
+    "ix_meal_user_id_date_over_limit",
+    Meal.user_id,
+    Meal.date,
+    postgresql_where=Meal.under_daily_total == false(),
+    sqlite_where=Meal.under_daily_total == false(),
+)
+
+# Full-text index of the name and description of the meals. SQLite keeps an external
+# content FTS5 table in sync with triggers, Postgres a GIN index on the same tsvector
+# expression used by calories.main.util.search
+MEAL_FTS_SQLITE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS meal_fts USING fts5("
+    "name, description, content='meal', content_rowid='id', "
+    "tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS meal_fts_insert AFTER INSERT ON meal BEGIN "
+    "INSERT INTO meal_fts (rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS meal_fts_delete AFTER DELETE ON meal BEGIN "
+    "INSERT INTO meal_fts (meal_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS meal_fts_update "
+    "AFTER UPDATE OF id, name, description ON meal BEGIN "
+    "INSERT INTO meal_fts (meal_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO meal_fts (rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+    "INSERT INTO meal_fts (meal_fts) VALUES ('rebuild')",
+]
+MEAL_FTS_INDEX = "ix_meal_fts"
+
+MEAL_FTS_POSTGRESQL = [
+    f"CREATE INDEX IF NOT EXISTS {MEAL_FTS_INDEX} ON meal "
+    "USING GIN (to_tsvector('english', "
+    "coalesce(name, '') || ' ' || coalesce(description, '')))",
+]
+
+for statement in MEAL_FTS_SQLITE:
+    event.listen(
+        Meal.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+for statement in MEAL_FTS_POSTGRESQL:
+    event.listen(
+        Meal.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql")
+    )
+event.listen(
+    Meal.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS meal_fts").execute_if(dialect="sqlite"),
+)
+
+
+class MealTombstone(db.Model):
+    """Database Model Class for the meals deleted, with the data version of their
+    user on the deletion, so clients syncing the changes of the meals can remove
+    them"""
+
+    __tablename__ = "meal_tombstone"
+    __table_args__ = (db.Index("ix_meal_tombstone_user_id_version", "user_id", "version"),)
+    meal_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False)
+
+
+class DailyRollup(db.Model):
+    """Database Model Class for the calories of every user and day with meals, it is
+    maintained from the meals of the dirty days when the rollups are refreshed"""
+
+    __tablename__ = "daily_rollup"
+    __table_args__ = (db.Index("ix_daily_rollup_date", "date"),)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    calories = db.Column(db.Integer, nullable=False)
+    meals = db.Column(db.Integer, nullable=False)
+
+
+class DirtyDay(db.Model):
+    """Database Model Class for the days of a user whose meals changed since the
+    rollups were last refreshed, the same day can be marked more than once"""
+
+    __tablename__ = "dirty_day"
+    __table_args__ = (db.Index("ix_dirty_day_user_id_date", "user_id", "date"),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.Date, nullable=False)
+
+
+class DayVersion(db.Model):
+    """Database Model Class for the version of the meals of every user and day,
+    bumped by every write to the meals of the day. Days whose meals never changed
+    since the table was created have no row and version 0"""
+
+    __tablename__ = "day_version"
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+
+class DataVersion(db.Model):
+    """Database Model Class for the versions of data not owned by a single user,
+    like the list of users, bumped by every write to it"""
+
+    __tablename__ = "data_version"
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class OutboxEvent(db.Model):
+    """Database Model Class for the changes to the users and their meals waiting to
+    be relayed downstream, appended in the same transaction as the change itself and
+    removed once the sink acknowledges them. There is a single sink, consumers that
+    need the events fan them out from it"""
+
+    __tablename__ = "outbox_event"
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(32), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class OutboxOffset(db.Model):
+    """Database Model Class for the single row with the id of the last event of the
+    outbox acknowledged by the sink and the number of events it acknowledged, moved
+    in the same transaction as the events are removed"""
+
+    __tablename__ = "outbox_offset"
+    id = db.Column(db.Integer, primary_key=True)
+    sink = db.Column(db.String(255), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    delivered = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class IdempotencyKey(db.Model):
+    """Database Model Class for the Idempotency-Key headers sent by every user on
+    the creation requests, with a fingerprint of the request and the response
+    given to it, which is empty while the request is being processed. The request
+    holds the key until locked_until, a retry can take it over after that"""
+
+    __tablename__ = "idempotency_key"
+    __table_args__ = (
+        db.Index("ix_idempotency_key_username_key", "username", "key", unique=True),
+        db.Index("ix_idempotency_key_created_at", "created_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(32), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer)
+    response = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    locked_until = db.Column(db.DateTime)
+
+
+event.listen(
+    DataVersion.__table__,
+    "after_create",
+    DDL("INSERT INTO data_version (name, version) VALUES ('users', 0)"),
+)
 
 
 class UserSchema(ma.ModelSchema):
@@ -0,0 +1,161 @@
+"""
+This module records the changes made to the users and their meals, so the data
+derived from them can be brought up to date
+"""
+import datetime
+from typing import Iterable
+
+from sqlalchemy import Date, bindparam, event, text
+from sqlalchemy.orm import Session
+
+from calories.main import cfg, db
+from calories.main.models.models import (
+    DataVersion,
+    DayVersion,
+    DirtyDay,
+    Meal,
+    MealTombstone,
+    User,
+)
+from calories.main.util.events import get_broker
+from calories.main.util.outbox import append_event
+
+USERS_VERSION = "users"
+USER_ACTIONS = ("create", "update", "delete")
+
+# Notified with the id of the user after their meals change
+broker = get_broker(cfg.EVENTS_SOCKET_DIR)
+
+# Supported by Postgres and by SQLite 3.24 onwards
+BUMP_DAY_VERSION = text(
+    "INSERT INTO day_version (user_id, date, version) VALUES (:user_id, :date, 1) "
+    "ON CONFLICT (user_id, date) DO UPDATE SET version = day_version.version + 1"
+).bindparams(bindparam("date", type_=Date))
+
+
+def record_meal_changes(
+        user_id: int, dates: Iterable[datetime.date], deleted: Iterable[int] = ()
+) -> None:
+    """Record that the meals of a user changed on the given dates, marking the days
+    as dirty and bumping the versions of the days and of the user. The meals left on
+    those days are stamped with the new version of the user and the deleted ones get
+    a tombstone with it, an event is appended to the outbox and the subscribers of
+    the user are notified once the transaction commits. It does not commit changes
+    to the database so the record is part of the same transaction as the change
+    itself. It has to be called by every write to the meals, including the ones
+    that bypass the ORM
+
+    :param user_id: Id of the user owner of the meals
+    :param dates: Dates of the meals that changed
+    :param deleted: Ids of the meals deleted
+    """
+    # The pending changes of the session have to be stamped too
+    db.session.flush()
+
+    dates = set(dates)
+    marks = [{"user_id": user_id, "date": date} for date in dates]
+    if marks:
+        db.session.execute(DirtyDay.__table__.insert(), marks)
+        db.session.execute(BUMP_DAY_VERSION, marks)
+    _bump_data_version(user_id)
+    version = db.session.query(User.data_version).filter(User.id == user_id).scalar()
+
+    now = datetime.datetime.utcnow()
+    if dates:
+        meal = Meal.__table__
+        db.session.execute(
+            meal.update()
+                .where(meal.c.user_id == user_id)
+                .where(meal.c.date.in_(dates))
+                .values(version=version, updated_at=now)
+        )
+
+    tombstones = [
+        {"meal_id": i, "user_id": user_id, "version": version, "deleted_at": now}
+        for i in deleted
+    ]
+    if tombstones:
+        db.session.execute(MealTombstone.__table__.insert(), tombstones)
+    append_event(
+        "meals",
+        {
+            "user_id": user_id,
+            "version": version,
+            "dates": sorted(date.isoformat() for date in dates),
+            "deleted": list(deleted),
+        },
+    )
+
+    # Subscribers are notified after commit, see _publish_changes
+    db.session.info.setdefault("changed_users", set()).add(user_id)
+    db.session.info["wrote"] = True
+
+
+def record_user_changes(user_id: int, username: str, action: str) -> None:
+    """Record that a user was created, updated or deleted by bumping the version of
+    the list of users and the data version of the user if it was updated, and
+    appending an event to the outbox. It does not commit changes to the database so
+    the record is part of the same transaction as the change itself
+
+    :param user_id: Id of the user that changed
+    :param username: Username of the user that changed
+    :param action: What happened to the user, one of USER_ACTIONS
+    """
+    if action == "update":
+        _bump_data_version(user_id)
+
+    version = DataVersion.__table__
+    db.session.execute(
+        version.update()
+            .where(version.c.name == USERS_VERSION)
+            .values(version=version.c.version + 1)
+    )
+    append_event("users", {"user_id": user_id, "username": username, "action": action})
+    db.session.info["wrote"] = True
+
+
+def get_users_version() -> int:
+    """Get the version of the list of users, bumped by every write to any user"""
+    return (
+        db.session.query(DataVersion.version)
+            .filter(DataVersion.name == USERS_VERSION)
+            .scalar()
+    ) or 0
+
+
+def get_day_version(user_id: int, date: datetime.date) -> int:
+    """Get the version of the meals of a user on a day, bumped by every write to
+    them"""
+    return (
+        db.session.query(DayVersion.version)
+            .filter(DayVersion.user_id == user_id, DayVersion.date == date)
+            .scalar()
+    ) or 0
+
+
+def _bump_data_version(user_id: int) -> None:
+    """Bump the data version of a user, for every write to the user or his meals.
+    The row of the user stays locked until the end of the transaction, so versions
+    of the same user are committed in order"""
+    user = User.__table__
+    db.session.execute(
+        user.update()
+            .where(user.c.id == user_id)
+            .values(data_version=user.c.data_version + 1)
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session: Session) -> None:
+    """Notify the subscribers of the users whose meals changed, once committed"""
+    if session.info.get("single_transaction"):
+        # Not committed yet, see single_transaction
+        return
+    for user_id in session.info.pop("changed_users", ()):
+        broker.publish(str(user_id))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session) -> None:
+    """Forget the users whose meals changed on a transaction rolled back"""
+    session.info.pop("changed_users", None)
@@ -0,0 +1,142 @@
+"""
+This module contains the JSON encoding and compression used for the responses
+"""
+import datetime
+import gzip
+import logging
+from decimal import Decimal
+from typing import Any, Optional, Type
+
+from connexion.apis.flask_api import FlaskApi
+from connexion.jsonifier import Jsonifier
+from flask import Response, current_app, request
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Child of the logger of the Flask app, so the warnings go through its handlers
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/problem+json", "text/csv"}
+CONTENT_ENCODINGS = ("br", "gzip")
+
+
+def _default(o: Any) -> Any:
+    """Encode the types orjson does not support natively"""
+    if isinstance(o, Decimal):
+        return float(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class OrjsonProvider:
+    """JSON library backed by orjson with the same conventions as connexion's
+    encoder: sorted keys, ISO 8601 dates and times, naive datetimes as UTC and
+    enums encoded by value
+    """
+
+    @staticmethod
+    def dumps(data: Any, **kwargs: Any) -> str:
+        return orjson.dumps(
+            data,
+            default=_default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z,
+        ).decode()
+
+    @staticmethod
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+
+
+class OrjsonFlaskApi(FlaskApi):
+    """Connexion Flask API that serializes the responses with orjson"""
+
+    @classmethod
+    def _set_jsonifier(cls):
+        cls.jsonifier = Jsonifier(OrjsonProvider)
+
+
+def get_api_cls(provider: str) -> Type[FlaskApi]:
+    """Get the connexion API class for a JSON provider
+
+    :param provider: Name of the JSON provider, either 'orjson' or 'json'
+    :return: The API class that serializes responses with the provider, falls
+    back to the standard library if orjson is not installed
+    """
+    if provider == "orjson":
+        if orjson is not None:
+            return OrjsonFlaskApi
+        logger.warning("orjson is not installed, using the json module instead")
+
+    return FlaskApi
+
+
+def check_compression(enabled: bool) -> None:
+    """Warn if the responses can only be compressed with gzip because brotli is not
+    installed
+
+    :param enabled: Whether the responses are compressed
+    """
+    if enabled and brotli is None:
+        logger.warning("brotli is not installed, compressing the responses with gzip only")
+
+
+def compress_response(response: Response) -> Response:
+    """Compress a response with the best encoding accepted by the client, if it is
+    enabled by COMPRESSION and the body is at least COMPRESSION_MIN_SIZE bytes long.
+    Strong ETags get the encoding appended, as the compressed body is a different
+    representation
+
+    :param response: Response to compress
+    :return: The same response, with a compressed body if it applies
+    """
+    if not current_app.config["COMPRESSION"]:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    data = response.get_data()
+    encoding = _negotiate_encoding()
+    if encoding is None or len(data) < current_app.config["COMPRESSION_MIN_SIZE"]:
+        return response
+
+    if encoding == "br":
+        data = brotli.compress(data, quality=5)
+    else:
+        data = gzip.compress(data, compresslevel=6)
+
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+
+    return response
+
+
+def _negotiate_encoding() -> Optional[str]:
+    """Get the preferred encoding of the client among the supported ones, brotli
+    wins when both are accepted with the same quality"""
+    supported = [e for e in CONTENT_ENCODINGS if e != "br" or brotli is not None]
+    encoding, best = None, 0
+    for candidate in supported:
+        quality = request.accept_encodings.quality(candidate)
+        if quality > best:
+            encoding, best = candidate, quality
+
+    return encoding
@@ -0,0 +1,173 @@
+"""
+This module contains the brokers that notify the subscribers of a topic when it
+changes, within a process or across the worker processes of the same machine
+"""
+import logging
+import os
+import socket
+import threading
+from collections import defaultdict
+from typing import Optional
+
+from calories.main.util import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Subscription to the notifications of a topic. Notifications are not queued,
+    any number of them received while not waiting wake up the next wait once, so
+    subscribers have to read the state of the topic after every wake up"""
+
+    def __init__(self, broker: "LocalBroker", topic: str):
+        self.broker = broker
+        self.topic = topic
+        self._event = threading.Event()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait for a notification
+
+        :param timeout: Maximum number of seconds to wait
+        :return: True if it was notified, False if the timeout expired
+        """
+        notified = self._event.wait(timeout)
+        self._event.clear()
+        return notified
+
+    def notify(self) -> None:
+        """Wake up the subscriber"""
+        self._event.set()
+
+    def close(self) -> None:
+        """Stop receiving notifications"""
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Broker that fans out the notifications of a topic to its subscribers in the
+    same process"""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic: str) -> Subscription:
+        """Subscribe to the notifications of a topic
+
+        :param topic: Topic to subscribe to
+        :return: The subscription, it has to be closed when it is not needed anymore
+        """
+        subscription = Subscription(self, topic)
+        with self._lock:
+            self._subscriptions[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a subscription"""
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.topic, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.topic, None)
+
+    def publish(self, topic: str) -> None:
+        """Notify the subscribers of a topic that it changed
+
+        :param topic: Topic that changed
+        """
+        metrics.increment("events.published")
+        self.deliver(topic)
+
+    def deliver(self, topic: str) -> None:
+        """Notify the subscribers of a topic in this process"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(topic, ()))
+        for subscription in subscriptions:
+            subscription.notify()
+
+
+class SocketBroker(LocalBroker):
+    """Broker that also fans out the notifications to the other processes using it
+    on the same machine, a stand-in for an external broker. Every process with
+    subscribers binds a Unix datagram socket on the given directory, and publishing
+    sends the topic to all the sockets there. Sockets left by processes that are
+    gone are removed, and notifications that do not fit on the buffer of a socket
+    are dropped, so subscribers should not rely only on them
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: Directory shared by the processes for their sockets
+        """
+        super().__init__()
+        self.directory = directory
+        self.path = None
+        self._sender = None
+        self._started = threading.Lock()
+
+    def subscribe(self, topic: str) -> Subscription:
+        self._listen()
+        return super().subscribe(topic)
+
+    def publish(self, topic: str) -> None:
+        super().publish(topic)
+
+        if self._sender is None:
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if path == self.path or not name.endswith(".sock"):
+                continue
+            try:
+                self._sender.sendto(topic.encode(), path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                _remove(path)
+            except OSError as e:
+                metrics.increment("events.dropped")
+                logger.warning(f"Notification to '{path}' dropped: {e}")
+
+    def _listen(self) -> None:
+        """Bind the socket of this process and receive from it on a thread, once per
+        process, as workers may be forked after the broker is created"""
+        with self._started:
+            path = os.path.join(self.directory, f"{os.getpid()}.sock")
+            if self.path == path:
+                return
+
+            os.makedirs(self.directory, exist_ok=True)
+            _remove(path)
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(path)
+            self.path = path
+            threading.Thread(
+                target=self._receive, args=(receiver,), name="events", daemon=True
+            ).start()
+
+    def _receive(self, receiver: socket.socket) -> None:
+        """Deliver the notifications received from other processes"""
+        while True:
+            topic = receiver.recv(1024)
+            self.deliver(topic.decode())
+
+
+def get_broker(directory: Optional[str]) -> LocalBroker:
+    """Get a broker for the given socket directory, a broker for this process only
+    if there is none
+
+    :param directory: Directory for the sockets of the processes or None
+    :return: The broker
+    """
+    return SocketBroker(directory) if directory else LocalBroker()
+
+
+def _remove(path: str) -> None:
+    """Remove a file if it exists"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
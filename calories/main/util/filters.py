@@ -1,6 +1,13 @@
+import base64
+import binascii
+import datetime
+import json
 import re
+from typing import Any, List, Optional, Sequence, Tuple
 
 from fiql_parser import parse_str_to_expression, FiqlException
+from sqlalchemy import Column, and_, or_
+from sqlalchemy.orm import Query
 from sqlalchemy_filters import apply_filters, apply_pagination
 from sqlalchemy_filters.exceptions import FieldNotFound, BadFilterFormat
 from werkzeug.exceptions import abort
@@ -63,13 +70,78 @@ def apply_filter(
     the pagination information
     :rtype: tuple
     """
+    query = filter_query(query, filter_spec)
+    query, pagination = apply_pagination(
+        query, page_number=page_number, page_size=page_size
+    )
+    return query, pagination
 
+
+def filter_query(query: str, filter_spec: str = None):
+    """Apply filtering to any given query
+
+    :param query: Query to apply filtering to
+    :param filter_spec: Filter to apply to the query
+    :return: The query after applying the filter
+    """
     if filter_spec:
         try:
             query = apply_filters(query, to_sql_alchemy(to_fiql(filter_spec)))
         except (FiqlException, FieldNotFound, BadFilterFormat):
             abort(400, f"Filter '{filter_spec}' is invalid")
-    query, pagination = apply_pagination(
-        query, page_number=page_number, page_size=page_size
-    )
-    return query, pagination
+    return query
+
+
+def apply_keyset(
+        query: Query, keys: Sequence[Column], page_size: int = 10, cursor: str = None
+) -> Tuple[List[Any], Optional[str]]:
+    """Paginate a query by seeking past the last row of the previous page instead
+    of skipping rows with an offset, so every page costs the same with an index on
+    the keys. The keys need to identify the rows and be selected by the query
+
+    :param query: Query to paginate
+    :param keys: Columns the rows are ordered by
+    :param page_size: Page size used for pagination
+    :param cursor: Cursor returned with the previous page, first page if not given
+    :return: The rows of the page and the cursor of the next page, None if it is
+    the last one
+    """
+    if cursor:
+        values = _decode_cursor(cursor, keys)
+        seek = or_(
+            *(
+                and_(*(k == v for k, v in zip(keys[:i], values)), keys[i] > values[i])
+                for i in range(len(keys))
+            )
+        )
+        query = query.filter(keys[0] >= values[0], seek)
+
+    rows = query.order_by(*keys).limit(page_size + 1).all()
+    if len(rows) <= page_size:
+        return rows, None
+
+    rows = rows[:page_size]
+    return rows, _encode_cursor([getattr(rows[-1], k.key) for k in keys])
+
+
+def _encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the values of the keys of a row as an opaque cursor"""
+    values = [v.isoformat() if isinstance(v, datetime.date) else v for v in values]
+
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor: str, keys: Sequence[Column]) -> List[Any]:
+    """Decode the values of the keys of a cursor"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(keys):
+            raise ValueError
+        return [
+            datetime.date.fromisoformat(v)
+            if k.type.python_type is datetime.date
+            else k.type.python_type(v)
+            for k, v in zip(keys, values)
+        ]
+    except (binascii.Error, TypeError, ValueError):
+        abort(400, f"Cursor '{cursor}' is invalid")
@@ -0,0 +1,124 @@
+"""
+This module contains an in-process least recently used cache for the results of
+read queries
+"""
+import sys
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable
+from weakref import WeakSet
+
+from calories.main.util import metrics
+
+_caches = WeakSet()
+
+
+class LRUCache:
+    """Cache bounded both by number of entries and by the approximate memory used by
+    its values, the least recently used entries are evicted first to stay within
+    both bounds.
+
+    Keys have to include the version of the data the values were read from, so
+    writes invalidate the entries implicitly by bumping the version and stale
+    entries just age out. Cached values are shared between requests, so they must
+    not be modified. Hits, misses and evictions are counted on the metrics as
+    ``cache.<name>.hits``, ``cache.<name>.misses`` and ``cache.<name>.evictions``
+    """
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int):
+        """
+        :param name: Name of the cache on the metrics
+        :param max_entries: Maximum number of entries, 0 disables the cache
+        :param max_bytes: Maximum approximate size of all the values, in bytes
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        _caches.add(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        """Fraction of the lookups that were found on the cache, 0 without lookups"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_or_set(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Get the value of a key, loading and storing it if it is not on the cache.
+        Exceptions raised by load are propagated and nothing is stored
+
+        :param key: Key of the value, including the version of its data
+        :param load: Function that loads the value when it is not on the cache
+        :return: The value of the key
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            metrics.increment(f"cache.{self.name}.hits")
+            return entry[0]
+
+        with self._lock:
+            self.misses += 1
+        metrics.increment(f"cache.{self.name}.misses")
+
+        value = load()
+        self.set(key, value)
+
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store the value of a key, evicting the least recently used entries if the
+        cache goes over its bounds. Values bigger than the whole cache are not stored
+
+        :param key: Key of the value, including the version of its data
+        :param value: Value to store
+        """
+        size = sizeof(value)
+        if not self.max_entries or size > self.max_bytes:
+            return
+
+        evicted = 0
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][1]
+                evicted += 1
+        if evicted:
+            metrics.increment(f"cache.{self.name}.evictions", evicted)
+
+    def clear(self) -> None:
+        """Remove all the entries of the cache"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+def clear_caches() -> None:
+    """Remove all the entries of every cache of the process, for when the versions
+    of the data start over, like after rebuilding the database"""
+    for cache in list(_caches):
+        cache.clear()
+
+
+def sizeof(value: Any) -> int:
+    """Approximate size in bytes of a value made of dictionaries, lists, tuples and
+    scalars, counting the containers and everything they hold"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(sizeof(v) for v in value)
+    return size
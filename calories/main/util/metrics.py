@@ -0,0 +1,30 @@
+"""
+This module contains in-process counters used to expose operational metrics
+"""
+from collections import Counter
+from threading import Lock
+from typing import Dict
+
+_counters = Counter()
+_lock = Lock()
+
+
+def increment(name: str, value: int = 1) -> None:
+    """Increment a counter
+
+    :param name: Name of the counter
+    :param value: Amount to add to the counter
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def get(name: str) -> int:
+    """Get the current value of a counter, 0 if it was never incremented"""
+    return _counters[name]
+
+
+def snapshot() -> Dict[str, int]:
+    """Get a copy of all the counters"""
+    with _lock:
+        return dict(_counters)
@@ -0,0 +1,191 @@
+"""
+This module contains the transactional outbox: the changes to the users and their
+meals are appended to it in the same transaction as the change itself, and relayed
+from it to a sink downstream
+"""
+import datetime
+import json
+import os
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from sqlalchemy import func
+
+from calories.main import db
+from calories.main.models.models import OutboxEvent, OutboxOffset
+from calories.main.util import metrics
+
+EventType = Dict[str, Any]
+
+# Id of the only row of the offset, there is a single sink
+OFFSET_ID = 1
+
+
+class SinkError(Exception):
+    """The sink could not take a batch of events, they are relayed again later"""
+
+
+class FileSink:
+    """Sink that appends the events as NDJSON to a local file"""
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the file, it is created if it does not exist
+        """
+        self.name = f"file://{path}"
+        self.path = path
+
+    def send(self, events: List[EventType]) -> None:
+        """Append a batch of events to the file and flush it to disk
+
+        :param events: Events to append
+        :raises SinkError: If the file cannot be written
+        """
+        lines = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in events)
+        try:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(lines)
+                file.flush()
+                os.fsync(file.fileno())
+        except OSError as e:
+            raise SinkError(f"Events not written to '{self.path}': {e}")
+
+
+class HTTPSink:
+    """Sink that posts the events as NDJSON to an HTTP endpoint, any 2xx response
+    acknowledges the whole batch"""
+
+    def __init__(self, url: str, timeout: float = 10):
+        """
+        :param url: URL the batches are posted to
+        :param timeout: Seconds to wait for the endpoint
+        """
+        self.name = url
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, events: List[EventType]) -> None:
+        """Post a batch of events to the endpoint
+
+        :param events: Events to post
+        :raises SinkError: If the endpoint does not acknowledge them
+        """
+        lines = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in events)
+        try:
+            response = requests.post(
+                self.url,
+                data=lines.encode(),
+                headers={"Content-Type": "application/x-ndjson"},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise SinkError(f"Events not posted to '{self.url}': {e}")
+
+
+def get_sink(url: str) -> Any:
+    """Get the sink for a URL, a file:// URL for a FileSink or an http:// or
+    https:// one for an HTTPSink
+
+    :param url: URL of the sink
+    :return: The sink
+    :raises ValueError: If the scheme of the URL is not supported
+    """
+    scheme = urlparse(url).scheme
+    if scheme == "file":
+        return FileSink(url[len("file://"):])
+    if scheme in ("http", "https"):
+        return HTTPSink(url)
+    raise ValueError(f"Unknown sink: '{url}', use a file:// or http:// URL")
+
+
+def append_event(topic: str, data: Dict[str, Any]) -> None:
+    """Append an event to the outbox. It does not commit changes to the database so
+    the event is part of the same transaction as the change itself
+
+    :param topic: Topic of the event, like the kind of data that changed
+    :param data: Contents of the event, it has to be serializable as JSON
+    """
+    db.session.execute(
+        OutboxEvent.__table__.insert(),
+        {
+            "topic": topic,
+            "payload": json.dumps(data, separators=(",", ":")),
+            "created_at": datetime.datetime.utcnow(),
+        },
+    )
+
+
+def relay_outbox(sink: Any, batch_size: int = 500) -> int:
+    """Relay the oldest batch of events of the outbox to a sink. The events are
+    removed and the offset moved past them in the same transaction, only after the
+    sink acknowledges them, so every event is delivered at least once: a relay that fails after sending a batch sends it again and
+    consumers have to deduplicate by the id of the events. The batch is locked on
+    databases that support it, so several relays can run at once, all of them have
+    to send to the same sink as every event is removed once delivered to any
+
+    :param sink: Sink to send the events to
+    :param batch_size: Maximum number of events relayed
+    :return: The number of events relayed
+    :raises SinkError: If the sink does not acknowledge the batch, it is kept then
+    """
+    rows = (
+        db.session.query(OutboxEvent)
+            .order_by(OutboxEvent.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+    )
+    if not rows:
+        db.session.rollback()
+        return 0
+
+    events = [
+        {
+            "id": row.id,
+            "topic": row.topic,
+            "created_at": row.created_at.isoformat(),
+            "data": json.loads(row.payload),
+        }
+        for row in rows
+    ]
+    try:
+        sink.send(events)
+    except SinkError:
+        db.session.rollback()
+        raise
+
+    db.session.query(OutboxEvent).filter(
+        OutboxEvent.id.in_([row.id for row in rows])
+    ).delete(synchronize_session=False)
+    offset = (
+        db.session.query(OutboxOffset)
+            .filter(OutboxOffset.id == OFFSET_ID)
+            .with_for_update()
+            .one_or_none()
+    )
+    if offset is None:
+        offset = OutboxOffset(id=OFFSET_ID, position=0, delivered=0)
+        db.session.add(offset)
+    offset.sink = sink.name
+    offset.position = max(offset.position, rows[-1].id)
+    offset.delivered += len(rows)
+    offset.updated_at = datetime.datetime.utcnow()
+    db.session.commit()
+    metrics.increment("outbox.relayed", len(rows))
+
+    return len(rows)
+
+
+def get_backlog() -> int:
+    """Get the number of events waiting on the outbox"""
+    return db.session.query(func.count(OutboxEvent.id)).scalar()
+
+
+def get_offset() -> Optional[OutboxOffset]:
+    """Get the offset of the sink, with the id of the last event it acknowledged
+
+    :return: The offset, None if no event was relayed yet
+    """
+    return db.session.query(OutboxOffset).get(OFFSET_ID)
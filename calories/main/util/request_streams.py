@@ -0,0 +1,32 @@
+"""
+This module contains the request class that leaves the NDJSON and CSV documents sent
+on the request bodies to be read as streams
+"""
+from typing import Union
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from calories.main.util.streams import FORMATS
+
+
+class StreamedRequest(Request):
+    """Request whose NDJSON and CSV bodies are never loaded in memory. Their data is
+    empty, also for connexion, which reads it for every request, so their handlers
+    parse them from request.stream as they are received. Bodies longer than
+    MAX_CONTENT_LENGTH are rejected before that
+    """
+
+    def get_data(
+            self, cache: bool = True, as_text: bool = False, parse_form_data: bool = False
+    ) -> Union[bytes, str]:
+        if self.mimetype not in FORMATS:
+            return super().get_data(cache, as_text, parse_form_data)
+
+        if (
+                self.max_content_length is not None
+                and (self.content_length or 0) > self.max_content_length
+        ):
+            raise RequestEntityTooLarge()
+
+        return "" if as_text else b""
@@ -0,0 +1,32 @@
+"""
+This module contains the session that routes the reads of a request to a read
+replica of the database
+"""
+from typing import Any
+
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import TextClause, UpdateBase
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends the queries to the engine of the read replica set on
+    ``info["replica"]``, if any, while flushes, writes and textual statements, which
+    may be writes too, always go to the primary"""
+
+    def get_bind(self, mapper: Any = None, clause: Any = None) -> Any:
+        replica = self.info.get("replica")
+        if (
+                replica is not None
+                and not self._flushing
+                and not isinstance(clause, (UpdateBase, TextClause))
+        ):
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy extension whose sessions are RoutingSessions"""
+
+    def create_session(self, options: Any) -> orm.sessionmaker:
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
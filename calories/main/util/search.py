@@ -0,0 +1,47 @@
+"""
+This module contains the full-text search over the name and description of the meals
+"""
+import re
+
+from sqlalchemy import column, false, literal_column, table
+from sqlalchemy.orm import Query
+from sqlalchemy.sql import func
+
+from calories.main import db
+from calories.main.models.models import Meal
+
+TS_CONFIG = "english"
+
+meal_fts = table("meal_fts", column("rowid"), column("rank"))
+
+
+def apply_search(query: Query, terms: str) -> Query:
+    """Restrict a query over the meals to the ones whose name or description contain
+    all the terms, ordered from the best to the worst match. It uses the FTS5 table
+    on SQLite and the tsvector GIN index on Postgres, words are stemmed on both
+
+    :param query: Query over the meals
+    :param terms: Words to search for
+    :return: The query restricted to the matching meals
+    """
+    words = re.findall(r"\w+", terms or "")
+    if not words:
+        return query.filter(false())
+
+    if db.session.get_bind().dialect.name == "sqlite":
+        # Every word is quoted so no character has a meaning on the FTS5 syntax
+        match = " ".join(f'"{w}"' for w in words)
+        return (
+            query.join(meal_fts, meal_fts.c.rowid == Meal.id)
+                .filter(literal_column("meal_fts").match(match))
+                .order_by(meal_fts.c.rank, Meal.id)
+        )
+
+    document = func.to_tsvector(
+        TS_CONFIG,
+        func.coalesce(Meal.name, "") + " " + func.coalesce(Meal.description, ""),
+    )
+    tsquery = func.plainto_tsquery(TS_CONFIG, " ".join(words))
+    return query.filter(document.op("@@")(tsquery)).order_by(
+        func.ts_rank(document, tsquery).desc(), Meal.id
+    )
@@ -0,0 +1,91 @@
+"""
+This module contains fast serializers that turn database rows into dictionaries
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import Date, DateTime, Time
+
+from calories.main import db
+
+RowType = Sequence[Any]
+
+ISOFORMAT_TYPES = (Date, DateTime, Time)
+
+
+class RowSerializer:
+    """Serializer for the rows of a model, generated once from the model columns.
+
+    It produces the same output as dumping the model with its ModelSchema, but it
+    works on plain row tuples holding the values of ``columns`` in order, so the
+    per row cost is a single call to a precompiled function
+    """
+
+    def __init__(self, model: db.Model, exclude: Iterable[str] = ()):
+        """
+        :param model: Model whose columns are serialized
+        :param exclude: Attributes of the model that are left out of the output
+        """
+        self.model = model
+        self.exclude = tuple(exclude)
+        props = [
+            prop
+            for prop in model.__mapper__.column_attrs
+            if prop.key not in self.exclude
+        ]
+        self.fields = tuple(prop.key for prop in props)
+        self.columns = tuple(getattr(model, prop.key) for prop in props)
+        self.dump_row = _compile_dump_row(
+            self.fields,
+            [isinstance(prop.columns[0].type, ISOFORMAT_TYPES) for prop in props],
+        )
+        self._subsets = {}
+
+    def only(self, fields: Optional[Iterable[str]]) -> "RowSerializer":
+        """Get a serializer for a subset of the fields, its columns can be used to
+        select just what is going to be serialized. Serializers are generated once
+        per subset of fields
+
+        :param fields: Fields to serialize, all of them if it is empty or None
+        :return: The serializer for the given fields
+        :raises ValueError: If any of the fields is not serialized by this serializer
+        """
+        if not fields:
+            return self
+
+        fields = frozenset(fields)
+        if fields not in self._subsets:
+            unknown = fields.difference(self.fields)
+            if unknown:
+                raise ValueError(", ".join(f"'{f}'" for f in sorted(unknown)))
+            exclude = self.exclude + tuple(f for f in self.fields if f not in fields)
+            self._subsets[fields] = RowSerializer(self.model, exclude)
+
+        return self._subsets[fields]
+
+    def dump(self, rows: Iterable[RowType]) -> List[Dict[str, Any]]:
+        """Serialize a list of rows"""
+        return list(map(self.dump_row, rows))
+
+
+def _compile_dump_row(
+        fields: Sequence[str], isoformat: Sequence[bool]
+) -> Callable[[RowType], Dict[str, Any]]:
+    """Generate the source of a function that builds the dictionary for a row
+    and compile it
+
+    :param fields: Names of the fields in the order they appear on the rows
+    :param isoformat: Whether the value of each field is serialized as ISO 8601
+    :return: The compiled function
+    """
+    items = []
+    for i, (field, iso) in enumerate(zip(fields, isoformat)):
+        value = f"row[{i}]"
+        if iso:
+            value = f"None if {value} is None else {value}.isoformat()"
+        items.append(f"{field!r}: {value}")
+    source = "def dump_row(row):\n    return {%s}\n" % ", ".join(items)
+
+    namespace = {}
+    exec(compile(source, "<dump_row>", "exec"), namespace)
+
+    return namespace["dump_row"]
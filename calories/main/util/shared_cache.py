@@ -0,0 +1,179 @@
+"""
+This module contains a cache kept in shared memory, so it is shared by all the
+worker processes of the same machine
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from threading import Lock
+from typing import Any, Optional, Tuple
+
+from calories.main.util import metrics
+
+# Generation, expiration time, checksum and length of the payload of every slot
+HEADER = struct.Struct("<QdIH")
+
+
+class SharedCache:
+    """Hash table of JSON values kept on a memory mapped file, like one on /dev/shm,
+    with a fixed number of slots of a fixed size. Every key is stored on the slot
+    given by its hash, replacing whatever was there, and values that do not fit on a
+    slot are not stored.
+
+    Reads take no locks: a slot is copied at once and discarded if its checksum
+    does not match, as it was being written meanwhile. Writes lock the slot with
+    fcntl, so they are serialized across processes. Deleting a key bumps the
+    generation of its slot, so a value read from the database before the deletion
+    is not stored after it. Entries expire after the given time to live, which
+    bounds how long a change that does not delete its key stays unnoticed.
+
+    The file is opened on first use, so every process maps it on its own. Hits and
+    misses are counted on the metrics as ``shared_cache.<name>.hits`` and
+    ``shared_cache.<name>.misses``
+    """
+
+    def __init__(
+            self, name: str, path: str, slots: int, slot_size: int = 256, ttl: float = 60
+    ):
+        """
+        :param name: Name of the cache on the metrics
+        :param path: Path of the file shared by the processes, without the suffix
+        with the layout of the slots
+        :param slots: Number of slots of the table, 0 disables the cache
+        :param slot_size: Size in bytes of every slot, including its header
+        :param ttl: Seconds an entry is valid for after it is stored
+        """
+        self.name = name
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self._fd = None
+        self._mm = None
+        self._lock = Lock()
+
+    def lookup(self, key: str) -> Tuple[Optional[Any], int]:
+        """Get the value of a key
+
+        :param key: Key of the value
+        :return: The value or None if it is not on the cache, and the generation of
+        its slot, which has to be given to set when storing a value after a miss
+        """
+        if not self.slots:
+            return None, 0
+
+        offset = self._offset(key)
+        data = self._map()[offset: offset + self.slot_size]
+        generation, expires, checksum, length = HEADER.unpack_from(data)
+        payload = data[HEADER.size: HEADER.size + length]
+        if length and expires > time.time() and zlib.crc32(payload) == checksum:
+            try:
+                stored_key, value = json.loads(payload)
+            except ValueError:
+                stored_key = value = None
+            if stored_key == key:
+                metrics.increment(f"shared_cache.{self.name}.hits")
+                return value, generation
+
+        metrics.increment(f"shared_cache.{self.name}.misses")
+        return None, generation
+
+    def set(self, key: str, value: Any, generation: int) -> None:
+        """Store the value of a key, unless the key was deleted since the lookup that
+        returned the generation
+
+        :param key: Key of the value
+        :param value: Value to store, it has to be serializable as JSON
+        :param generation: Generation returned by lookup before reading the value
+        """
+        if not self.slots:
+            return
+
+        payload = json.dumps([key, value], separators=(",", ":")).encode()
+        if HEADER.size + len(payload) > self.slot_size:
+            return
+
+        offset = self._offset(key)
+        with self._locked(offset):
+            if HEADER.unpack_from(self._mm, offset)[0] != generation:
+                return
+            header = HEADER.pack(
+                generation, time.time() + self.ttl, zlib.crc32(payload), len(payload)
+            )
+            self._mm[offset: offset + len(header) + len(payload)] = header + payload
+
+    def delete(self, key: str) -> None:
+        """Remove a key from the cache, in every process
+
+        :param key: Key to remove
+        """
+        if self.slots:
+            self._invalidate(self._offset(key))
+
+    def clear(self) -> None:
+        """Remove all the keys from the cache, in every process"""
+        if self.slots:
+            with self._locked(0, self.slots * self.slot_size):
+                for slot in range(self.slots):
+                    self._empty(slot * self.slot_size)
+
+    def _invalidate(self, offset: int) -> None:
+        """Empty a slot and bump its generation"""
+        with self._locked(offset):
+            self._empty(offset)
+
+    def _empty(self, offset: int) -> None:
+        """Empty a slot and bump its generation, the slot has to be locked"""
+        generation = HEADER.unpack_from(self._mm, offset)[0]
+        self._mm[offset: offset + HEADER.size] = HEADER.pack(generation + 1, 0, 0, 0)
+
+    def _offset(self, key: str) -> int:
+        """Offset of the slot of a key on the file"""
+        return zlib.crc32(key.encode()) % self.slots * self.slot_size
+
+    def _locked(self, offset: int, length: int = None) -> "_SlotLock":
+        """Lock a slot, or the given length of the file, against the threads of this
+        process and other processes"""
+        self._map()
+        return _SlotLock(self._lock, self._fd, offset, length or self.slot_size)
+
+    def _map(self) -> mmap.mmap:
+        """Map the file, creating it if needed. Its name includes the layout of the
+        slots, so processes configured differently never share the same file"""
+        if self._mm is None:
+            with self._lock:
+                if self._mm is None:
+                    size = self.slots * self.slot_size
+                    path = f"{self.path}.{self.slots}x{self.slot_size}"
+                    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                    fcntl.lockf(fd, fcntl.LOCK_EX)
+                    try:
+                        if os.fstat(fd).st_size < size:
+                            os.ftruncate(fd, size)
+                    finally:
+                        fcntl.lockf(fd, fcntl.LOCK_UN)
+                    self._fd = fd
+                    self._mm = mmap.mmap(fd, size)
+        return self._mm
+
+
+class _SlotLock:
+    """Context manager that holds the thread lock and the fcntl lock of a slot"""
+
+    def __init__(self, lock: Lock, fd: int, offset: int, length: int):
+        self.lock = lock
+        self.fd = fd
+        self.offset = offset
+        self.length = length
+
+    def __enter__(self) -> None:
+        self.lock.acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, self.length, self.offset)
+
+    def __exit__(self, *exc_info: Any) -> None:
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, self.length, self.offset)
+        self.lock.release()
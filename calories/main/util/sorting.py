@@ -0,0 +1,35 @@
+"""
+This module contains the sorting of the lists by a whitelist of orderings
+"""
+from typing import Dict, List, Sequence
+
+from sqlalchemy.sql import ColumnElement
+
+Orderings = Dict[str, Sequence[ColumnElement]]
+
+
+def get_ordering(orderings: Orderings, sort: str) -> List[ColumnElement]:
+    """Get the ORDER BY clauses of a sort parameter, a comma separated list of
+    fields of one of the orderings, all of them prefixed with '-' to sort
+    descending. Mixed directions are not allowed so every ordering can be read
+    from its index backwards
+
+    :param orderings: Allowed orderings, keyed by their fields in ascending order
+    and with a unique tiebreaker column at the end if the fields are not unique
+    :param sort: Sort parameter, e.g. '-date,-time'
+    :return: The clauses to order by
+    :raises ValueError: If the sort parameter is not one of the orderings
+    """
+    fields = sort.replace(" ", "").split(",")
+    descending = fields[0].startswith("-")
+    if any(f.startswith("-") != descending for f in fields):
+        raise ValueError(f"Sort '{sort}' mixes ascending and descending fields")
+
+    columns = orderings.get(",".join(f.lstrip("-") for f in fields))
+    if columns is None:
+        raise ValueError(
+            f"Sort '{sort}' is not allowed, use one of: "
+            f"{', '.join(repr(o) for o in orderings)} with or without '-'"
+        )
+
+    return [c.desc() if descending else c.asc() for c in columns]
@@ -0,0 +1,222 @@
+"""
+This module contains SQL and session helpers the ORM does not provide out of the box
+"""
+import csv
+import io
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+from sqlalchemy import Date, Table, bindparam, text
+from sqlalchemy.engine import RowProxy, Transaction
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from calories.main import db
+
+GRANULARITIES = ("day", "week", "month")
+
+
+def update_returning(
+        table: Table, values: Dict[str, Any], **criteria: Any
+) -> RowProxy:
+    """Update the rows of a table and return the new contents of the updated row
+    using one ``UPDATE ... WHERE ... RETURNING ...`` statement
+
+    SQLAlchemy only emits RETURNING for some dialects, so the statement is written
+    as text, keeping the column types for both parameters and results. It is
+    supported by Postgres and by SQLite 3.35 onwards
+
+    :param table: Table to update
+    :param values: New values for the columns, keyed by column name
+    :param criteria: Equality conditions for the WHERE clause, keyed by column name
+    :return: The updated row or None if no row matched the criteria
+    """
+    preparer = db.session.get_bind().dialect.identifier_preparer
+    assignments = ", ".join(f"{preparer.quote(c)} = :{c}" for c in values)
+    conditions = " AND ".join(f"{preparer.quote(c)} = :w_{c}" for c in criteria)
+    returning = ", ".join(preparer.quote(c.name) for c in table.columns)
+
+    statement = (
+        text(
+            f"UPDATE {preparer.format_table(table)} SET {assignments} "
+            f"WHERE {conditions} RETURNING {returning}"
+        )
+        .bindparams(*(bindparam(c, type_=table.c[c].type) for c in values))
+        .bindparams(*(bindparam(f"w_{c}", type_=table.c[c].type) for c in criteria))
+        .columns(*table.columns)
+    )
+    params = {**values, **{f"w_{c}": v for c, v in criteria.items()}}
+
+    return db.session.execute(statement, params).first()
+
+
+def commit_without_expire() -> None:
+    """Commit the current transaction without expiring the objects of the session,
+    so freshly written objects can be serialized from the values already in memory
+    instead of being selected again from the database
+    """
+    session = db.session()
+    expire_on_commit = session.expire_on_commit
+    session.expire_on_commit = False
+    try:
+        session.commit()
+    finally:
+        session.expire_on_commit = expire_on_commit
+
+
+@contextmanager
+def single_transaction() -> Iterator[Transaction]:
+    """Run a block in a single transaction, even if it commits the session several
+    times. The session of the block is bound to a connection whose transaction is
+    only committed when the block ends, so commits inside it just end a
+    subtransaction, and the after_commit listeners of the session are run again
+    then. Any rollback inside the block, or rolling back the transaction given to
+    it, rolls back everything and leaves the transaction inactive, so the block
+    should stop using the database then
+
+    :return: A context manager that gives the transaction to the block
+    """
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    session = db.create_session({"bind": connection, "binds": {}})()
+    session.info["single_transaction"] = True
+    db.session.registry.set(session)
+    try:
+        yield transaction
+        if transaction.is_active:
+            transaction.commit()
+            del session.info["single_transaction"]
+            session.dispatch.after_commit(session)
+    finally:
+        if transaction.is_active:
+            transaction.rollback()
+        session.close()
+        db.session.registry.clear()
+        connection.close()
+
+
+def bulk_insert(
+        table: Table,
+        columns: Sequence[str],
+        rows: Iterable[Sequence[Any]],
+        batch_size: int = 1000,
+) -> int:
+    """Insert rows into a table as part of the current transaction. The rows are
+    consumed as they are inserted, streamed through ``COPY`` on Postgres and
+    inserted in batches with ``executemany`` on any other database
+
+    :param table: Table to insert the rows into
+    :param columns: Name of the columns of the values of the rows
+    :param rows: Rows to insert, with their values in the order of columns
+    :param batch_size: Number of rows of every batch
+    :return: The number of rows inserted
+    """
+    connection = db.session.connection()
+
+    if connection.dialect.name == "postgresql":
+        preparer = connection.dialect.identifier_preparer
+        statement = (
+            f"COPY {preparer.format_table(table)} "
+            f"({', '.join(preparer.quote(c) for c in columns)}) "
+            f"FROM STDIN WITH (FORMAT csv)"
+        )
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(statement, _CSVFile(rows))
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+    count = 0
+    for batch in batches(rows, batch_size):
+        connection.execute(table.insert(), [dict(zip(columns, r)) for r in batch])
+        count += len(batch)
+
+    return count
+
+
+class _CSVFile(io.TextIOBase):
+    """Read-only file that writes the rows as CSV lazily, as it is read"""
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = ""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row)
+            self._pending += self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+
+        return data
+
+    def readline(self, size: int = -1) -> str:
+        return self.read(size)
+
+
+def batches(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Split an iterable in lists of the given size, consuming it lazily
+
+    :param items: Items to split
+    :param size: Number of items of every list, the last one may be shorter
+    :return: An iterator over the lists
+    """
+    items = iter(items)
+    batch = list(islice(items, size))
+    while batch:
+        yield batch
+        batch = list(islice(items, size))
+
+
+class date_bucket(FunctionElement):
+    """First day of the bucket a date belongs to, for buckets of a day, an ISO week
+    starting on Monday or a month. It is compiled to the date functions of every
+    database so dates can be grouped in SQL
+
+    :param granularity: Size of the buckets, one of GRANULARITIES
+    :param column: Date to get the bucket of
+    """
+
+    type = Date()
+    name = "date_bucket"
+
+    def __init__(self, granularity: str, column: Any):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity: '{granularity}'")
+        self.granularity = granularity
+        super().__init__(column)
+
+
+@compiles(date_bucket)
+def _compile_date_bucket(element: date_bucket, compiler: Any, **kw: Any) -> str:
+    column = compiler.process(element.clauses, **kw)
+    if element.granularity == "day":
+        return column
+    return f"CAST(date_trunc('{element.granularity}', {column}) AS DATE)"
+
+
+@compiles(date_bucket, "sqlite")
+def _compile_date_bucket_sqlite(
+        element: date_bucket, compiler: Any, **kw: Any
+) -> str:
+    column = compiler.process(element.clauses, **kw)
+    modifiers = {
+        "day": "",
+        "week": ", 'weekday 0', '-6 days'",
+        "month": ", 'start of month'",
+    }
+    return f"date({column}{modifiers[element.granularity]})"
@@ -0,0 +1,104 @@
+"""
+This module contains readers and writers that stream rows as NDJSON or CSV documents
+"""
+import csv
+import io
+import json
+from typing import Any, Dict, Iterable, Iterator, Sequence, Tuple
+
+RowDict = Dict[str, Any]
+
+MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+FORMATS = {mimetype: format for format, mimetype in MIMETYPES.items()}
+
+
+class ParseError(ValueError):
+    """A line of a document could not be parsed"""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def read_rows(lines: Iterable[str], format: str) -> Iterator[Tuple[int, RowDict]]:
+    """Read the rows of a document in the selected format, parsing every line as it
+    is consumed so the whole document is never held in memory. Empty CSV values
+    are left out of the rows
+
+    :param lines: Lines of the document
+    :param format: Format of the document, either 'ndjson' or 'csv'
+    :return: The number of the line where every row is and the row itself
+    :raises ParseError: If a line is not a valid row
+    """
+    if format == "csv":
+        return _read_csv(lines)
+    return _read_ndjson(lines)
+
+
+def _read_ndjson(lines: Iterable[str]) -> Iterator[Tuple[int, RowDict]]:
+    """Read every non empty line as a JSON object"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise ParseError(number, f"Invalid JSON, {e}")
+        if not isinstance(row, dict):
+            raise ParseError(number, "Rows must be JSON objects")
+        yield number, row
+
+
+def _read_csv(lines: Iterable[str]) -> Iterator[Tuple[int, RowDict]]:
+    """Read the rows of a CSV document with a header with the name of the fields"""
+    reader = csv.DictReader(lines)
+    for row in reader:
+        if None in row or None in row.values():
+            raise ParseError(reader.line_num, "Wrong number of values")
+        yield reader.line_num, {k: v for k, v in row.items() if v != ""}
+
+
+def write_rows(
+        rows: Iterable[RowDict], fields: Sequence[str], format: str, batch_size: int
+) -> Iterator[str]:
+    """Write rows in the selected format, yielding the document in chunks of
+    batch_size rows so the whole document is never held in memory
+
+    :param rows: Rows to write
+    :param fields: Fields of the rows, in the order they are written to CSV
+    :param format: Format of the document, either 'ndjson' or 'csv'
+    :param batch_size: Number of rows of every chunk
+    :return: The chunks of the document
+    """
+    if format == "csv":
+        return _write_csv(rows, fields, batch_size)
+    return _write_ndjson(rows, batch_size)
+
+
+def _write_ndjson(rows: Iterable[RowDict], batch_size: int) -> Iterator[str]:
+    """Write every row as a JSON document on its own line"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, sort_keys=True))
+        lines.append("\n")
+        if len(lines) >= 2 * batch_size:
+            yield "".join(lines)
+            lines.clear()
+    if lines:
+        yield "".join(lines)
+
+
+def _write_csv(
+        rows: Iterable[RowDict], fields: Sequence[str], batch_size: int
+) -> Iterator[str]:
+    """Write the rows as CSV, with a header with the name of the fields"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\n")
+    writer.writeheader()
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
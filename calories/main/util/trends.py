@@ -0,0 +1,119 @@
+"""
+This module contains vectorized computations over series of daily calorie totals
+"""
+import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+WEEKDAYS = (
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+)
+
+# 1970-01-01, day 0 of numpy dates, was a Thursday
+EPOCH_WEEKDAY = 3
+
+
+def daily_series(
+        dates: Sequence[datetime.date],
+        totals: Sequence[int],
+        start: datetime.date,
+        end: datetime.date,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Spread the totals of the days with meals over every day of a range
+
+    :param dates: Days with meals, inside the range
+    :param totals: Calories of every day with meals
+    :param start: First day of the range
+    :param end: Last day of the range
+    :return: The days of the range, their calories and whether they have meals
+    """
+    days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+    index = (np.array(dates, dtype="datetime64[D]") - days[0]).astype(np.int64)
+
+    calories = np.zeros(len(days), dtype=np.int64)
+    calories[index] = totals
+    logged = np.zeros(len(days), dtype=bool)
+    logged[index] = True
+
+    return days, calories, logged
+
+
+def rolling_average(
+        calories: np.ndarray, logged: np.ndarray, window: int
+) -> np.ndarray:
+    """Average of the calories of the days with meals on the window of days ending
+    on every day, NaN where the window has no days with meals
+
+    :param calories: Calories of every day
+    :param logged: Whether every day has meals
+    :param window: Number of days of the window
+    :return: The rolling averages
+    """
+    sums = _window_sums(calories, window)
+    counts = _window_sums(logged.astype(np.int64), window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def longest_streak(under: np.ndarray) -> Optional[Tuple[int, int]]:
+    """Longest run of consecutive days under the daily limit
+
+    :param under: Whether every day has meals and is under the daily limit
+    :return: Index of the first and last days of the run or None if there is no run
+    """
+    edges = np.diff(np.concatenate(([0], under.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if not len(starts):
+        return None
+    longest = np.argmax(ends - starts)
+
+    return int(starts[longest]), int(ends[longest]) - 1
+
+
+def weekday_profile(
+        days: np.ndarray, calories: np.ndarray, logged: np.ndarray
+) -> List[Dict[str, Any]]:
+    """Average calories of the days with meals for every day of the week
+
+    :param days: Days of the series
+    :param calories: Calories of every day
+    :param logged: Whether every day has meals
+    :return: The day of the week, average and number of days with meals of
+    every day of the week, starting on Monday
+    """
+    weekdays = (days[logged].astype(np.int64) + EPOCH_WEEKDAY) % 7
+    counts = np.bincount(weekdays, minlength=7)
+    sums = np.bincount(weekdays, weights=calories[logged], minlength=7)
+
+    return [
+        {
+            "day": day,
+            "average": round(total / count, 2) if count else None,
+            "days": count,
+        }
+        for day, total, count in zip(WEEKDAYS, sums.tolist(), counts.tolist())
+    ]
+
+
+def to_list(values: np.ndarray) -> List[Optional[float]]:
+    """Round an array of averages for serialization, NaN becomes None"""
+    rounded = np.round(values, 2).astype(object)
+    rounded[np.isnan(values)] = None
+
+    return rounded.tolist()
+
+
+def _window_sums(values: np.ndarray, window: int) -> np.ndarray:
+    """Sum of the values on the window ending on every position"""
+    cumulative = np.concatenate(([0], np.cumsum(values)))
+    lagged = np.concatenate((np.zeros(window, dtype=cumulative.dtype), cumulative))
+
+    return cumulative[1:] - lagged[1:len(values) + 1]
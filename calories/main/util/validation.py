@@ -0,0 +1,127 @@
+"""
+This module contains the validator used to check the responses of the API against
+its specification
+"""
+import functools
+import logging
+import random
+from typing import Any, Dict, Tuple
+
+from connexion.decorators.response import ResponseValidator
+from connexion.decorators.validation import ResponseBodyValidator
+from connexion.exceptions import (
+    NonConformingResponse,
+    NonConformingResponseBody,
+    NonConformingResponseHeaders,
+)
+from flask import current_app
+from jsonschema import ValidationError
+
+from calories.main.util import metrics
+
+logger = logging.getLogger(__name__)
+
+ALWAYS = "always"
+SAMPLED = "sampled"
+OFF = "off"
+
+
+class SampledResponseValidator(ResponseValidator):
+    """Response validator that can be configured through RESPONSE_VALIDATION to
+    validate every response (always), just a fraction of them given by
+    RESPONSE_VALIDATION_RATE (sampled) or none of them (off).
+
+    Violations raise an error when validating every response, otherwise they are
+    logged and counted. Streamed responses are never validated, as that would
+    need to read them whole. The schema validators are compiled once per operation,
+    status code and content type instead of once per response
+    """
+
+    def __init__(self, operation, mimetype, validator=None):
+        super().__init__(operation, mimetype, validator)
+        self._body_validators: Dict[Tuple[str, str], ResponseBodyValidator] = {}
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def wrapper(request):
+            response = function(request)
+            if self._is_skipped(response):
+                return response
+
+            metrics.increment("response_validation.validated")
+            connexion_response = self.operation.api.get_connexion_response(
+                response, self.mimetype
+            )
+            self.validate_response(
+                connexion_response.body,
+                connexion_response.status_code,
+                connexion_response.headers,
+                request.url,
+            )
+
+            return response
+
+        return wrapper
+
+    @staticmethod
+    def _is_skipped(response: Any) -> bool:
+        """Check if a response is returned without validating it"""
+        mode = current_app.config["RESPONSE_VALIDATION"]
+        if mode == OFF or getattr(response, "is_streamed", False):
+            return True
+
+        rate = current_app.config["RESPONSE_VALIDATION_RATE"]
+        return mode == SAMPLED and random.random() >= rate
+
+    def validate_response(
+            self, data: Any, status_code: int, headers: Dict[str, str], url: str
+    ) -> bool:
+        """Validate a response, raising an error for violations only when every
+        response is validated
+
+        :param data: Body of the response
+        :param status_code: Status code of the response
+        :param headers: Headers of the response
+        :param url: Url of the request
+        :return: True if the response conforms to the specification
+        """
+        try:
+            self._validate(data, str(status_code), headers, url)
+        except NonConformingResponse as e:
+            metrics.increment("response_validation.violations")
+            if current_app.config["RESPONSE_VALIDATION"] == ALWAYS:
+                raise
+            logger.error(f"Response for '{url}' does not conform: {e.message}")
+            return False
+
+        return True
+
+    def _validate(
+            self, data: Any, status_code: str, headers: Dict[str, str], url: str
+    ) -> None:
+        """Same validation done by connexion but reusing the compiled validators"""
+        content_type = headers.get("Content-Type", self.mimetype).rsplit(";", 1)[0]
+
+        key = (status_code, content_type)
+        if key not in self._body_validators:
+            schema = self.operation.response_schema(status_code, content_type)
+            self._body_validators[key] = (
+                ResponseBodyValidator(schema, validator=self.validator)
+                if self.is_json_schema_compatible(schema)
+                else None
+            )
+        body_validator = self._body_validators[key]
+
+        if body_validator is not None:
+            try:
+                body_validator.validate_schema(self.operation.json_loads(data), url)
+            except ValidationError as e:
+                raise NonConformingResponseBody(message=str(e))
+
+        definition = self.operation.response_definition(status_code, content_type)
+        missing_keys = set((definition or {}).get("headers", {})) - set(headers)
+        if missing_keys:
+            raise NonConformingResponseHeaders(
+                message=f"Keys in header don't match response specification. "
+                        f"Difference: {', '.join(missing_keys)}"
+            )
@@ -1,4 +1,8 @@
+from contextlib import contextmanager
+from typing import Iterator, List
+
 from flask_testing import TestCase
+from sqlalchemy import event
 
 from calories.main import db
 from calories.main.build_database import build_db, populate_db
@@ -18,3 +22,18 @@ class BaseTestCase(TestCase):
 
     def tearDown(self):
         db.session.remove()
+
+
+@contextmanager
+def record_queries() -> Iterator[List[str]]:
+    """Record the SQL statements sent to the database inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
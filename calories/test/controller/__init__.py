@@ -26,6 +26,9 @@ class TestAPI(BaseTestCase):
     def put(self, path: str, data, headers: HeaderType = None):
         return self.client.put(path, data=json.dumps(data), content_type='application/json', headers=headers)
 
+    def patch(self, path: str, data, headers: HeaderType = None):
+        return self.client.patch(path, data=json.dumps(data), content_type='application/json', headers=headers)
+
     def _login(self, username: str = 'admin', password: str = 'admin1234') -> str:
         path = 'api/login'
         request_data = {'username': username, 'password': password}
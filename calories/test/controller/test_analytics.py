@@ -0,0 +1,249 @@
+"""Test module for calories.main.controller.analytics"""
+import unittest
+
+from calories.main.controller.helpers.analytics import refresh_rollups
+from calories.test.controller import TestAPI
+
+
+class TestAnalytics(TestAPI):
+    """Test class for calories.main.controller.analytics"""
+
+    def _add_meal(self, date: str, calories: int) -> None:
+        path = "/".join([self.path, "users", "user1", "meals"])
+        response = self.post(
+            path,
+            {"date": date, "time": "10:00:00", "name": "apple", "calories": calories},
+            self._get_headers("user1", "pass_user1"),
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_summary_day(self):
+        """Daily totals flag the days over the limit"""
+        path = "/".join([self.path, "users", "user1", "summary"])
+        with self.client:
+            self._add_meal("2020-02-20", 100)
+            response = self.get(path, self._get_headers("user1", "pass_user1"))
+            self._check_succes(
+                [
+                    {
+                        "date": "2020-02-11",
+                        "calories": 2600,
+                        "meals": 2,
+                        "days": 1,
+                        "days_over_limit": 1,
+                        "over_limit": True,
+                    },
+                    {
+                        "date": "2020-02-20",
+                        "calories": 100,
+                        "meals": 1,
+                        "days": 1,
+                        "days_over_limit": 0,
+                        "over_limit": False,
+                    },
+                ],
+                response,
+                200,
+            )
+
+    def test_summary_week_month(self):
+        """Weeks start on Monday and months on their first day"""
+        path = "/".join([self.path, "users", "user1", "summary"])
+        with self.client:
+            self._add_meal("2020-02-16", 100)
+            headers = self._get_headers()
+            response = self.get(path + "?granularity=week", headers)
+            self._check_succes(
+                [
+                    {
+                        "date": "2020-02-10",
+                        "calories": 2700,
+                        "meals": 3,
+                        "days": 2,
+                        "days_over_limit": 1,
+                        "over_limit": True,
+                    }
+                ],
+                response,
+                200,
+            )
+            response = self.get(path + "?granularity=month", headers)
+            self.assertEqual(response.json["data"][0]["date"], "2020-02-01")
+
+    def test_summary_range(self):
+        """Only the dates in the range are summarized"""
+        path = "/".join([self.path, "users", "user1", "summary"])
+        with self.client:
+            self._add_meal("2020-02-20", 100)
+            response = self.get(
+                path + "?from=2020-02-12&to=2020-02-20", self._get_headers()
+            )
+            self.assertEqual(
+                [bucket["date"] for bucket in response.json["data"]], ["2020-02-20"]
+            )
+
+            response = self.get(path + "?from=2020-02-12&to=2020-02-11", self._get_headers())
+            self._check_error(
+                response,
+                400,
+                "Bad Request",
+                "Date 'from': '2020-02-12' is after date 'to': '2020-02-11'",
+            )
+
+    def test_summary_wrong_granularity(self):
+        """Unknown granularities are rejected"""
+        path = "/".join([self.path, "users", "user1", "summary"])
+        with self.client:
+            response = self.get(path + "?granularity=year", self._get_headers())
+            self.assertEqual(response.status_code, 400)
+
+    def test_summary_user_others(self):
+        """User cannot read the summary of other users"""
+        path = "/".join([self.path, "users", "user2", "summary"])
+        with self.client:
+            response = self.get(path, self._get_headers("user1", "pass_user1"))
+            self._check_error(
+                response,
+                403,
+                "Forbidden",
+                "User 'user1' cannot perform the action for other user",
+            )
+
+    def test_trends(self):
+        """Averages only count days with meals, days without meals break streaks"""
+        path = "/".join([self.path, "users", "user1", "trends"])
+        with self.client:
+            for date, calories in [
+                ("2020-02-12", 1000),
+                ("2020-02-13", 1200),
+                ("2020-02-15", 900),
+            ]:
+                self._add_meal(date, calories)
+            response = self.get(path, self._get_headers("user1", "pass_user1"))
+            self.assertEqual(response.status_code, 200)
+            data = response.json["data"]
+            self.assertEqual(
+                [(d["date"], d["calories"], d["average_7"]) for d in data["daily"]],
+                [
+                    ("2020-02-11", 2600, 2600.0),
+                    ("2020-02-12", 1000, 1800.0),
+                    ("2020-02-13", 1200, 1600.0),
+                    ("2020-02-14", 0, 1600.0),
+                    ("2020-02-15", 900, 1425.0),
+                ],
+            )
+            self.assertEqual(
+                data["longest_streak"],
+                {"from": "2020-02-12", "to": "2020-02-13", "days": 2},
+            )
+            self.assertEqual(
+                data["weekdays"][1], {"day": "Tuesday", "average": 2600.0, "days": 1}
+            )
+            self.assertEqual(
+                data["weekdays"][0], {"day": "Monday", "average": None, "days": 0}
+            )
+
+    def test_trends_empty(self):
+        """Users without meals have no trends"""
+        path = "/".join([self.path, "users", "user1", "trends"])
+        with self.client:
+            response = self.get(path + "?from=2021-01-01", self._get_headers())
+            self._check_succes(
+                {"daily": [], "longest_streak": None, "weekdays": []}, response, 200
+            )
+
+    def test_trends_too_long(self):
+        """Ten years of meals have trends, ranges longer than TRENDS_MAX_DAYS are
+        rejected, open bounds included"""
+        path = "/".join([self.path, "users", "user1", "trends"])
+        with self.client:
+            response = self.get(path + "?from=2000-01-01&to=2021-01-01", self._get_headers())
+            self._check_error(
+                response,
+                400,
+                "Bad Request",
+                "Range from '2000-01-01' to '2021-01-01' is longer than 7320 days, "
+                "use 'from' and 'to' to narrow it",
+            )
+
+            self._add_meal("2030-02-11", 100)
+            response = self.get(path, self._get_headers())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json["data"]["daily"]), 3654)
+
+            self._add_meal("2041-01-01", 100)
+            response = self.get(path, self._get_headers())
+            self._check_error(
+                response,
+                400,
+                "Bad Request",
+                "Range from '2020-02-11' to '2041-01-01' is longer than 7320 days, "
+                "use 'from' and 'to' to narrow it",
+            )
+
+            response = self.get(path + "?from=2021-01-01", self._get_headers())
+            self.assertEqual(response.status_code, 200)
+
+    def test_fleet_analytics(self):
+        """Analytics are read from the rollups"""
+        self.assertEqual(refresh_rollups(full=True), 2)
+        with self.client:
+            response = self.get("api/analytics", self._get_headers("manager1", "pass_manager1"))
+            self._check_succes(
+                {
+                    "over_limit_users": [{"date": "2020-02-11", "users": 1}],
+                    "average_per_role": [{"role": "USER", "average": 1550.0, "users": 2}],
+                    "top_consumers": [
+                        {"username": "user1", "calories": 2600, "days": 1},
+                        {"username": "user2", "calories": 500, "days": 1},
+                    ],
+                    "pending_changes": 0,
+                },
+                response,
+                200,
+            )
+
+            response = self.get("api/analytics?top=1&from=2020-02-12", self._get_headers())
+            self.assertEqual(response.json["data"]["top_consumers"], [])
+
+    def test_fleet_analytics_incremental(self):
+        """Only the days with changes are refreshed"""
+        refresh_rollups(full=True)
+        with self.client:
+            headers = self._get_headers()
+            response = self.post(
+                "/".join([self.path, "users", "user2", "meals"]),
+                {"date": "2020-02-11", "name": "pizza", "calories": 2600},
+                headers,
+            )
+            self.assertEqual(response.status_code, 201)
+            response = self.delete("/".join([self.path, "users", "user1", "meals", "1"]), headers)
+            self.assertEqual(response.status_code, 200)
+
+            data = self.get("api/analytics", headers).json["data"]
+            self.assertEqual(data["pending_changes"], 2)
+            self.assertEqual(data["over_limit_users"], [{"date": "2020-02-11", "users": 1}])
+
+            self.assertEqual(refresh_rollups(), 2)
+            self.assertEqual(refresh_rollups(), 0)
+
+            data = self.get("api/analytics", headers).json["data"]
+            self.assertEqual(data["pending_changes"], 0)
+            self.assertEqual(data["over_limit_users"], [{"date": "2020-02-11", "users": 1}])
+            self.assertEqual(
+                data["top_consumers"],
+                [
+                    {"username": "user2", "calories": 3100, "days": 1},
+                    {"username": "user1", "calories": 2100, "days": 1},
+                ],
+            )
+
+    def test_fleet_analytics_user(self):
+        """Users cannot read the analytics of all the users"""
+        with self.client:
+            response = self.get("api/analytics", self._get_headers("user1", "pass_user1"))
+            self.assertEqual(response.status_code, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+"""Test module for calories.main.controller.batch"""
+import unittest
+from unittest.mock import patch
+
+from jose import jwt
+
+from calories.main.controller.helpers.users import user_records
+from calories.test.controller import TestAPI
+
+
+class TestBatch(TestAPI):
+    """Test class for calories.main.controller.batch"""
+
+    def _meal(self, name: str) -> dict:
+        return {
+            "method": "POST",
+            "path": "/users/user1/meals",
+            "body": {"date": "2020-02-12", "time": "10:00:00", "name": name, "calories": 100},
+        }
+
+    def _meal_names(self) -> list:
+        path = "/".join([self.path, "users", "user1", "meals"])
+        response = self.get(path, self._get_headers("user1", "pass_user1"))
+        return [m["name"] for m in response.json["data"]]
+
+    def test_batch(self):
+        """Operations run in order and independently, with the token decoded once"""
+        path = "/".join([self.path, "batch"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            operations = [
+                {"method": "GET", "path": "/users/user1"},
+                self._meal("apple"),
+                {"method": "GET", "path": "/users/user2/meals"},
+                {"method": "GET", "path": "/users/user1/days/2020-02-12"},
+            ]
+            with patch("calories.main.controller.auth.jwt.decode", wraps=jwt.decode) as decode:
+                response = self.post(path, {"operations": operations}, headers)
+            self.assertEqual(decode.call_count, 1)
+            self.assertEqual(response.status_code, 200)
+
+            data = response.json["data"]
+            self.assertFalse(data["rolled_back"])
+            results = data["results"]
+            self.assertEqual([r["status"] for r in results], [200, 201, 403, 200])
+            self.assertEqual(results[0]["body"]["data"]["username"], "user1")
+            self.assertEqual(results[1]["body"]["data"]["name"], "apple")
+            self.assertEqual(results[2]["body"]["title"], "Forbidden")
+            self.assertEqual([m["name"] for m in results[3]["body"]["data"]["meals"]], ["apple"])
+
+    def test_batch_atomic(self):
+        """Atomic batches are committed at once or rolled back at the first failure"""
+        path = "/".join([self.path, "batch"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            operations = [self._meal("apple"), self._meal("pear")]
+            response = self.post(path, {"operations": operations, "atomic": True}, headers)
+            results = response.json["data"]["results"]
+            self.assertEqual([r["status"] for r in results], [201, 201])
+            self.assertEqual(self._meal_names(), ["meal 1", "meal 2", "apple", "pear"])
+
+            operations = [
+                self._meal("banana"),
+                {"method": "DELETE", "path": "/users/user1/meals/100"},
+                self._meal("kiwi"),
+            ]
+            response = self.post(path, {"operations": operations, "atomic": True}, headers)
+            data = response.json["data"]
+            self.assertTrue(data["rolled_back"])
+            self.assertEqual([r["status"] for r in data["results"]], [201, 404])
+            self.assertEqual(self._meal_names(), ["meal 1", "meal 2", "apple", "pear"])
+
+    def test_batch_atomic_rolled_back_reads(self):
+        """Reads of a batch rolled back are not cached, their versions are reused by
+        the writes committed next"""
+        path = "/".join([self.path, "batch"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            operations = [
+                self._meal("phantom"),
+                {"method": "GET", "path": "/users/user1/meals"},
+                {"method": "DELETE", "path": "/users/user1/meals/100"},
+            ]
+            response = self.post(path, {"operations": operations, "atomic": True}, headers)
+            data = response.json["data"]
+            self.assertTrue(data["rolled_back"])
+            names = [m["name"] for m in data["results"][1]["body"]["data"]]
+            self.assertEqual(names, ["meal 1", "meal 2", "phantom"])
+
+            meals_path = "/".join([self.path, "users", "user1", "meals"])
+            self.patch(meals_path + "/1", {"grams": 120}, headers)
+            self.assertEqual(self._meal_names(), ["meal 1", "meal 2"])
+
+    def test_batch_atomic_user_records(self):
+        """Shared records of the users updated are only removed once committed"""
+        path = "/".join([self.path, "batch"])
+        update = {"method": "PUT", "path": "/users/user1", "body": {"daily_calories": 3000}}
+        with self.client, patch.object(user_records, "delete") as delete:
+            headers = self._get_headers()
+            operations = [update, {"method": "DELETE", "path": "/users/user1/meals/100"}]
+            response = self.post(path, {"operations": operations, "atomic": True}, headers)
+            self.assertTrue(response.json["data"]["rolled_back"])
+            delete.assert_not_called()
+
+            response = self.post(path, {"operations": [update], "atomic": True}, headers)
+            self.assertFalse(response.json["data"]["rolled_back"])
+            delete.assert_called_once_with("user1")
+
+    def test_batch_unsupported(self):
+        """Nested batches and streamed responses are rejected"""
+        path = "/".join([self.path, "batch"])
+        with self.client:
+            operations = [
+                {"method": "POST", "path": "/batch", "body": {"operations": []}},
+                {"method": "GET", "path": "/users/user1/meals/export?format=csv"},
+            ]
+            response = self.post(path, {"operations": operations}, self._get_headers())
+            results = response.json["data"]["results"]
+            self.assertEqual([r["status"] for r in results], [400, 400])
+
+            response = self.post(path, {"operations": []}, self._get_headers())
+            self.assertEqual(response.status_code, 400)
+
+    def test_batch_unauthenticated(self):
+        """Batches need a token"""
+        path = "/".join([self.path, "batch"])
+        with self.client:
+            response = self.post(path, {"operations": [{"method": "GET", "path": "/users"}]})
+            self.assertEqual(response.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,38 @@
 """Test module for calories.main.controller.meals"""
+import datetime
+import json
+import threading
 import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.parse import quote
 
+from sqlalchemy.dialects import postgresql
+
+from calories.main import db
+from calories.main.controller.helpers import events as events_helpers
+from calories.main.controller.helpers.idempotency import purge_keys
+from calories.main.controller.helpers.meals import MEAL_ORDERINGS
+from calories.main.models.models import IdempotencyKey
+from calories.test import record_queries
 from calories.test.controller import TestAPI
 
 
+class _CopyCursor:
+    """Cursor that reads the file given to COPY in small chunks, as psycopg2 does"""
+
+    def __init__(self):
+        self.copied = []
+        self.closed = False
+
+    def copy_expert(self, statement, file):
+        for data in iter(lambda: file.read(16), ""):
+            self.copied.append(data)
+
+    def close(self):
+        self.closed = True
+
+
 class TestMeals(TestAPI):
     """Test class for calories.main.controller.meals"""
 
@@ -74,6 +103,663 @@ class TestMeals(TestAPI):
             response = self.get(path, self._get_headers("user1", "pass_user1"))
             self._check_succes(expected, response, 200)
 
+    def test_get_user_meals_fields(self):
+        """Only the requested fields are selected and returned"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            expected = [
+                {"calories": 500, "date": "2020-02-11", "id": 1},
+                {"calories": 2100, "date": "2020-02-11", "id": 2},
+            ]
+            headers = self._get_headers("user1", "pass_user1")
+            with record_queries() as statements:
+                response = self.get(path + "?fields=id,date,calories", headers)
+            self._check_succes(expected, response, 200)
+            self.assertFalse(any("meal.description" in s for s in statements))
+
+    def test_get_user_meals_wrong_fields(self):
+        """Fields that do not exist are rejected"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            response = self.get(path + "?fields=id,user_id", self._get_headers())
+            self.assertEqual(response.status_code, 400)
+
+    def test_export_meals_ndjson(self):
+        """Meals are exported one JSON document per line"""
+        path = "/".join([self.path, "users", "user1", "meals", "export"])
+        with self.client:
+            response = self.get(path, self._get_headers("user1", "pass_user1"))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "application/x-ndjson")
+            self.assertTrue(response.is_streamed)
+            lines = response.data.decode().splitlines()
+            self.assertEqual(
+                [json.loads(line) for line in lines],
+                [
+                    {
+                        "calories": 500,
+                        "date": "2020-02-11",
+                        "description": "Meal 1 User 1",
+                        "grams": 100,
+                        "id": 1,
+                        "name": "meal 1",
+                        "time": "15:00:03",
+                        "under_daily_total": True,
+                    },
+                    {
+                        "calories": 2100,
+                        "date": "2020-02-11",
+                        "description": "Meal 2 User 1",
+                        "grams": 100,
+                        "id": 2,
+                        "name": "meal 2",
+                        "time": "15:10:03",
+                        "under_daily_total": True,
+                    },
+                ],
+            )
+
+    def test_export_meals_csv_filtered(self):
+        """Meals are exported as CSV honoring the filter"""
+        path = "/".join([self.path, "users", "user1", "meals", "export"])
+        with self.client:
+            response = self.get(
+                path + "?format=csv&filter_results=" + quote("calories gt 1000"),
+                self._get_headers(),
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "text/csv")
+            self.assertEqual(
+                response.data.decode(),
+                "id,date,time,name,grams,description,calories,under_daily_total\n"
+                "2,2020-02-11,15:10:03,meal 2,100,Meal 2 User 1,2100,True\n",
+            )
+
+    def test_export_meals_wrong_filter(self):
+        """Invalid filters are rejected before streaming"""
+        path = "/".join([self.path, "users", "user1", "meals", "export"])
+        with self.client:
+            response = self.get(
+                path + "?filter_results=" + quote("calories gt"), self._get_headers()
+            )
+            self._check_error(
+                response, 400, "Bad Request", "Filter 'calories gt' is invalid"
+            )
+
+    def test_export_meals_user_others(self):
+        """User cannot export other users meals"""
+        path = "/".join([self.path, "users", "user2", "meals", "export"])
+        with self.client:
+            response = self.get(path, self._get_headers("user1", "pass_user1"))
+            self._check_error(
+                response,
+                403,
+                "Forbidden",
+                "User 'user1' cannot perform the action for other user",
+            )
+
+    def test_import_meals_ndjson(self):
+        """Meals are imported and the daily totals recomputed once"""
+        path = "/".join([self.path, "users", "user2", "meals"])
+        document = (
+            '{"date": "2020-02-11", "name": "pizza", "calories": 2600}\n'
+            "\n"
+            '{"date": "2020-02-12", "time": "10:00:00", "name": "apple", "grams": 150}\n'
+        )
+        with self.client:
+            headers = self._get_headers("user2", "pass_user2")
+            response = self.client.post(
+                path + "/import",
+                data=document,
+                content_type="application/x-ndjson",
+                headers=headers,
+            )
+            self._check_succes(2, response, 201)
+
+            response = self.get(path + "?fields=date,name,calories,under_daily_total", headers)
+            self._check_succes(
+                [
+                    {"calories": 2600, "date": "2020-02-11", "name": "pizza", "under_daily_total": False},
+                    {"calories": 500, "date": "2020-02-11", "name": "cheese", "under_daily_total": False},
+                    {"calories": 0, "date": "2020-02-12", "name": "apple", "under_daily_total": True},
+                ],
+                response,
+                200,
+            )
+
+    def test_import_meals_csv(self):
+        """Exported CSV can be imported back, ids and under_daily_total are ignored"""
+        path = "/".join([self.path, "users", "user2", "meals"])
+        document = (
+            "id,date,time,name,grams,description,calories,under_daily_total\n"
+            "1,2020-02-13,,soup,250,,300,False\n"
+        )
+        with self.client:
+            headers = self._get_headers("user2", "pass_user2")
+            response = self.client.post(
+                path + "/import", data=document, content_type="text/csv", headers=headers
+            )
+            self._check_succes(1, response, 201)
+
+            response = self.get(path + "?filter_results=" + quote("name eq soup"), headers)
+            self._check_succes(
+                [
+                    {
+                        "calories": 300,
+                        "date": "2020-02-13",
+                        "description": None,
+                        "grams": 250,
+                        "id": 4,
+                        "name": "soup",
+                        "time": None,
+                        "under_daily_total": True,
+                    }
+                ],
+                response,
+                200,
+            )
+
+    def test_import_meals_wrong_row(self):
+        """A wrong row rejects the whole document"""
+        path = "/".join([self.path, "users", "user2", "meals"])
+        document = "date,name,calories\n2020-02-13,soup,300\n2020-02-13,,100\n"
+        with self.client:
+            headers = self._get_headers("user2", "pass_user2")
+            response = self.client.post(
+                path + "/import", data=document, content_type="text/csv", headers=headers
+            )
+            self._check_error(
+                response, 400, "Bad Request", "Line 3: Field(s): 'name' are required"
+            )
+
+            response = self.get(path, headers)
+            self.assertEqual(len(json.loads(response.data.decode())["data"]), 1)
+
+    def test_import_meals_wrong_format(self):
+        """Values with the wrong format are reported with their line"""
+        path = "/".join([self.path, "users", "user2", "meals"])
+        document = '{"date": "2020-02-13", "name": "soup", "calories": "many"}\n'
+        with self.client:
+            response = self.client.post(
+                path + "/import",
+                data=document,
+                content_type="application/x-ndjson",
+                headers=self._get_headers(),
+            )
+            self._check_error(
+                response,
+                400,
+                "Bad Request",
+                "Line 1: Field(s): 'calories' have the wrong format",
+            )
+
+    def test_import_meals_stream(self):
+        """Documents are read from the stream, with any line ending, as UTF-8 and up
+        to MAX_CONTENT_LENGTH bytes"""
+        path = "/".join([self.path, "users", "user2", "meals", "import"])
+        with self.client:
+            headers = self._get_headers("user2", "pass_user2")
+            response = self.client.post(
+                path,
+                data="date,name\r\n2020-02-13,sopa\r\n2020-02-14,cr\u00e8me\r\n",
+                content_type="text/csv",
+                headers=headers,
+            )
+            self._check_succes(2, response, 201)
+
+            response = self.client.post(
+                path,
+                data=b"date,name\n2020-02-13,cr\xe8me\n",
+                content_type="text/csv",
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 400)
+
+            self.app.config["MAX_CONTENT_LENGTH"] = 16
+            response = self.client.post(
+                path,
+                data="date,name\n2020-02-13,soup\n",
+                content_type="text/csv",
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 413)
+
+    def test_import_meals_copy_wrong_row(self):
+        """A wrong row stops COPY mid-stream, the cursor is closed and nothing is
+        imported"""
+        path = "/".join([self.path, "users", "user2", "meals"])
+        document = "date,name\n2020-02-13,soup\n2020-02-14,salad\n2020-02-15,\n"
+        cursor = _CopyCursor()
+        connection = SimpleNamespace(
+            dialect=postgresql.dialect(),
+            connection=SimpleNamespace(cursor=lambda: cursor),
+        )
+        with self.client:
+            headers = self._get_headers("user2", "pass_user2")
+            with patch.object(db.session, "connection", return_value=connection):
+                response = self.client.post(
+                    path + "/import", data=document, content_type="text/csv", headers=headers
+                )
+            self._check_error(
+                response, 400, "Bad Request", "Line 4: Field(s): 'name' are required"
+            )
+            self.assertTrue(cursor.closed)
+            self.assertIn("soup", "".join(cursor.copied))
+
+            response = self.get(path, headers)
+            self.assertEqual(len(response.json["data"]), 1)
+
+    def test_import_meals_user_others(self):
+        """User cannot import meals for other users"""
+        path = "/".join([self.path, "users", "user2", "meals", "import"])
+        with self.client:
+            response = self.client.post(
+                path,
+                data="date,name\n2020-02-13,soup\n",
+                content_type="text/csv",
+                headers=self._get_headers("user1", "pass_user1"),
+            )
+            self._check_error(
+                response,
+                403,
+                "Forbidden",
+                "User 'user1' cannot perform the action for other user",
+            )
+
+    def _add_meals(self, meals):
+        path = "/".join([self.path, "users", "user1", "meals"])
+        ids = []
+        for name, description, calories in meals:
+            response = self.post(
+                path,
+                {
+                    "date": "2020-02-12",
+                    "name": name,
+                    "description": description,
+                    "calories": calories,
+                },
+                self._get_headers(),
+            )
+            ids.append(response.json["data"]["id"])
+        return ids
+
+    def test_get_user_meals_q(self):
+        """Meals are searched by words of their name and description, ranked"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            soup, grilled, _ = self._add_meals(
+                [
+                    ("Chicken soup", "Homemade", 300),
+                    ("Grilled chicken", "Chicken breast with rice", 600),
+                    ("Rice", "White rice", 200),
+                ]
+            )
+            headers = self._get_headers()
+            with record_queries() as statements:
+                response = self.get(path + "?q=chickens", headers)
+            self.assertEqual([m["id"] for m in response.json["data"]], [grilled, soup])
+            self.assertEqual(response.json["total_result"], 2)
+            self.assertFalse(any(" LIKE " in s.upper() for s in statements))
+
+            response = self.get(
+                path + "?q=chicken+rice&filter_results=" + quote("calories gt 100"),
+                headers,
+            )
+            self.assertEqual([m["id"] for m in response.json["data"]], [grilled])
+
+            response = self.get(path + "?q=" + quote('"soup*'), headers)
+            self.assertEqual([m["id"] for m in response.json["data"]], [soup])
+
+    def test_get_user_meals_q_writes(self):
+        """The search index is kept in sync on updates and deletes"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            (soup,) = self._add_meals([("Chicken soup", "Homemade", 300)])
+            headers = self._get_headers()
+            self.patch(f"{path}/{soup}", {"name": "Tomato soup"}, headers)
+            self.assertEqual(self.get(path + "?q=chicken", headers).json["data"], [])
+            response = self.get(path + "?q=tomato", headers)
+            self.assertEqual([m["id"] for m in response.json["data"]], [soup])
+
+            self.delete(f"{path}/{soup}", headers)
+            self.assertEqual(self.get(path + "?q=tomato", headers).json["data"], [])
+
+    def test_get_user_meals_sort(self):
+        """Meals are sorted by the allowed orderings, by date and time by default"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            self._add_meals([("Apple", "Green", 100)])
+            headers = self._get_headers()
+            for query, expected in [
+                ("", [1, 2, 4]),
+                ("?sort=" + quote("-date,-time"), [4, 2, 1]),
+                ("?sort=-calories", [2, 1, 4]),
+                ("?sort=name&q=meal", [1, 2]),
+            ]:
+                response = self.get(path + query, headers)
+                self.assertEqual([m["id"] for m in response.json["data"]], expected)
+
+    def test_get_user_meals_wrong_sort(self):
+        """Orderings out of the whitelist are rejected"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            response = self.get(path + "?sort=" + quote("date,-time"), self._get_headers())
+            self.assertEqual(response.status_code, 400)
+
+    def test_meal_orderings_indexes(self):
+        """Every ordering of the meals of a user is read from an index"""
+        for ordering in MEAL_ORDERINGS.values():
+            for descending in (False, True):
+                columns = ", ".join(
+                    f"meal.{c.key} DESC" if descending else f"meal.{c.key}"
+                    for c in ordering
+                )
+                plan = db.session.execute(
+                    "EXPLAIN QUERY PLAN SELECT meal.id FROM meal"
+                    f" WHERE meal.user_id = 1 ORDER BY {columns} LIMIT 10"
+                ).fetchall()
+                details = " ".join(row[-1] for row in plan)
+                self.assertIn("USING", details)
+                self.assertNotIn("TEMP B-TREE", details)
+
+    def test_get_user_meals_etag(self):
+        """Unchanged meals are answered with a 304 after a version lookup"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            response = self.get(path, headers)
+            etag = response.headers["ETag"]
+            self.assertTrue(etag.startswith('W/"2.0-'))
+
+            with record_queries() as statements:
+                response = self.get(path, {**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b"")
+            self.assertEqual(response.headers["ETag"], etag)
+            self.assertEqual(len(statements), 1)
+
+            response = self.get(
+                path + "?items_per_page=1", {**headers, "If-None-Match": etag}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+            self.patch(path + "/1", {"grams": 120}, headers)
+            response = self.get(path, {**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.headers["ETag"].startswith('W/"2.1-'))
+
+    def test_get_user_meals_etag_recreated(self):
+        """ETags of a user deleted and created again do not match the new one"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            headers = self._get_headers()
+            etag = self.get(path, headers).headers["ETag"]
+
+            users_path = "/".join([self.path, "users"])
+            self.delete(users_path + "/user1", headers)
+            user = {
+                "username": "user1",
+                "name": "User 1",
+                "email": "user1@users.com",
+                "role": "USER",
+                "daily_calories": 2500,
+                "password": "pass_user1",
+            }
+            self.assertEqual(self.post(users_path, user, headers).status_code, 201)
+
+            response = self.get(path, {**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json["data"], [])
+
+    def test_get_user_meals_cached(self):
+        """Pages of meals are cached until the user or his meals change"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            headers = self._get_headers()
+            self.get(path, headers)
+            with record_queries() as statements:
+                response = self.get(path, headers)
+            self.assertEqual([m["id"] for m in response.json["data"]], [1, 2])
+            self.assertFalse(any("FROM meal" in s for s in statements))
+
+            self.patch(path + "/1", {"grams": 120}, headers)
+            response = self.get(path, headers)
+            self.assertEqual(response.json["data"][0]["grams"], 120)
+
+            response = self.get(path.replace("user1", "user2"), headers)
+            self.assertEqual([m["id"] for m in response.json["data"]], [3])
+
+    def test_get_meal_changes(self):
+        """Syncs return the meals of the days changed and the meals deleted since the
+        previous one"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            data = self.get(path + "/changes", headers).json["data"]
+            self.assertEqual([m["id"] for m in data["upserts"]], [1, 2])
+            self.assertEqual(data["deletes"], [])
+            cursor = data["cursor"]
+
+            self.patch(path + "/1", {"grams": 120}, headers)
+            data = self.get(path + "/changes?since=" + cursor, headers).json["data"]
+            self.assertEqual([m["id"] for m in data["upserts"]], [1, 2])
+            self.assertEqual(data["upserts"][0]["grams"], 120)
+            self.assertIsNotNone(data["upserts"][0]["updated_at"])
+            self.assertNotIn("version", data["upserts"][0])
+            cursor = data["cursor"]
+
+            data = self.get(path + "/changes?since=" + cursor, headers).json["data"]
+            self.assertEqual((data["upserts"], data["deletes"]), ([], []))
+            self.assertEqual(data["cursor"], cursor)
+
+            self.delete(path + "/2", headers)
+            (meal_id,) = self._add_meals([("Apple", "Green", 100)])
+            data = self.get(path + "/changes?since=" + cursor, headers).json["data"]
+            self.assertEqual([m["id"] for m in data["upserts"]], [1, meal_id])
+            self.assertTrue(data["upserts"][0]["under_daily_total"])
+            self.assertEqual(data["deletes"], [2])
+
+            data = self.get(path + "/changes", headers).json["data"]
+            self.assertEqual([m["id"] for m in data["upserts"]], [1, meal_id])
+            self.assertEqual(data["deletes"], [2])
+
+    def test_get_meal_changes_wrong_cursor(self):
+        """Cursors that are wrong or of other users are rejected"""
+        path = "/".join([self.path, "users", "user1", "meals", "changes"])
+        with self.client:
+            headers = self._get_headers()
+            self.assertEqual(self.get(path + "?since=abc", headers).status_code, 400)
+            response = self.get(path.replace("user1", "user2"), headers)
+            cursor = response.json["data"]["cursor"]
+            response = self.get(path + "?since=" + cursor, headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_get_events(self):
+        """Changes are streamed since the cursor given and as they are committed"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        events_path = "/".join([self.path, "users", "user1", "events"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            cursor = self.get(path + "/changes", headers).json["data"]["cursor"]
+            self.delete(path + "/2", headers)
+
+            response = self.client.get(
+                events_path + "?since=" + cursor, headers=headers, buffered=False
+            )
+            self.assertEqual(response.mimetype, "text/event-stream")
+            self.assertEqual(response.headers["Cache-Control"], "no-cache")
+            chunks = iter(response.response)
+            self.assertEqual(next(chunks), b": connected\n\n")
+            event, id_, data = next(chunks).decode().strip().split("\n")
+            self.assertEqual(event, "event: meals")
+            data = json.loads(data[len("data: "):])
+            self.assertEqual(id_, "id: " + data["cursor"])
+            self.assertEqual([m["id"] for m in data["upserts"]], [1])
+            self.assertEqual(data["deletes"], [2])
+
+            self.patch(path + "/1", {"grams": 120}, headers)
+            data = json.loads(next(chunks).decode().strip().split("data: ")[1])
+            self.assertEqual(data["upserts"][0]["grams"], 120)
+            self.assertEqual(data["deletes"], [])
+            response.close()
+
+    def test_get_events_wrong(self):
+        """Wrong cursors and users are rejected before the stream starts"""
+        path = "/".join([self.path, "users", "user1", "events"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            response = self.get(path + "?since=abc", headers)
+            self.assertEqual(response.status_code, 400)
+            response = self.get(path, {**headers, "Last-Event-ID": "abc"})
+            self.assertEqual(response.status_code, 400)
+            response = self.get(path.replace("user1", "user2"), headers)
+            self.assertEqual(response.status_code, 403)
+
+    def test_get_events_limit(self):
+        """Streams over EVENTS_MAX_STREAMS are rejected until an open one is closed"""
+        path = "/".join([self.path, "users", "user1", "events"])
+        with self.client, patch.object(
+                events_helpers, "streams", threading.BoundedSemaphore(1)
+        ):
+            headers = self._get_headers("user1", "pass_user1")
+            response = self.client.get(path, headers=headers, buffered=False)
+            self.assertEqual(next(iter(response.response)), b": connected\n\n")
+
+            self._check_error(
+                self.get(path, headers),
+                503,
+                "Service Unavailable",
+                "Too many event streams open, try again later",
+            )
+
+            response.close()
+            response = self.client.get(path, headers=headers, buffered=False)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+    def test_get_day(self):
+        """Past days carry a strong ETag and are cacheable until the day changes"""
+        path = "/".join([self.path, "users", "user1", "days", "2020-02-11"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            response = self.get(path, headers)
+            self.assertEqual(response.json["data"]["calories"], 2600)
+            self.assertEqual([m["id"] for m in response.json["data"]["meals"]], [1, 2])
+            etag = response.headers["ETag"]
+            self.assertFalse(etag.startswith("W/"))
+            self.assertEqual(response.headers["Cache-Control"], "public, max-age=86400")
+            self.assertIn("Authorization", response.headers["Vary"])
+
+            response = self.get(path, {**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["ETag"], etag)
+
+            meals_path = "/".join([self.path, "users", "user1", "meals"])
+            self.patch(meals_path + "/1", {"date": "2020-02-10"}, headers)
+            response = self.get(path, {**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json["data"]["calories"], 2100)
+            etag = response.headers["ETag"]
+
+            self.patch(meals_path + "/1", {"grams": 50}, headers)
+            response = self.get(path, {**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+
+    def test_get_day_today(self):
+        """Recent days have to be revalidated every time"""
+        today = datetime.date.today().isoformat()
+        path = "/".join([self.path, "users", "user1", "days", today])
+        with self.client:
+            response = self.get(path, self._get_headers())
+            self.assertEqual(
+                response.json["data"], {"date": today, "calories": 0, "meals": []}
+            )
+            self.assertEqual(response.headers["Cache-Control"], "no-cache")
+
+    def test_get_day_wrong(self):
+        """Wrong dates, other users and missing users are rejected"""
+        path = "/".join([self.path, "users", "user1", "days"])
+        with self.client:
+            headers = self._get_headers()
+            response = self.get(path + "/2020-02-30", headers)
+            self.assertEqual(response.status_code, 400)
+            response = self.get(path.replace("user1", "user9") + "/2020-02-11", headers)
+            self.assertEqual(response.status_code, 404)
+            response = self.get(
+                path + "/2020-02-11", self._get_headers("user2", "pass_user2")
+            )
+            self.assertEqual(response.status_code, 403)
+
+    def test_get_user_meals_etag_forbidden(self):
+        """Permissions are checked before answering with a 304"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            etag = self.get(path, self._get_headers()).headers["ETag"]
+            response = self.get(
+                path, {**self._get_headers("user2", "pass_user2"), "If-None-Match": etag}
+            )
+            self.assertEqual(response.status_code, 403)
+
+    def test_search_meals_pages(self):
+        """Meals of all the users are paginated with cursors"""
+        with self.client:
+            headers = self._get_headers()
+            response = self.get("api/meals?items_per_page=2", headers)
+            self.assertEqual(response.status_code, 200)
+            data = response.json
+            self.assertEqual(
+                [(m["id"], m["username"]) for m in data["data"]],
+                [(1, "user1"), (2, "user1")],
+            )
+            self.assertIsNotNone(data["next_cursor"])
+
+            response = self.get(
+                "api/meals?items_per_page=2&cursor=" + quote(data["next_cursor"]),
+                headers,
+            )
+            data = response.json
+            self.assertEqual([(m["id"], m["username"]) for m in data["data"]], [(3, "user2")])
+            self.assertIsNone(data["next_cursor"])
+
+    def test_search_meals_filters(self):
+        """Meals are filtered by their fields and by their users"""
+        with self.client:
+            headers = self._get_headers()
+            for query, expected in [
+                ("filter_results=" + quote("calories gt 1000"), [2]),
+                ("username=user2,manager1", [3]),
+                ("role=USER&filter_results=" + quote("calories lt 1000"), [1, 3]),
+                ("role=MANAGER", []),
+            ]:
+                response = self.get("api/meals?" + query, headers)
+                self.assertEqual([m["id"] for m in response.json["data"]], expected)
+
+    def test_search_meals_wrong_cursor(self):
+        """Wrong cursors are rejected"""
+        with self.client:
+            response = self.get("api/meals?cursor=abc", self._get_headers())
+            self._check_error(response, 400, "Bad Request", "Cursor 'abc' is invalid")
+
+    def test_search_meals_index(self):
+        """Searches by date and calories are answered from the composite index"""
+        plan = db.session.execute(
+            "EXPLAIN QUERY PLAN SELECT meal.id, meal.user_id FROM meal"
+            " WHERE meal.calories > 1000 AND meal.date >= '2020-01-01'"
+            " AND (meal.date > '2020-01-01' OR meal.id > 1)"
+            " ORDER BY meal.date, meal.id LIMIT 11"
+        ).fetchall()
+        self.assertIn(
+            "COVERING INDEX ix_meal_date_id_calories_user_id",
+            " ".join(row[-1] for row in plan),
+        )
+
+    def test_search_meals_user(self):
+        """Only admins can search the meals of all the users"""
+        with self.client:
+            response = self.get("api/meals", self._get_headers("manager1", "pass_manager1"))
+            self.assertEqual(response.status_code, 403)
+
     def test_get_user_meals_user_others(self):
         """User is not allowed to see other user meals"""
         path = "/".join([self.path, "users", "user2", "meals"])
@@ -175,6 +861,147 @@ class TestMeals(TestAPI):
             response = self.post(path, request_data, self._get_headers())
             self._check_succes(expected, response, 201)
 
+    # Statements of a write after the one changing the meal: marking the day dirty,
+    # bumping the versions and stamping the meals of the day, and the outbox event
+    RECORD_CHANGES = [
+        "INSERT INTO dirty_day",
+        "INSERT INTO day_version",
+        "UPDATE user SET data_version",
+        "SELECT user.data_version",
+        "UPDATE meal SET version",
+        "INSERT INTO outbox_event",
+    ]
+
+    def _count_write(self, method, path: str, data: dict, again: dict) -> tuple:
+        """Statements of a write with and without commit_without_expire, the writes
+        have to take the same steps"""
+        headers = self._get_headers()
+        self.get(path, headers)
+        with patch(
+                "calories.main.controller.helpers.meals.commit_without_expire",
+                db.session.commit,
+        ):
+            with record_queries() as expiring:
+                method(path, data, headers)
+        with record_queries() as statements:
+            response = method(path, again, headers)
+
+        return response, expiring, statements
+
+    def test_post_meal_not_reselected(self):
+        """The created meal is returned without selecting it again after commit"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            expected = {
+                "calories": 500,
+                "date": "2020-02-12",
+                "description": None,
+                "grams": 0,
+                "id": 5,
+                "name": "meal 4b",
+                "time": None,
+                "under_daily_total": True,
+            }
+            request_data = {"date": "2020-02-12", "name": "meal 4", "calories": 500}
+            response, expiring, statements = self._count_write(
+                self.post, path, request_data, {**request_data, "name": "meal 4b"}
+            )
+            self._check_succes(expected, response, 201)
+            self.assertEqual(len(statements), len(expiring) - 1)
+            inserted = [s.startswith("INSERT INTO meal") for s in statements].index(True)
+            self.assertEqual(len(statements[inserted + 1:]), len(self.RECORD_CHANGES))
+            for statement, prefix in zip(statements[inserted + 1:], self.RECORD_CHANGES):
+                self.assertTrue(statement.startswith(prefix), statement)
+
+    def test_put_meal_not_reselected(self):
+        """The updated meal is returned without selecting it again after commit"""
+        path = "/".join([self.path, "users", "user1", "meals", "1"])
+        with self.client:
+            response, expiring, statements = self._count_write(
+                self.put,
+                path,
+                {"name": "meal 1", "calories": 600},
+                {"name": "meal 1b", "calories": 700},
+            )
+            self.assertEqual(response.json["data"]["name"], "meal 1b")
+            self.assertEqual(response.json["data"]["calories"], 700)
+            self.assertEqual(len(statements), len(expiring) - 1)
+            updated = [s.startswith("UPDATE meal SET name") for s in statements].index(True)
+            self.assertEqual(len(statements[updated + 1:]), len(self.RECORD_CHANGES))
+            for statement, prefix in zip(statements[updated + 1:], self.RECORD_CHANGES):
+                self.assertTrue(statement.startswith(prefix), statement)
+
+    def test_post_meal_idempotent(self):
+        """Requests repeated with the same key get the first response without
+        creating the meal again, and the key cannot be used for other requests"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            request_data = {"date": "2020-02-12", "name": "meal 4", "calories": 500}
+            headers = {**self._get_headers(), "Idempotency-Key": "key-1"}
+            response = self.post(path, request_data, headers)
+            self.assertEqual(response.status_code, 201)
+            self.assertNotIn("Idempotent-Replayed", response.headers)
+
+            with record_queries() as statements:
+                replayed = self.post(path, request_data, headers)
+            self.assertEqual(replayed.status_code, 201)
+            self.assertEqual(replayed.json, response.json)
+            self.assertEqual(replayed.headers["Idempotent-Replayed"], "true")
+            self.assertFalse(any(s.startswith("INSERT INTO meal") for s in statements))
+
+            response = self.post(path, {**request_data, "calories": 600}, headers)
+            self.assertEqual(response.status_code, 409)
+            response = self.post(
+                path.replace("user1", "user2"), request_data, headers
+            )
+            self.assertEqual(response.status_code, 409)
+
+            response = self.post(path, request_data, self._get_headers())
+            self.assertEqual(response.json["data"]["id"], 5)
+
+    def test_post_meal_idempotent_expired(self):
+        """Keys of unfinished requests can be taken over once their lock expires,
+        keys older than the TTL can be used again and are purged"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            request_data = {"date": "2020-02-12", "name": "meal 4", "calories": 500}
+            headers = {**self._get_headers(), "Idempotency-Key": "key-1"}
+            self.post(path, request_data, headers)
+            future = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+            # As left by a request that never finished
+            IdempotencyKey.query.update(
+                {"status": None, "response": None, "locked_until": future}
+            )
+            db.session.commit()
+            response = self.post(path, request_data, headers)
+            self._check_error(
+                response,
+                409,
+                "Conflict",
+                "Request with key 'key-1' is still being processed",
+            )
+
+            past = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+            IdempotencyKey.query.update({"locked_until": past})
+            db.session.commit()
+            response = self.post(path, request_data, headers)
+            self.assertEqual(response.status_code, 201)
+            self.assertNotIn("Idempotent-Replayed", response.headers)
+
+            IdempotencyKey.query.update(
+                {"created_at": past - datetime.timedelta(days=1)}
+            )
+            db.session.commit()
+            response = self.post(path, {**request_data, "calories": 600}, headers)
+            self.assertEqual(response.json["data"]["calories"], 600)
+            self.assertEqual(purge_keys(), 0)
+
+            IdempotencyKey.query.update(
+                {"created_at": past - datetime.timedelta(days=1)}
+            )
+            db.session.commit()
+            self.assertEqual(purge_keys(), 1)
+
     def test_post_meal_wrong_user_admin(self):
         """Wrong user from admin"""
         path = "/".join([self.path, "users", "wronguser", "meals"])
@@ -413,6 +1240,16 @@ class TestMeals(TestAPI):
             response = self.get(path, self._get_headers())
             self._check_succes(expected, response, 200)
 
+    def test_get_meal_fields(self):
+        """Only the requested fields of the meal are returned"""
+        path = "/".join([self.path, "users", "user1", "meals", "1"])
+        with self.client:
+            expected = {"name": "meal 1", "under_daily_total": True}
+            response = self.get(
+                path + "?fields=name,under_daily_total", self._get_headers()
+            )
+            self._check_succes(expected, response, 200)
+
     def test_get_meal_wrong_user(self):
         """Admin mistake on user"""
         path = "/".join([self.path, "users", "wronguser", "meals", "1"])
@@ -605,6 +1442,125 @@ class TestMeals(TestAPI):
                 "User 'manager1' belongs to the role 'MANAGER' and is not allowed to perform the action",
             )
 
+    def test_patch_meal_success_admin(self):
+        """Admin can patch any meal with a single UPDATE on the meals, besides the one
+        stamping the version of the meals of the day"""
+        path = "/".join([self.path, "users", "user1", "meals", "2"])
+        with self.client:
+            expected = {
+                "calories": 2100,
+                "date": "2020-02-11",
+                "description": "Meal 2 User 1b",
+                "grams": 100,
+                "id": 2,
+                "name": "meal 2",
+                "time": "15:10:03",
+                "under_daily_total": True,
+            }
+            request_data = {"description": "Meal 2 User 1b"}
+            headers = self._get_headers()
+            with record_queries() as statements:
+                response = self.patch(path, request_data, headers)
+            self._check_succes(expected, response, 200)
+            meal_statements = [s for s in statements if "meal" in s]
+            self.assertEqual(len(meal_statements), 2)
+            self.assertTrue(all(s.startswith("UPDATE meal") for s in meal_statements))
+            self.assertIn("RETURNING", meal_statements[0])
+
+    def test_patch_meal_calories(self):
+        """Changing the calories updates the daily total of the whole day"""
+        path = "/".join([self.path, "users", "user1", "meals", "2"])
+        with self.client:
+            expected = {
+                "calories": 2400,
+                "date": "2020-02-11",
+                "description": "Meal 2 User 1",
+                "grams": 100,
+                "id": 2,
+                "name": "meal 2",
+                "time": "15:10:03",
+                "under_daily_total": False,
+            }
+            headers = self._get_headers("user1", "pass_user1")
+            response = self.patch(path, {"calories": 2400}, headers)
+            self._check_succes(expected, response, 200)
+            path = "/".join([self.path, "users", "user1", "meals", "1"])
+            response = self.get(path, headers)
+            self.assertFalse(response.json["data"]["under_daily_total"])
+
+    def test_patch_meal_same_name(self):
+        """Calories are only looked up when the name changes and they are not given"""
+        path = "/".join([self.path, "users", "user1", "meals", "1"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            lookup = "calories.main.controller.helpers.meals.calories_from_nutritionix"
+            with patch(lookup, return_value=0) as calories_from_nutritionix:
+                response = self.patch(path, {"name": "meal 1"}, headers)
+                self.assertEqual(response.json["data"]["calories"], 500)
+                response = self.patch(path, {"name": "apple", "calories": 0}, headers)
+                self.assertEqual(response.json["data"]["calories"], 0)
+            calories_from_nutritionix.assert_not_called()
+
+    def test_patch_meal_date(self):
+        """Changing the date updates the daily totals of both days"""
+        path = "/".join([self.path, "users", "user1", "meals", "2"])
+        with self.client:
+            expected = {
+                "calories": 2600,
+                "date": "2020-02-12",
+                "description": "Meal 2 User 1",
+                "grams": 100,
+                "id": 2,
+                "name": "meal 2",
+                "time": "15:10:03",
+                "under_daily_total": False,
+            }
+            request_data = {"calories": 2600, "date": "2020-02-12"}
+            headers = self._get_headers("user1", "pass_user1")
+            self.patch(path, {"calories": 2400}, headers)
+            response = self.patch(path, request_data, headers)
+            self._check_succes(expected, response, 200)
+            path = "/".join([self.path, "users", "user1", "meals", "1"])
+            response = self.get(path, headers)
+            self.assertTrue(response.json["data"]["under_daily_total"])
+
+    def test_patch_meal_wrong_params(self):
+        """Fields that cannot be changed are rejected"""
+        path = "/".join([self.path, "users", "user1", "meals", "2"])
+        with self.client:
+            request_data = {"id": 5, "time": "15:99:28"}
+            response = self.patch(path, request_data, self._get_headers())
+            self._check_error(
+                response,
+                400,
+                "Bad Request",
+                "Field(s): 'id', 'time' have the wrong format",
+            )
+
+    def test_patch_meal_no_meal(self):
+        """Meal doesnt exist"""
+        path = "/".join([self.path, "users", "user1", "meals", "3"])
+        with self.client:
+            request_data = {"calories": 5000, "date": "2020-02-13"}
+            response = self.patch(
+                path, request_data, self._get_headers("user1", "pass_user1")
+            )
+            self._check_error(response, 404, "Not Found", "Meal '3' not found")
+
+    def test_patch_meal_user_others(self):
+        """User cannot patch other users meals"""
+        path = "/".join([self.path, "users", "user2", "meals", "3"])
+        with self.client:
+            response = self.patch(
+                path, {"calories": 5}, self._get_headers("user1", "pass_user1")
+            )
+            self._check_error(
+                response,
+                403,
+                "Forbidden",
+                "User 'user1' cannot perform the action for other user",
+            )
+
 
 if __name__ == "__main__":
     unittest.main()
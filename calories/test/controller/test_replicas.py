@@ -0,0 +1,93 @@
+"""Test module for calories.main.controller.helpers.replicas"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from calories.main.controller.helpers.replicas import write_marks
+from calories.main.util import metrics
+from calories.main.util.lru import clear_caches
+from calories.test.controller import TestAPI
+
+
+class TestReplicas(TestAPI):
+    """Test class for calories.main.controller.helpers.replicas"""
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.TemporaryDirectory()
+        replica = os.path.join(self.dir.name, "replica.db")
+        primary = self.app.config["SQLALCHEMY_DATABASE_URI"][len("sqlite:///"):]
+        shutil.copyfile(primary, replica)
+
+        # Changes on the replica show which database answered
+        with sqlite3.connect(replica) as connection:
+            connection.execute("UPDATE meal SET name = 'replica meal' WHERE id = 1")
+        self.app.config["SQLALCHEMY_BINDS"] = {"replica0": "sqlite:///" + replica}
+        write_marks.clear()
+        clear_caches()
+
+    def tearDown(self):
+        self.app.config["SQLALCHEMY_BINDS"] = {}
+        write_marks.clear()
+        clear_caches()
+        super().tearDown()
+        self.dir.cleanup()
+
+    def test_read_replica(self):
+        """Reads go to the replica and writes to the primary"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            reads = metrics.get("replicas.replica_reads")
+            response = self.get(path, headers)
+            self.assertEqual(response.json["data"][0]["name"], "replica meal")
+            response = self.get(path + "/1", headers)
+            self.assertEqual(response.json["data"]["name"], "replica meal")
+            self.assertEqual(metrics.get("replicas.replica_reads"), reads + 2)
+
+            response = self.put(path + "/1", {"name": "primary meal"}, headers)
+            self.assertEqual(response.json["data"]["name"], "primary meal")
+
+    def test_read_your_writes(self):
+        """Users read from the primary right after their own writes"""
+        path = "/".join([self.path, "users", "user1", "meals"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            self.patch(path + "/1", {"grams": 120}, headers)
+
+            response = self.get(path, headers)
+            self.assertEqual(response.json["data"][0]["name"], "meal 1")
+            self.assertEqual(response.json["data"][0]["grams"], 120)
+
+            response = self.get(path, self._get_headers())
+            self.assertEqual(response.json["data"][0]["name"], "replica meal")
+            self.assertEqual(response.json["data"][0]["grams"], 100)
+
+    def test_read_batch_writes(self):
+        """Reads of an atomic batch go to the primary, where its writes are"""
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            operations = [
+                {
+                    "method": "POST",
+                    "path": "/users/user1/meals",
+                    "body": {"date": "2020-02-12", "name": "new", "calories": 100},
+                },
+                {"method": "GET", "path": "/users/user1/meals"},
+            ]
+            response = self.post(
+                "/".join([self.path, "batch"]),
+                {"operations": operations, "atomic": True},
+                headers,
+            )
+            results = response.json["data"]["results"]
+            self.assertEqual(
+                [m["name"] for m in results[1]["body"]["data"]],
+                ["meal 1", "meal 2", "new"],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
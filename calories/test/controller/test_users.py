@@ -3,6 +3,7 @@
 import unittest
 from urllib.parse import quote
 
+from calories.test import record_queries
 from calories.test.controller import TestAPI
 
 
@@ -212,6 +213,21 @@ class TestUsers(TestAPI):
                 response, 400, "Bad Request", "Filter 'wrongfilter' is invalid"
             )
 
+    def test_get_all_users_fields(self):
+        """Only the requested fields of the users are returned"""
+        path = "/".join([self.path, "users"])
+        with self.client:
+            expected = [
+                {"daily_calories": 2500, "username": "user1"},
+                {"daily_calories": 3000, "username": "user2"},
+            ]
+            response = self.get(
+                path + "?fields=username,daily_calories&filter_results="
+                + quote("role eq USER"),
+                self._get_headers(),
+            )
+            self._check_succes(expected, response, 200)
+
     def test_post_user_unauthenticated(self):
         """Unauthenticated request"""
         path = "/".join([self.path, "users"])
@@ -249,6 +265,54 @@ class TestUsers(TestAPI):
             response = self.post(path, request_data, self._get_headers())
             self._check_succes(expected, response, 201)
 
+    def test_post_user_not_reselected(self):
+        """The created user is returned without selecting it again after commit"""
+        path = "/".join([self.path, "users"])
+        with self.client:
+            request_data = {
+                "username": "user3",
+                "name": "User 3",
+                "email": "user3@users.com",
+                "role": "USER",
+                "daily_calories": 2500,
+                "password": "pass_user3",
+            }
+            headers = self._get_headers()
+            with record_queries() as statements:
+                response = self.post(path, request_data, headers)
+            self.assertEqual(response.status_code, 201)
+            inserted = [s.startswith("INSERT INTO user") for s in statements].index(True)
+            self.assertFalse(
+                any(s.startswith("SELECT") for s in statements[inserted:])
+            )
+
+    def test_post_user_idempotent(self):
+        """Requests repeated with the same key get the first response, failed ones
+        release the key"""
+        path = "/".join([self.path, "users"])
+        with self.client:
+            request_data = {
+                "username": "user3",
+                "name": "User 3",
+                "email": "user3@users.com",
+                "role": "USER",
+                "daily_calories": 2500,
+                "password": "pass_user3",
+            }
+            headers = {**self._get_headers(), "Idempotency-Key": "key-1"}
+            response = self.post(path, request_data, headers)
+            self.assertEqual(response.status_code, 201)
+            replayed = self.post(path, request_data, headers)
+            self.assertEqual(replayed.status_code, 201)
+            self.assertEqual(replayed.json, response.json)
+            self.assertEqual(replayed.headers["Idempotent-Replayed"], "true")
+
+            headers["Idempotency-Key"] = "key-2"
+            response = self.post(path, {**request_data, "username": "user1"}, headers)
+            self.assertEqual(response.status_code, 409)
+            response = self.post(path, {**request_data, "username": "user4"}, headers)
+            self.assertEqual(response.status_code, 201)
+
     def test_post_user_username_exists(self):
         """Username exists"""
         path = "/".join([self.path, "users"])
@@ -420,6 +484,90 @@ class TestUsers(TestAPI):
             )
             self._check_succes(expected, response, 200)
 
+    def test_get_all_users_sort(self):
+        """Users are sorted by the allowed orderings"""
+        path = "/".join([self.path, "users"])
+        with self.client:
+            response = self.get(
+                path + "?fields=username&sort=-daily_calories", self._get_headers()
+            )
+            self.assertEqual(
+                [u["username"] for u in response.json["data"]],
+                ["manager2", "user2", "user1", "manager1", "admin"],
+            )
+
+            response = self.get(path + "?sort=email", self._get_headers())
+            self.assertEqual(response.status_code, 400)
+
+    def test_get_all_users_cached(self):
+        """Pages of users are cached until any user is created, updated or deleted"""
+        path = "/".join([self.path, "users"])
+        with self.client:
+            headers = self._get_headers()
+            self.get(path + "?fields=username", headers)
+            with record_queries() as statements:
+                response = self.get(path + "?fields=username", headers)
+            self.assertEqual(len(response.json["data"]), 5)
+            self.assertFalse(any("ORDER BY user.username" in s for s in statements))
+
+            request_data = {
+                "username": "user3",
+                "name": "User 3",
+                "email": "user3@users.com",
+                "role": "USER",
+                "daily_calories": 2500,
+                "password": "pass_user3",
+            }
+            self.post(path, request_data, headers)
+            response = self.get(path + "?fields=username", headers)
+            self.assertEqual(len(response.json["data"]), 6)
+
+            self.put(path + "/user3", {"name": "User three"}, headers)
+            response = self.get(
+                path + "?fields=name&filter_results=" + quote("username eq user3"),
+                headers,
+            )
+            self.assertEqual(response.json["data"], [{"name": "User three"}])
+
+            self.delete(path + "/user3", headers)
+            response = self.get(path + "?fields=username", headers)
+            self.assertEqual(len(response.json["data"]), 5)
+
+    def test_put_user_role_cached(self):
+        """Permissions are checked without reading the user again until it changes"""
+        path = "/".join([self.path, "users"])
+        with self.client:
+            headers = self._get_headers("user1", "pass_user1")
+            self.assertEqual(self.get(path, headers).status_code, 403)
+            with record_queries() as statements:
+                self.assertEqual(self.get(path, headers).status_code, 403)
+            self.assertEqual(statements, [])
+
+            self.put(path + "/user1", {"role": "MANAGER"}, self._get_headers())
+            self.assertEqual(self.get(path, headers).status_code, 200)
+
+    def test_get_user_etag(self):
+        """Users are answered with a 304 until they change"""
+        path = "/".join([self.path, "users", "user1"])
+        with self.client:
+            headers = self._get_headers()
+            etag = self.get(path, headers).headers["ETag"]
+            response = self.get(path, {**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+
+            self.put(path, {"daily_calories": 2000}, headers)
+            response = self.get(path, {**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json["data"]["daily_calories"], 2000)
+
+    def test_get_user_fields(self):
+        """Only the requested fields of the user are returned"""
+        path = "/".join([self.path, "users", "user1"])
+        with self.client:
+            expected = {"role": "USER", "username": "user1"}
+            response = self.get(path + "?fields=username,role", self._get_headers())
+            self._check_succes(expected, response, 200)
+
     def test_get_user_error_not_found(self):
         """Error getting non existing user"""
         path = "/".join([self.path, "users"])
@@ -499,6 +647,17 @@ class TestUsers(TestAPI):
             )
             self._check_succes(expected, response, 200)
 
+    def test_put_user_not_reselected(self):
+        """The updated user is returned without selecting it again after commit"""
+        path = "/".join([self.path, "users", "user1"])
+        with self.client:
+            headers = self._get_headers()
+            with record_queries() as statements:
+                response = self.put(path, {"name": "User 1A"}, headers)
+            self.assertEqual(response.json["data"]["name"], "User 1A")
+            updated = [s.startswith("UPDATE user") for s in statements].index(True)
+            self.assertFalse(any(s.startswith("SELECT") for s in statements[updated:]))
+
     def test_put_user_non_existing(self):
         """Error getting non existing user"""
         path = "/".join([self.path, "users"])
@@ -0,0 +1,62 @@
+"""Test module for calories.main.build_database"""
+import unittest
+
+from sqlalchemy import inspect
+
+from calories.main import db
+from calories.main.build_database import migrate_indexes
+from calories.test import BaseTestCase
+
+
+class TestBuildDatabase(BaseTestCase):
+    """Test class for calories.main.build_database"""
+
+    def test_migrate_indexes(self):
+        """Missing tables, columns, indexes and full-text search are added keeping
+        the data"""
+        for statement in [
+            'ALTER TABLE "user" DROP COLUMN data_version',
+            "DROP INDEX ix_meal_user_id_date_time_id",
+            "DROP INDEX ix_meal_user_id_date_over_limit",
+            "DROP TABLE meal_fts",
+            "DROP TRIGGER meal_fts_insert",
+            "DROP TABLE daily_rollup",
+        ]:
+            db.session.execute(statement)
+        db.session.commit()
+
+        self.assertEqual(
+            migrate_indexes(),
+            ["ix_meal_user_id_date_over_limit", "ix_meal_user_id_date_time_id"],
+        )
+        self.assertEqual(migrate_indexes(), [])
+
+        inspector = inspect(db.engine)
+        self.assertIn("daily_rollup", inspector.get_table_names())
+        self.assertEqual(
+            db.session.execute('SELECT DISTINCT data_version FROM "user"').fetchall(),
+            [(0,)],
+        )
+        self.assertEqual(
+            db.session.execute("SELECT count(*) FROM meal").scalar(), 3
+        )
+        matches = db.session.execute(
+            "SELECT rowid FROM meal_fts WHERE meal_fts MATCH 'cheese'"
+        ).fetchall()
+        self.assertEqual(matches, [(3,)])
+
+    def test_over_limit_index(self):
+        """Days over the limit can be looked up from the partial index, SQLite
+        fails to prepare the query otherwise"""
+        plan = db.session.execute(
+            "EXPLAIN QUERY PLAN SELECT meal.date FROM meal"
+            " INDEXED BY ix_meal_user_id_date_over_limit"
+            " WHERE meal.user_id = 1 AND meal.under_daily_total = 0"
+        ).fetchall()
+        self.assertIn(
+            "ix_meal_user_id_date_over_limit", " ".join(row[-1] for row in plan)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Test module for calories.main.util.encoding"""
+
+import gzip
+import json
+import unittest
+from datetime import date, datetime, time
+from decimal import Decimal
+from unittest.mock import patch
+
+from connexion.apis.flask_api import FlaskApi
+
+from calories.main.models.models import Role
+from calories.main.util import encoding
+from calories.main.util.encoding import OrjsonProvider
+from calories.test.controller import TestAPI
+
+
+@unittest.skipIf(encoding.orjson is None, "orjson is not installed")
+class TestOrjsonProvider(unittest.TestCase):
+    """Test class for calories.main.util.encoding.OrjsonProvider"""
+
+    def test_dumps(self):
+        """Dates, times, enums and decimals are encoded as connexion does"""
+        data = {
+            "role": Role.MANAGER,
+            "date": date(2020, 2, 11),
+            "time": time(15, 0, 3),
+            "datetime": datetime(2020, 2, 11, 15, 0, 3),
+            "calories": Decimal("2.5"),
+        }
+        self.assertEqual(
+            OrjsonProvider.dumps(data),
+            '{"calories":2.5,"date":"2020-02-11","datetime":"2020-02-11T15:00:03Z",'
+            '"role":"MANAGER","time":"15:00:03"}',
+        )
+
+    def test_loads(self):
+        """Encoded data can be decoded back"""
+        self.assertEqual(OrjsonProvider.loads('{"a": [1, null]}'), {"a": [1, None]})
+
+
+class TestMissingLibraries(unittest.TestCase):
+    """Test class for the fallbacks of calories.main.util.encoding"""
+
+    def test_orjson_missing(self):
+        """The json module is used, with a warning through the logger of the app"""
+        with patch.object(encoding, "orjson", None), self.assertLogs(
+                "calories.main", "WARNING"
+        ) as logs:
+            self.assertIs(encoding.get_api_cls("orjson"), FlaskApi)
+        self.assertIn("orjson is not installed", logs.output[0])
+
+    def test_brotli_missing(self):
+        """Compressing without brotli is warned about only if compression is enabled"""
+        with patch.object(encoding, "brotli", None), self.assertLogs(
+                "calories.main", "WARNING"
+        ) as logs:
+            encoding.check_compression(False)
+            encoding.check_compression(True)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("brotli is not installed", logs.output[0])
+
+
+class TestCompression(TestAPI):
+    """Test class for calories.main.util.encoding.compress_response"""
+
+    def setUp(self):
+        super().setUp()
+        self.app.config["COMPRESSION_MIN_SIZE"] = 0
+        self.users_path = "/".join([self.path, "users"])
+
+    def test_gzip(self):
+        """Responses are compressed with gzip when the client accepts it"""
+        with self.client:
+            headers = {**self._get_headers(), "Accept-Encoding": "gzip"}
+            response = self.get(self.users_path, headers)
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+            self.assertIn("Accept-Encoding", response.headers["Vary"])
+            data = json.loads(gzip.decompress(response.data))
+            self.assertEqual(len(data["data"]), 5)
+
+    def test_strong_etag(self):
+        """Strong ETags of compressed responses get the encoding appended"""
+        path = "/".join([self.users_path, "user1", "days", "2020-02-11"])
+        with self.client:
+            headers = {**self._get_headers(), "Accept-Encoding": "gzip"}
+            etag = self.get(path, headers).headers["ETag"]
+            self.assertTrue(etag.endswith('-gzip"'))
+            response = self.get(path, {**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["ETag"], etag)
+
+    @unittest.skipIf(encoding.brotli is None, "brotli is not installed")
+    def test_brotli_preferred(self):
+        """Brotli is used when the client accepts it as much as gzip"""
+        with self.client:
+            headers = {**self._get_headers(), "Accept-Encoding": "gzip, br"}
+            response = self.get(self.users_path, headers)
+            self.assertEqual(response.headers["Content-Encoding"], "br")
+            data = json.loads(encoding.brotli.decompress(response.data))
+            self.assertEqual(len(data["data"]), 5)
+
+    def test_not_accepted(self):
+        """Responses are not compressed if the client does not accept it"""
+        with self.client:
+            headers = {**self._get_headers(), "Accept-Encoding": "gzip;q=0"}
+            response = self.get(self.users_path, headers)
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertEqual(len(response.json["data"]), 5)
+
+    def test_below_threshold(self):
+        """Small responses are not compressed"""
+        self.app.config["COMPRESSION_MIN_SIZE"] = 1024 * 1024
+        with self.client:
+            headers = {**self._get_headers(), "Accept-Encoding": "gzip"}
+            response = self.get(self.users_path, headers)
+            self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_disabled(self):
+        """Responses are not compressed if compression is disabled"""
+        self.app.config["COMPRESSION"] = False
+        with self.client:
+            headers = {**self._get_headers(), "Accept-Encoding": "gzip"}
+            response = self.get(self.users_path, headers)
+            self.assertNotIn("Content-Encoding", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
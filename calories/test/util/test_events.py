@@ -0,0 +1,51 @@
+"""Test module for calories.main.util.events"""
+
+import os
+import tempfile
+import unittest
+
+from calories.main.util.events import LocalBroker, SocketBroker
+
+
+class TestEvents(unittest.TestCase):
+    """Test class for calories.main.util.events"""
+
+    def test_local_broker(self):
+        """Subscribers are woken up once by the notifications of their topic"""
+        broker = LocalBroker()
+        subscription = broker.subscribe("1")
+        other = broker.subscribe("2")
+        broker.publish("1")
+        broker.publish("1")
+        self.assertTrue(subscription.wait(1))
+        self.assertFalse(subscription.wait(0.01))
+        self.assertFalse(other.wait(0.01))
+
+        subscription.close()
+        other.close()
+        broker.publish("1")
+        self.assertFalse(subscription.wait(0.01))
+
+    def test_socket_broker(self):
+        """Notifications reach the subscribers of the other brokers on the directory,
+        and sockets left by processes that are gone are removed"""
+        with tempfile.TemporaryDirectory() as directory:
+            subscriber = SocketBroker(directory)
+            subscription = subscriber.subscribe("1")
+            gone = os.path.join(directory, "0.sock")
+            open(gone, "w").close()
+
+            publisher = SocketBroker(directory)
+            publisher.publish("1")
+            self.assertTrue(subscription.wait(5))
+            self.assertFalse(os.path.exists(gone))
+            subscription.close()
+
+    def test_socket_broker_no_directory(self):
+        """Publishing without subscribers anywhere does nothing"""
+        with tempfile.TemporaryDirectory() as directory:
+            SocketBroker(os.path.join(directory, "events")).publish("1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Test module for calories.main.util.lru"""
+
+import unittest
+
+from calories.main.util import metrics
+from calories.main.util.lru import LRUCache, clear_caches, sizeof
+
+
+class TestLRUCache(unittest.TestCase):
+    """Test class for calories.main.util.lru"""
+
+    def test_get_or_set(self):
+        """Values are loaded once per key and hits and misses are counted"""
+        cache = LRUCache("test_get_or_set", 10, 10000)
+        loads = []
+        for key in ["a", "a", "b", "a"]:
+            value = cache.get_or_set(key, lambda: loads.append(key) or key.upper())
+            self.assertEqual(value, key.upper())
+        self.assertEqual(loads, ["a", "b"])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertEqual(cache.hit_ratio, 0.5)
+        self.assertEqual(metrics.get("cache.test_get_or_set.hits"), 2)
+        self.assertEqual(metrics.get("cache.test_get_or_set.misses"), 2)
+
+    def test_max_entries(self):
+        """The least recently used entry is evicted first"""
+        cache = LRUCache("test_max_entries", 2, 10000)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get_or_set("a", lambda: None)
+        cache.set("c", 3)
+        self.assertEqual(cache.get_or_set("b", lambda: "loaded"), "loaded")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(metrics.get("cache.test_max_entries.evictions"), 2)
+
+    def test_max_bytes(self):
+        """Entries are evicted to stay within the memory bound"""
+        value = [{"name": "x" * 100}]
+        cache = LRUCache("test_max_bytes", 10, sizeof(value) * 2)
+        for key in range(3):
+            cache.set(key, value)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.size, sizeof(value) * 2)
+
+        cache.set("big", value * 10)
+        self.assertEqual(len(cache), 2)
+
+    def test_errors_not_cached(self):
+        """Nothing is stored when loading fails"""
+        cache = LRUCache("test_errors_not_cached", 10, 10000)
+        with self.assertRaises(ValueError):
+            cache.get_or_set("a", lambda: int("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_clear_caches(self):
+        """Every cache can be cleared at once"""
+        caches = [LRUCache("test_clear_caches", 10, 10000) for _ in range(2)]
+        for cache in caches:
+            cache.set("a", 1)
+        clear_caches()
+        self.assertEqual([len(c) for c in caches], [0, 0])
+        self.assertEqual([c.size for c in caches], [0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
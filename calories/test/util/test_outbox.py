@@ -0,0 +1,115 @@
+"""Test module for calories.main.util.outbox"""
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from calories.main.util.outbox import (
+    FileSink,
+    SinkError,
+    get_backlog,
+    get_offset,
+    get_sink,
+    relay_outbox,
+)
+from calories.test.controller import TestAPI
+
+
+class _FailingSink:
+    name = "failing"
+
+    def send(self, events):
+        raise SinkError("Sink down")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.received.extend(json.loads(line) for line in body.decode().splitlines())
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestOutbox(TestAPI):
+    """Test class for calories.main.util.outbox"""
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.dir.cleanup()
+
+    def _write(self):
+        path = "/".join([self.path, "users"])
+        with self.client:
+            headers = self._get_headers()
+            self.put(path + "/user1", {"name": "User 1A"}, headers)
+            self.delete(path + "/user1/meals/2", headers)
+
+    def test_relay_file(self):
+        """Writes append an event each that is relayed once acknowledged"""
+        self._write()
+        self.assertEqual(get_backlog(), 2)
+
+        sink = get_sink("file://" + os.path.join(self.dir.name, "outbox.ndjson"))
+        self.assertIsInstance(sink, FileSink)
+        self.assertEqual(relay_outbox(sink, batch_size=1), 1)
+        self.assertEqual(relay_outbox(sink, batch_size=1), 1)
+        self.assertEqual(relay_outbox(sink), 0)
+        self.assertEqual(get_backlog(), 0)
+
+        with open(sink.path) as file:
+            events = [json.loads(line) for line in file]
+        self.assertEqual([e["topic"] for e in events], ["users", "meals"])
+        self.assertLess(events[0]["id"], events[1]["id"])
+        self.assertEqual(
+            events[0]["data"], {"user_id": 2, "username": "user1", "action": "update"}
+        )
+        self.assertEqual(events[1]["data"]["dates"], ["2020-02-11"])
+        self.assertEqual(events[1]["data"]["deleted"], [2])
+
+        offset = get_offset()
+        self.assertEqual(offset.sink, sink.name)
+        self.assertEqual((offset.position, offset.delivered), (events[1]["id"], 2))
+
+    def test_relay_failed(self):
+        """Events are kept until a sink acknowledges them"""
+        self._write()
+        with self.assertRaises(SinkError):
+            relay_outbox(_FailingSink())
+        self.assertEqual(get_backlog(), 2)
+        self.assertIsNone(get_offset())
+
+        server = HTTPServer(("127.0.0.1", 0), _Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            sink = get_sink(f"http://127.0.0.1:{server.server_port}/events")
+            self.assertEqual(relay_outbox(sink), 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([e["topic"] for e in _Handler.received], ["users", "meals"])
+        offset = get_offset()
+        self.assertEqual(offset.sink, sink.name)
+        self.assertEqual(
+            (offset.position, offset.delivered), (_Handler.received[1]["id"], 2)
+        )
+
+    def test_unknown_sink(self):
+        """Only file and HTTP sinks are supported"""
+        with self.assertRaises(ValueError):
+            get_sink("kafka://localhost")
+
+
+if __name__ == "__main__":
+    unittest.main()
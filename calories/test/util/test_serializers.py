@@ -0,0 +1,47 @@
+"""Test module for calories.main.util.serializers"""
+
+import unittest
+
+from flask import json
+
+from calories.main.models.models import Meal, MealSchema, User, UserSchema
+from calories.main.util.serializers import RowSerializer
+from calories.test import BaseTestCase
+
+
+class TestSerializers(BaseTestCase):
+    """Test class for calories.main.util.serializers"""
+
+    def test_meals_same_as_schema(self):
+        """Meal rows are encoded exactly as the output of MealSchema"""
+        serializer = RowSerializer(Meal, exclude=["user_id"])
+        meals = Meal.query.order_by(Meal.id).all()
+        meals[0].time = None
+        rows = Meal.query.with_entities(*serializer.columns).order_by(Meal.id)
+        self.assertEqual(
+            json.dumps(MealSchema(many=True, exclude=["user"]).dump(meals)),
+            json.dumps(serializer.dump(rows)),
+        )
+
+    def test_users_same_as_schema(self):
+        """User rows are encoded exactly as the output of UserSchema"""
+        serializer = RowSerializer(User, exclude=("id", "_password"))
+        users = User.query.order_by(User.username).all()
+        rows = User.query.with_entities(*serializer.columns).order_by(User.username)
+        self.assertEqual(
+            json.dumps(
+                UserSchema(many=True, exclude=("id", "_password", "meals")).dump(users)
+            ),
+            json.dumps(serializer.dump(rows)),
+        )
+
+    def test_fields(self):
+        """Excluded attributes are not serialized"""
+        serializer = RowSerializer(User, exclude=("id", "_password", "data_version"))
+        self.assertEqual(
+            serializer.fields, ("username", "name", "email", "role", "daily_calories")
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
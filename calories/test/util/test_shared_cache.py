@@ -0,0 +1,85 @@
+"""Test module for calories.main.util.shared_cache"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+from calories.main.util.shared_cache import SharedCache
+
+
+def _set_in_child(path: str) -> None:
+    cache = SharedCache("test", path, 16)
+    value, generation = cache.lookup("user1")
+    cache.set("user1", {"role": "USER"}, generation)
+
+
+class TestSharedCache(unittest.TestCase):
+    """Test class for calories.main.util.shared_cache"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "cache")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_lookup_set(self):
+        """Values are found after being stored and only for their own key"""
+        cache = SharedCache("test", self.path, 16)
+        value, generation = cache.lookup("user1")
+        self.assertIsNone(value)
+        cache.set("user1", [1, "USER", 2500], generation)
+        self.assertEqual(cache.lookup("user1"), ([1, "USER", 2500], generation))
+        self.assertIsNone(cache.lookup("user2")[0])
+
+    def test_delete(self):
+        """Values read before a key is deleted are not stored after it"""
+        cache = SharedCache("test", self.path, 16)
+        _, generation = cache.lookup("user1")
+        cache.set("user1", 1, generation)
+        cache.delete("user1")
+        value, new_generation = cache.lookup("user1")
+        self.assertIsNone(value)
+        self.assertGreater(new_generation, generation)
+
+        cache.set("user1", 1, generation)
+        self.assertIsNone(cache.lookup("user1")[0])
+        cache.set("user1", 2, new_generation)
+        self.assertEqual(cache.lookup("user1")[0], 2)
+
+        cache.clear()
+        self.assertIsNone(cache.lookup("user1")[0])
+
+    def test_limits(self):
+        """Values too big for a slot are not stored and entries expire"""
+        cache = SharedCache("test", self.path, 16, slot_size=64, ttl=0.05)
+        cache.set("user1", "x" * 64, cache.lookup("user1")[1])
+        self.assertIsNone(cache.lookup("user1")[0])
+
+        cache.set("user1", "x", cache.lookup("user1")[1])
+        self.assertEqual(cache.lookup("user1")[0], "x")
+        time.sleep(0.1)
+        self.assertIsNone(cache.lookup("user1")[0])
+
+    def test_disabled(self):
+        """Nothing is stored without slots"""
+        cache = SharedCache("test", self.path, 0)
+        cache.set("user1", 1, cache.lookup("user1")[1])
+        self.assertIsNone(cache.lookup("user1")[0])
+
+    def test_processes(self):
+        """Values are shared with other processes"""
+        cache = SharedCache("test", self.path, 16)
+        self.assertIsNone(cache.lookup("user1")[0])
+        process = multiprocessing.get_context("spawn").Process(
+            target=_set_in_child, args=(self.path,)
+        )
+        process.start()
+        process.join()
+        self.assertEqual(cache.lookup("user1")[0], {"role": "USER"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+"""Test module for calories.main.util.sorting"""
+
+import unittest
+
+from sqlalchemy import column
+
+from calories.main.util.sorting import get_ordering
+
+ORDERINGS = {"date,time": (column("date"), column("time"), column("id"))}
+
+
+class TestSorting(unittest.TestCase):
+    """Test class for calories.main.util.sorting"""
+
+    def test_ascending_descending(self):
+        """The direction applies to every column, including the tiebreaker"""
+        self.assertEqual(
+            [str(c) for c in get_ordering(ORDERINGS, "date, time")],
+            ["date ASC", "time ASC", "id ASC"],
+        )
+        self.assertEqual(
+            [str(c) for c in get_ordering(ORDERINGS, "-date,-time")],
+            ["date DESC", "time DESC", "id DESC"],
+        )
+
+    def test_not_allowed(self):
+        """Unknown orderings and mixed directions are rejected"""
+        with self.assertRaisesRegex(ValueError, "use one of: 'date,time'"):
+            get_ordering(ORDERINGS, "time,date")
+        with self.assertRaisesRegex(ValueError, "mixes ascending and descending"):
+            get_ordering(ORDERINGS, "date,-time")
+
+
+if __name__ == "__main__":
+    unittest.main()
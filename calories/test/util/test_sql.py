@@ -0,0 +1,28 @@
+"""Test module for calories.main.util.sql"""
+
+import unittest
+
+from calories.main.util.sql import _CSVFile, batches
+
+
+class TestSQL(unittest.TestCase):
+    """Test class for calories.main.util.sql"""
+
+    def test_batches(self):
+        """Items are split in lists of the given size"""
+        self.assertEqual(list(batches(iter(range(5)), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batches([], 2)), [])
+
+    def test_csv_file(self):
+        """Rows are written as CSV as the file is read, in chunks of any size"""
+        rows = [(1, "meal, 1", None), (2, "b", 3)]
+        expected = '1,"meal, 1",\n2,b,3\n'
+        self.assertEqual(_CSVFile(rows).read(), expected)
+
+        file = _CSVFile(iter(rows))
+        chunks = iter(lambda: file.read(4), "")
+        self.assertEqual(list(chunks), [expected[i:i + 4] for i in range(0, len(expected), 4)])
+
+
+if __name__ == "__main__":
+    unittest.main()
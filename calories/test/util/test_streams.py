@@ -0,0 +1,57 @@
+"""Test module for calories.main.util.streams"""
+
+import unittest
+
+from calories.main.util.streams import ParseError, read_rows, write_rows
+
+ROWS = [{"id": 1, "name": "meal, 1"}, {"id": 2, "name": None}, {"id": 3, "name": "c"}]
+
+
+class TestStreams(unittest.TestCase):
+    """Test class for calories.main.util.streams"""
+
+    def test_ndjson_chunks(self):
+        """NDJSON documents are written in chunks of batch_size rows"""
+        chunks = list(write_rows(iter(ROWS), ["id", "name"], "ndjson", 2))
+        self.assertEqual(
+            chunks,
+            [
+                '{"id": 1, "name": "meal, 1"}\n{"id": 2, "name": null}\n',
+                '{"id": 3, "name": "c"}\n',
+            ],
+        )
+
+    def test_csv_chunks(self):
+        """CSV documents start with a header and are written in chunks"""
+        chunks = list(write_rows(iter(ROWS), ["id", "name"], "csv", 2))
+        self.assertEqual(chunks, ['id,name\n1,"meal, 1"\n2,\n', "3,c\n"])
+
+    def test_empty(self):
+        """An empty CSV document only contains the header"""
+        self.assertEqual("".join(write_rows([], ["id"], "csv", 2)), "id\n")
+        self.assertEqual("".join(write_rows([], ["id"], "ndjson", 2)), "")
+
+    def test_read_round_trip(self):
+        """Written documents are read back, empty CSV values are left out"""
+        for format in ("ndjson", "csv"):
+            document = "".join(write_rows(ROWS, ["id", "name"], format, 2))
+            rows = [row for _, row in read_rows(document.splitlines(), format)]
+            if format == "csv":
+                self.assertEqual(
+                    rows, [{"id": "1", "name": "meal, 1"}, {"id": "2"}, {"id": "3", "name": "c"}]
+                )
+            else:
+                self.assertEqual(rows, ROWS)
+
+    def test_read_wrong_lines(self):
+        """Wrong lines are reported with their line number"""
+        with self.assertRaisesRegex(ParseError, "Line 3: Rows must be JSON objects"):
+            list(read_rows(['{"id": 1}', "", "[1]"], "ndjson"))
+        with self.assertRaisesRegex(ParseError, "Line 2: Invalid JSON"):
+            list(read_rows(['{"id": 1}', "{"], "ndjson"))
+        with self.assertRaisesRegex(ParseError, "Line 3: Wrong number of values"):
+            list(read_rows(["id,name", "1,a", "2,b,c"], "csv"))
+
+
+if __name__ == "__main__":
+    unittest.main()
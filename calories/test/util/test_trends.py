@@ -0,0 +1,70 @@
+"""Test module for calories.main.util.trends"""
+
+import datetime
+import unittest
+
+import numpy as np
+
+from calories.main.util import trends
+
+
+class TestTrends(unittest.TestCase):
+    """Test class for calories.main.util.trends"""
+
+    def test_daily_series(self):
+        """Days without meals are filled with zeros"""
+        days, calories, logged = trends.daily_series(
+            [datetime.date(2020, 2, 11), datetime.date(2020, 2, 13)],
+            [100, 300],
+            datetime.date(2020, 2, 10),
+            datetime.date(2020, 2, 13),
+        )
+        self.assertEqual(
+            np.datetime_as_string(days).tolist(),
+            ["2020-02-10", "2020-02-11", "2020-02-12", "2020-02-13"],
+        )
+        self.assertEqual(calories.tolist(), [0, 100, 0, 300])
+        self.assertEqual(logged.tolist(), [False, True, False, True])
+
+    def test_rolling_average(self):
+        """Windows are averaged over their days with meals only"""
+        calories = np.array([0, 100, 0, 300, 500])
+        logged = np.array([False, True, False, True, True])
+        self.assertEqual(
+            trends.to_list(trends.rolling_average(calories, logged, 2)),
+            [None, 100.0, 100.0, 300.0, 400.0],
+        )
+
+    def test_longest_streak(self):
+        """The first of the longest runs is returned"""
+        under = np.array([True, False, True, True, False, True, True])
+        self.assertEqual(trends.longest_streak(under), (2, 3))
+        self.assertEqual(trends.longest_streak(np.array([True, True])), (0, 1))
+        self.assertIsNone(trends.longest_streak(np.zeros(3, dtype=bool)))
+
+    def test_weekday_profile(self):
+        """Days are grouped by day of the week starting on Monday"""
+        days, calories, logged = trends.daily_series(
+            [datetime.date(2020, 2, 10), datetime.date(2020, 2, 17)],
+            [100, 200],
+            datetime.date(2020, 2, 10),
+            datetime.date(2020, 2, 17),
+        )
+        profile = trends.weekday_profile(days, calories, logged)
+        self.assertEqual(profile[0], {"day": "Monday", "average": 150.0, "days": 2})
+        self.assertEqual(profile[6], {"day": "Sunday", "average": None, "days": 0})
+
+    def test_long_history(self):
+        """Ten years of daily totals are handled without loops over the days"""
+        start = datetime.date(2010, 1, 1)
+        dates = [start + datetime.timedelta(days=i) for i in range(3653)]
+        days, calories, logged = trends.daily_series(
+            dates, np.full(len(dates), 2000), start, dates[-1]
+        )
+        averages = trends.rolling_average(calories, logged, 30)
+        self.assertTrue(np.all(averages == 2000))
+        self.assertEqual(trends.longest_streak(calories < 2500), (0, 3652))
+
+
+if __name__ == "__main__":
+    unittest.main()
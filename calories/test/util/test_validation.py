@@ -0,0 +1,81 @@
+"""Test module for calories.main.util.validation"""
+
+import json
+import unittest
+from unittest.mock import Mock, patch
+
+from connexion.exceptions import NonConformingResponseBody
+
+from calories.main.util import metrics
+from calories.main.util.validation import SampledResponseValidator
+from calories.test import BaseTestCase
+
+SCHEMA = {
+    "type": "object",
+    "properties": {"status": {"type": "integer"}},
+    "required": ["status"],
+}
+
+
+class TestValidation(BaseTestCase):
+    """Test class for calories.main.util.validation"""
+
+    def setUp(self):
+        super().setUp()
+        operation = Mock()
+        operation.response_schema.return_value = SCHEMA
+        operation.response_definition.return_value = {}
+        operation.json_loads.side_effect = json.loads
+        self.validator = SampledResponseValidator(operation, "application/json")
+
+    def test_always_raises(self):
+        """Violations raise an error when every response is validated"""
+        self.app.config["RESPONSE_VALIDATION"] = "always"
+        self.assertTrue(self.validator.validate_response('{"status": 200}', 200, {}, ""))
+        with self.assertRaises(NonConformingResponseBody):
+            self.validator.validate_response('{"status": "OK"}', 200, {}, "")
+
+    def test_sampled_logs_and_counts(self):
+        """Violations are counted but do not raise when sampling responses"""
+        self.app.config["RESPONSE_VALIDATION"] = "sampled"
+        violations = metrics.get("response_validation.violations")
+        self.assertFalse(self.validator.validate_response("{}", 200, {}, ""))
+        self.assertEqual(
+            metrics.get("response_validation.violations"), violations + 1
+        )
+
+    def test_validator_compiled_once(self):
+        """Schema validators are compiled once and reused"""
+        self.app.config["RESPONSE_VALIDATION"] = "always"
+        with patch(
+                "calories.main.util.validation.ResponseBodyValidator"
+        ) as body_validator:
+            for _ in range(3):
+                self.validator.validate_response('{"status": 200}', 200, {}, "")
+                self.validator.validate_response('{"status": 404}', 404, {}, "")
+        self.assertEqual(body_validator.call_count, 2)
+
+    def test_sampling_rate(self):
+        """Only the sampled fraction of the responses is validated"""
+        function = Mock(return_value="response")
+        wrapper = self.validator(function)
+        self.app.config["RESPONSE_VALIDATION"] = "sampled"
+        self.app.config["RESPONSE_VALIDATION_RATE"] = 0.0
+        validated = metrics.get("response_validation.validated")
+        with patch.object(self.validator, "validate_response") as validate:
+            self.assertEqual(wrapper(Mock()), "response")
+            validate.assert_not_called()
+            self.app.config["RESPONSE_VALIDATION"] = "off"
+            self.app.config["RESPONSE_VALIDATION_RATE"] = 1.0
+            wrapper(Mock())
+            validate.assert_not_called()
+            self.app.config["RESPONSE_VALIDATION"] = "sampled"
+            wrapper(Mock())
+            validate.assert_called_once()
+        self.assertEqual(
+            metrics.get("response_validation.validated"), validated + 1
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,8 @@
+import os
+import timeit
 import unittest
+from datetime import date, time
+from time import sleep
 
 from flask_script import Manager
 
@@ -21,6 +25,13 @@ def build_db():
     build_database.build_db()
 
 
+@manager.command
+def migrate_indexes():
+    """Add the missing tables and indexes to an existing database"""
+    created = build_database.migrate_indexes()
+    print(f"{len(created)} indexes created: {', '.join(created) or '-'}")
+
+
 @manager.command
 def run():
     """Run the app"""
@@ -30,6 +41,129 @@ def run():
         connex_app.run(port=cfg.PORT)
 
 
+@manager.option("-r", "--rows", dest="rows", type=int, default=500)
+def bench_serializers(rows):
+    """Compare the per row cost of MealSchema and the fast meal serializer"""
+    from calories.main.controller.helpers.meals import meal_schema, meals_serializer
+    from calories.main.models.models import Meal
+
+    meals = [
+        Meal(
+            id=i,
+            date=date(2020, 2, 11),
+            time=time(15, 0, 3),
+            name=f"meal {i}",
+            grams=100,
+            description=f"Meal {i}",
+            calories=500,
+            under_daily_total=True,
+        )
+        for i in range(rows)
+    ]
+    tuples = [
+        tuple(getattr(meal, field) for field in meals_serializer.fields)
+        for meal in meals
+    ]
+    assert meal_schema.dump(meals, many=True) == meals_serializer.dump(tuples)
+
+    for name, dump in [
+        ("MealSchema", lambda: meal_schema.dump(meals, many=True)),
+        ("RowSerializer", lambda: meals_serializer.dump(tuples)),
+    ]:
+        number, seconds = timeit.Timer(dump).autorange()
+        print(f"{name}: {seconds / number / rows * 1e6:.2f} us/row")
+
+
+@manager.option("-u", "--username", dest="username", required=True)
+@manager.option("-f", "--file", dest="path", required=True)
+@manager.option("-b", "--batch-size", dest="batch_size", type=int, default=1000)
+def import_meals(username, path, batch_size):
+    """Import meals for a user from a .ndjson or .csv file"""
+    from calories.main.controller.helpers import RequestError
+    from calories.main.controller.helpers.meals import imprt_meals
+
+    format = os.path.splitext(path)[1].lstrip(".")
+    if format not in ("ndjson", "csv"):
+        print(f"Unknown format: '{format}', use a .ndjson or .csv file")
+        return 1
+
+    with open(path, newline="", encoding="utf-8") as lines:
+        try:
+            count = imprt_meals(username, lines, format, batch_size)
+        except RequestError as e:
+            print(e.message)
+            return 1
+
+    print(f"{count} meals imported for user: '{username}'")
+    return 0
+
+
+@manager.option("-i", "--interval", dest="interval", type=int, default=0)
+@manager.option("--full", dest="full", action="store_true", default=False)
+def refresh_rollups(interval, full):
+    """Refresh the daily rollups of the analytics, every interval seconds if given"""
+    from calories.main.controller.helpers.analytics import refresh_rollups
+
+    while True:
+        print(f"{refresh_rollups(full)} days refreshed")
+        if not interval:
+            return 0
+        full = False
+        sleep(interval)
+
+
+@manager.option("-s", "--sink", dest="url", default=cfg.OUTBOX_SINK)
+@manager.option("-b", "--batch-size", dest="batch_size", type=int, default=cfg.OUTBOX_BATCH_SIZE)
+@manager.option("-i", "--interval", dest="interval", type=float, default=0)
+def relay_outbox(url, batch_size, interval):
+    """Relay the events of the outbox to a file:// or http:// sink, polling it every
+    interval seconds if given, until it is empty otherwise"""
+    from calories.main.util.outbox import (
+        SinkError,
+        get_backlog,
+        get_offset,
+        get_sink,
+        relay_outbox,
+    )
+
+    try:
+        sink = get_sink(url)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    while True:
+        try:
+            count = relay_outbox(sink, batch_size)
+        except SinkError as e:
+            print(e)
+            if not interval:
+                return 1
+            count = 0
+        if count:
+            offset = get_offset()
+            print(
+                f"{count} events relayed to '{sink.name}' up to event {offset.position}"
+                f" ({offset.delivered} in total), {get_backlog()} left"
+            )
+        elif not interval:
+            return 0
+        else:
+            sleep(interval)
+
+
+@manager.option("-i", "--interval", dest="interval", type=int, default=0)
+def purge_idempotency_keys(interval):
+    """Remove the expired idempotency keys, every interval seconds if given"""
+    from calories.main.controller.helpers.idempotency import purge_keys
+
+    while True:
+        print(f"{purge_keys()} idempotency keys removed")
+        if not interval:
+            return 0
+        sleep(interval)
+
+
 @manager.command
 def test():
     """Run the unit tests."""